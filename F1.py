@@ -1,5 +1,7 @@
 import polars as pl
+from profiling import profile_cli, timed
 
+@timed('F1')
 def main(pred_path: str, truth_path: str, output_path: str) -> None:
     pred_df = pl.read_csv(pred_path).select(['article_id', 'dataset_id', 'type'])
     truth_df = pl.read_csv(truth_path).select(['article_id', 'dataset_id', 'type']).filter(pl.col('type') != 'Missing')
@@ -63,7 +65,9 @@ def main(pred_path: str, truth_path: str, output_path: str) -> None:
     final_df.write_csv(output_path)
 
 if __name__ == '__main__':
-    pred_path = './temp/submission_xml_5.csv'
+    profile_cli()
+    # getid_xml_5 over parse_combine, the latest extraction; the mdc F1 stage scores the same file
+    pred_path = './temp/submission_xml_combine.csv'
     truth_path = './data/train_labels.csv'  # Assume this is the path to the ground truth CSV; adjust as needed
     output_path = './temp/F1_details_xml.csv'
     main(pred_path, truth_path, output_path)
\ No newline at end of file
@@ -0,0 +1,212 @@
+import argparse
+import importlib
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import helpers
+from helpers import *
+from post_filter import remove_extra_digit
+
+"""
+Benchmarks for the extraction hot paths: python benchmarks/bench.py --sizes 100 500 2000
+- The corpus (--input-dir) is cut or repeated to every --sizes article count and written as raw-text Parquet
+- Every (benchmark, size) runs in its own python process, so peak RSS is that benchmark's alone;
+  rss_setup_mb is the peak after building the inputs, rss_peak_mb after the timed runs
+- ops/sec is calls of the benchmarked function per second (best of --repeat), items/sec scales it by the
+  rows it processes (articles, or candidates for the post-extraction steps)
+- Results go to benchmarks/results/<commit>.json; compare two runs with benchmarks/compare.py
+- Without data/train_labels.csv, evaluate runs against labels made from the extracted candidates
+- For larger corpora generate one with benchmarks/synth_corpus.py and pass
+  --input-dir temp/synth --labels temp/synth/train_labels.csv
+"""
+
+l = get_logger()
+
+VARIANTS = ['getid', 'getid_xml', 'getid_xml_3', 'getid_xml_5']
+
+def variant_text(corpus, module):
+    """The text tidy_extraction of this variant scans, as its main() builds it."""
+    df = get_df(corpus)
+    if hasattr(module, 'preprocess_text'):
+        return df.with_columns(pl.col('text').map_elements(module.preprocess_text, return_dtype=pl.String))
+    return module.get_splits(df)
+
+def candidates(corpus, module):
+    return module.tidy_extraction(variant_text(corpus, module))
+
+def setup_get_df(corpus, module):
+    return partial(get_df, corpus), pl.scan_parquet(corpus).select(pl.len()).collect().item()
+
+def setup_string_normalization(corpus, module):
+    raw = pl.read_parquet(corpus)
+    return partial(raw.select, string_normalization('text')), len(raw)
+
+def setup_get_splits(corpus, module):
+    df = get_df(corpus)
+    return partial(module.get_splits, df), len(df)
+
+def setup_split_text_and_references(corpus, module):
+    texts = get_df(corpus)['text'].to_list()
+    return (lambda: [module.split_text_and_references(text) for text in texts]), len(texts)
+
+def setup_tidy_extraction(corpus, module):
+    df = variant_text(corpus, module)
+    return partial(module.tidy_extraction, df), len(df)
+
+def setup_get_window_df(corpus, module):
+    text_df = variant_text(corpus, module).select('article_id', 'text')
+    ids_df = module.tidy_extraction(variant_text(corpus, module))
+    return partial(module.get_window_df, text_df, ids_df), len(ids_df)
+
+def setup_remove_extra_digit(corpus, module):
+    df = candidates(corpus, module).select('article_id', 'dataset_id')
+    return partial(remove_extra_digit, df, 'dataset_id'), len(df)
+
+def setup_evaluate(corpus, module, labels=None):
+    df = candidates(corpus, module).select('article_id', 'dataset_id')
+    if labels is None:
+        # every other candidate as a true label, plus as many ids the extraction missed
+        gt = df.gather_every(2).with_columns(pl.lit('Primary').alias('type'))
+        missed = gt.with_columns(pl.col('dataset_id') + '_missed')
+        labels = Path(tempfile.mkdtemp()) / 'train_labels.csv'
+        pl.concat([gt, missed]).write_csv(labels)
+    helpers.COMP_DIR = Path(labels).parent
+    return partial(evaluate, df), len(df)
+
+# name -> (setup, runs once per getid variant)
+BENCHMARKS = {
+    'get_df': (setup_get_df, False),
+    'string_normalization': (setup_string_normalization, False),
+    'get_splits': (setup_get_splits, True),
+    'split_text_and_references': (setup_split_text_and_references, True),
+    'tidy_extraction': (setup_tidy_extraction, True),
+    'get_window_df': (setup_get_window_df, True),
+    'remove_extra_digit': (setup_remove_extra_digit, False),
+    'evaluate': (setup_evaluate, False),
+}
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def run_child(args) -> dict:
+    """One (benchmark, variant, size) in this process."""
+    setup, _ = BENCHMARKS[args.child]
+    module = importlib.import_module(args.variant)
+    kwargs = {'labels': args.labels} if setup is setup_evaluate else {}
+    func, items = setup(args.corpus, module, **kwargs)
+    rss_setup = peak_rss_mb()
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {
+        'items': items,
+        'best_s': best,
+        'mean_s': sum(times) / len(times),
+        'ops_per_sec': 1 / best,
+        'items_per_sec': items / best,
+        'rss_setup_mb': round(rss_setup, 1),
+        'rss_peak_mb': round(peak_rss_mb(), 1),
+    }
+
+def raw_corpus(input_dir: str) -> pl.DataFrame:
+    """(article_id, text) before string_normalization, so get_df / string_normalization have work to do."""
+    if Path(input_dir).suffix == '.parquet':
+        return pl.read_parquet(input_dir).select('article_id', 'text')
+    files = sorted(Path(input_dir).glob('*.txt'))
+    return pl.DataFrame({'article_id': [f.stem for f in files], 'text': [f.read_text() for f in files]})
+
+def write_corpus(base: pl.DataFrame, size: int, path: Path) -> None:
+    """The first `size` articles, repeating the corpus with _1, _2... id suffixes when it is too small."""
+    rounds = -(-size // len(base))
+    df = pl.concat([
+        base.with_columns(pl.col('article_id') + f'_{k}') if k else base
+        for k in range(rounds)
+    ]).head(size)
+    df.write_parquet(path, compression='zstd')
+
+def git_commit() -> tuple[str, bool]:
+    def git(*cmd):
+        return subprocess.run(['git', *cmd], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return git('rev-parse', '--short', 'HEAD') or 'unknown', bool(git('status', '--porcelain', '--untracked-files=no'))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input-dir', type=str, default='./temp/parse_combine', help='Corpus directory of .txt files or .parquet file')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500], help='Corpus sizes in articles')
+    parser.add_argument('--variants', type=str, nargs='+', default=VARIANTS, help='getid variants for the per-variant benchmarks')
+    parser.add_argument('--variant', type=str, default='getid_xml_5', help='Variant whose candidates feed remove_extra_digit / evaluate')
+    parser.add_argument('--only', type=str, nargs='+', default=None, help='Run only these benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark; the best is reported')
+    parser.add_argument('--labels', type=str, default=None, help='train_labels.csv for evaluate (default: data/train_labels.csv, else synthetic)')
+    parser.add_argument('--output', type=str, default=None, help='Results JSON (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--child', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--corpus', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        Path(args.result).write_text(json.dumps(run_child(args)))
+        return
+
+    labels = args.labels or (str(COMP_DIR / 'train_labels.csv') if (COMP_DIR / 'train_labels.csv').exists() else None)
+    commit, dirty = git_commit()
+    output = Path(args.output or ROOT / 'benchmarks' / 'results' / f"{commit}{'-dirty' if dirty else ''}.json")
+    names = args.only or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    base = raw_corpus(args.input_dir)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            corpus = Path(tmp) / f'corpus_{size}.parquet'
+            write_corpus(base, size, corpus)
+            for name in names:
+                per_variant = BENCHMARKS[name][1]
+                for variant in (args.variants if per_variant else [args.variant]):
+                    result_path = Path(tmp) / 'result.json'
+                    cmd = [
+                        sys.executable, __file__, '--child', name, '--variant', variant, '--corpus', str(corpus),
+                        '--repeat', str(args.repeat), '--result', str(result_path),
+                    ]
+                    if labels:
+                        cmd += ['--labels', labels]
+                    subprocess.run(cmd, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+                    result = {'name': name, 'variant': variant if per_variant else None, 'size': size, **json.loads(result_path.read_text())}
+                    results.append(result)
+                    label = f"{name}[{variant}]" if per_variant else name
+                    l.info(f"{label:<40} n={size:<6} {result['best_s']:8.3f}s  {result['ops_per_sec']:8.2f} ops/s  "
+                           f"{result['items_per_sec']:10.0f} items/s  peak RSS {result['rss_peak_mb']:.0f} MB")
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        'commit': commit,
+        'dirty': dirty,
+        'date': time.strftime(LOG_DATEFMT),
+        'python': platform.python_version(),
+        'polars': pl.__version__,
+        'cpus': os.cpu_count(),
+        'input_dir': args.input_dir,
+        'labels': labels or 'synthetic',
+        'repeat': args.repeat,
+        'results': results,
+    }, indent=2))
+    l.info(f"Results saved to {output}")
+
+if __name__=='__main__': main()
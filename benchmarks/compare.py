@@ -0,0 +1,43 @@
+import argparse
+import json
+
+"""
+Compare two benchmarks/bench.py result files: python benchmarks/compare.py base.json new.json
+- speedup = base best time / new best time (> 1 is faster), matched on (name, variant, size)
+- Rows slower than --threshold are flagged, and --fail-on-regression makes that exit 1
+"""
+
+def load(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data, {(r['name'], r['variant'], r['size']): r for r in data['results']}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base', help='Results JSON of the reference commit')
+    parser.add_argument('new', help='Results JSON to compare against it')
+    parser.add_argument('--threshold', type=float, default=0.9, help='Flag rows whose speedup is below this')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    base_meta, base = load(args.base)
+    new_meta, new = load(args.new)
+    print(f"base {base_meta['commit']}{' (dirty)' if base_meta['dirty'] else ''} vs new {new_meta['commit']}{' (dirty)' if new_meta['dirty'] else ''}")
+    print(f"{'benchmark':<40} {'size':>6} {'base s':>9} {'new s':>9} {'speedup':>8} {'base MB':>8} {'new MB':>8}")
+    regressions = 0
+    for key in sorted(base.keys() & new.keys(), key=lambda k: (k[2], k[0], k[1] or '')):
+        name, variant, size = key
+        b, n = base[key], new[key]
+        speedup = b['best_s'] / n['best_s']
+        flag = ''
+        if speedup < args.threshold:
+            flag = '  <-- slower'
+            regressions += 1
+        label = f"{name}[{variant}]" if variant else name
+        print(f"{label:<40} {size:>6} {b['best_s']:>9.3f} {n['best_s']:>9.3f} {speedup:>7.2f}x {b['rss_peak_mb']:>8.0f} {n['rss_peak_mb']:>8.0f}{flag}")
+    for key in sorted(base.keys() ^ new.keys(), key=str):
+        print(f"only in {'base' if key in base else 'new'}: {key}")
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
+
+if __name__=='__main__': main()
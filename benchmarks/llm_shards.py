@@ -0,0 +1,53 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from helpers import *
+from llm_scoring import available_cores, score_sharded
+from llm_validate import SYS_PROMPT_CLASSIFY_DOI, build_df
+
+"""
+Scaling of llm_validate's sharded scoring: python benchmarks/llm_shards.py --limit 256
+- For every --workers N (default 1, 2, 4, ... up to the core count) the windows are scored by N workers of
+  cores / N threads, and a 1/N strided sample by a single worker of the same thread count
+- efficiency = prompts/s of N workers / (N x prompts/s of one such worker), 1.0 = linear;
+  speedup is against the first configuration (by default one worker on every core)
+- Times include each worker's model load, as a real run does; use a --limit large enough to amortize it
+"""
+
+l = get_logger()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-path', type=str, default='./models/qwen2.5')
+    parser.add_argument('--extracted', type=str, default='./temp/extracted.parquet')
+    parser.add_argument('--limit', type=int, default=256, help='DOI windows to score (0 = all)')
+    parser.add_argument('--workers', type=int, nargs='+', default=None)
+    parser.add_argument('--dtype', type=str, default='float32')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', type=str, default=None, help='Also write the results as JSON')
+    args = parser.parse_args()
+
+    windows = build_df(str(ROOT / args.extracted), '/dev/null')['window'].to_list()
+    windows = windows[:args.limit] if args.limit else windows
+    cores = len(available_cores())
+    counts = args.workers or [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= cores]
+    results = []
+    for n in counts:
+        threads = max(1, cores // n)
+        _, stats = score_sharded(windows, args.model_path, SYS_PROMPT_CLASSIFY_DOI, args.dtype, n, threads, args.batch_size)
+        single = stats if n == 1 else score_sharded(windows[::n], args.model_path, SYS_PROMPT_CLASSIFY_DOI, args.dtype, 1, threads, args.batch_size)[1]
+        stats['efficiency'] = round(stats['prompts_per_s'] / (n * single['prompts_per_s']), 3)
+        stats['speedup'] = round(stats['prompts_per_s'] / results[0]['prompts_per_s'], 3) if results else 1.0
+        results.append(stats)
+        l.info(f"{n:>3} workers x {threads:>3} threads  {stats['prompts_per_s']:8.2f} prompts/s  speedup {stats['speedup']:5.2f}x  "
+               f"efficiency {stats['efficiency']:5.2f}  utilization {stats['utilization']:.0%}")
+    if args.output:
+        Path(args.output).write_text(json.dumps({'date': time.strftime(LOG_DATEFMT), 'cores': cores, 'windows': len(windows), 'results': results}, indent=2))
+
+if __name__=='__main__': main()
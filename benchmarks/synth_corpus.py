@@ -0,0 +1,306 @@
+import argparse
+import random
+import re
+import string
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from helpers import *
+from doi_prefixes import PAPER_PREFIXES
+from getid import REGEX_IDS
+
+"""
+Synthetic article corpus in the shape of temp/parse_combine, for load and stress runs:
+python benchmarks/synth_corpus.py --docs 100000 --output-dir temp/synth_100k --workers 0
+- One <article_id>.txt per article (10.xxxx_journal.id like the real corpus) plus train_labels.csv
+  (article_id, dataset_id, type) next to them; --corpus also packs the texts into one Parquet file
+- Body sections cite datasets (the accession families of REGEX_IDS, and data DOIs from Dryad, Zenodo,
+  Figshare, PANGAEA...) in Primary or Secondary contexts; the reference section cites papers by DOI
+  under one of the header spellings, or only as a numbered list
+- --pdf-fraction of the articles look like PDF text: wrapped lines, hyphenated words, DOIs broken after
+  the '/', page numbers, ligatures; the rest look like the XML text (blocks joined by double spaces)
+- Article i depends only on (seed, i), so any --workers count gives the same files
+"""
+
+l = get_logger()
+
+WORDS = (
+    "analysis sample samples model models species population data rate rates temperature expression gene genes "
+    "protein proteins cell cells tissue growth response effect effects treatment control measurement measurements "
+    "variation region regions site sites climate soil water sediment community structure function functional "
+    "sequence sequencing genome transcript isolate isolates strain strains host infection diversity abundance "
+    "concentration signal pathway binding activity mutation mutant phenotype trait traits field experiment "
+    "experimental observed significant significantly higher lower increased decreased compared between within "
+    "across during after before under using based approach method methods result results study studies "
+    "previous recent novel potential specific relative total mean average distribution pattern patterns "
+    "environmental molecular biological chemical physical statistical spatial temporal seasonal annual "
+    "estimated predicted associated consistent robust large small high low dynamic network interaction"
+).split()
+LIGATURE_WORDS = ['signiﬁcant', 'ﬁeld', 'identiﬁed', 'speciﬁc', 'coefﬁcient', 'ﬂux', 'ﬂow', 'proﬁle']
+SURNAMES = ['Smith', 'Garcia', 'Chen', 'Müller', 'Kumar', 'Silva', 'Nguyen', 'Kowalski', 'Rossi', 'Tanaka',
+            'Martin', 'Johansson', 'Okafor', 'Dubois', 'Novak', 'Hernández', 'Wang', 'Brown', 'Ivanova', 'Cohen']
+JOURNALS = ['Nature', 'Science', 'PLoS One', 'Mol Ecol', 'Ecol Evol', 'J Biol Chem', 'Nucleic Acids Res',
+            'Proc Natl Acad Sci USA', 'Sci Rep', 'Genome Res', 'Limnol Oceanogr', 'J Geophys Res']
+ARTICLE_PREFIXES = [('10.1002', 'ece3.{n}'), ('10.1029', '{y}jc{n:06d}'), ('10.1371', 'journal.pone.{n:07d}'),
+                    ('10.1038', 's41598-{y2:03d}-{n:05d}-{k}'), ('10.7554', 'elife.{n}'), ('10.1098', 'rspb.{y}.{n:04d}')]
+SECTIONS = ['Introduction', 'Materials and Methods', 'Results', 'Discussion']
+REF_HEADERS = ['References', 'REFERENCES', 'Literature Cited', 'Bibliography', 'R E F E R E N C E S', 'Works Cited']
+
+def digits(r, n):
+    return ''.join(r.choices(string.digits, k=n))
+
+def alnum(r, n):
+    return ''.join(r.choices(string.ascii_uppercase + string.digits, k=n))
+
+# (repository, id generator) for the accession families of REGEX_IDS
+ACCESSIONS = [
+    ('GEO', lambda r: f"GSE{r.randint(1000, 250000)}"),
+    ('GEO', lambda r: f"GSM{r.randint(10000, 6000000)}"),
+    ('BioProject', lambda r: f"PRJNA{r.randint(10000, 999999)}"),
+    ('ENA', lambda r: f"PRJEB{r.randint(1000, 60000)}"),
+    ('DDBJ', lambda r: f"PRJDB{r.randint(1000, 15000)}"),
+    ('SRA', lambda r: f"{r.choice(['SRR', 'SRP', 'SRX', 'SRA', 'ERR', 'DRR', 'ERP', 'ERX'])}{r.randint(100000, 29999999)}"),
+    ('BioSample', lambda r: f"SAMN{r.randint(1000000, 39999999):08d}"),
+    ('PRIDE', lambda r: f"PXD{r.randint(1, 50000):06d}"),
+    ('ArrayExpress', lambda r: f"E-{r.choice(['MTAB', 'GEOD', 'MEXP', 'PROT'])}-{r.randint(100, 12000)}"),
+    ('EMPIAR', lambda r: f"EMPIAR-{r.randint(10000, 11999)}"),
+    ('ChEMBL', lambda r: f"CHEMBL{r.randint(100, 5000000)}"),
+    ('HMDB', lambda r: f"HMDB{r.randint(1, 250000):07d}"),
+    ('InterPro', lambda r: f"IPR{digits(r, 6)}"),
+    ('Pfam', lambda r: f"PF{digits(r, 5)}"),
+    ('GenBank', lambda r: f"{r.choice(['CP', 'BX', 'KX'])}{digits(r, 6)}"),
+    ('RefSeq', lambda r: f"NC_{digits(r, 6)}.{r.randint(1, 9)}"),
+    ('RefSeq', lambda r: f"NM_{digits(r, 9)}"),
+    ('GISAID', lambda r: f"EPI_ISL_{r.randint(10000, 9999999)}"),
+    ('Cellosaurus', lambda r: f"CVCL_{alnum(r, 4)}"),
+    ('Ensembl', lambda r: f"{r.choice(['ENSBTAG', 'ENSOARG'])}{digits(r, 11)}"),
+    ('Protein Data Bank', lambda r: f"{r.randint(1, 9)}{alnum(r, 3)}"),
+]
+# (repository, DOI) for data DOIs; pasta/dryad also appear without the 10.x/ prefix in text
+DATA_DOIS = [
+    ('Dryad', lambda r: f"10.5061/dryad.{''.join(r.choices(string.ascii_lowercase + string.digits, k=r.choice([5, 7, 9])))}"),
+    ('Zenodo', lambda r: f"10.5281/zenodo.{r.randint(10000, 9999999)}"),
+    ('Figshare', lambda r: f"10.6084/m9.figshare.{r.randint(100000, 29999999)}"),
+    ('PANGAEA', lambda r: f"10.1594/PANGAEA.{r.randint(100000, 999999)}"),
+    ('Mendeley Data', lambda r: f"10.17632/{alnum(r, 10).lower()}.{r.randint(1, 4)}"),
+    ('Dataverse', lambda r: f"10.7910/DVN/{alnum(r, 6)}"),
+    ('EDI', lambda r: f"10.6073/pasta/{''.join(r.choices('0123456789abcdef', k=32))}"),
+]
+
+PRIMARY = [
+    "The {kind} generated in this study have been deposited in {repo} under accession {id}.",
+    "All {kind} produced for this work are available from {repo} ({id}).",
+    "Raw {kind} were uploaded to {repo} and can be accessed at {id}.",
+    "Data availability: the {kind} supporting this article are archived in {repo}, {id}.",
+]
+SECONDARY = [
+    "We reused publicly available {kind} from {repo} ({id}).",
+    "Reference {kind} were retrieved from {repo} under accession {id} [{ref}].",
+    "Previously published {kind} ({id}) were obtained from {repo}.",
+    "As described by {author} et al. [{ref}], the {kind} in {repo} ({id}) were reanalysed.",
+]
+KINDS = ['sequence data', 'raw reads', 'datasets', 'measurements', 'expression data', 'spectra', 'images', 'structures']
+
+def sentence(r, lo=8, hi=24):
+    words = [r.choice(LIGATURE_WORDS) if r.random() < 0.02 else r.choice(WORDS) for _ in range(r.randint(lo, hi))]
+    if r.random() < 0.25:
+        words.insert(r.randrange(len(words)), f"(n = {r.randint(3, 400)})")
+    if r.random() < 0.3:
+        words.append(f"[{r.randint(1, 60)}]")
+    return ' '.join(words).capitalize() + '.'
+
+def paragraph(r, n=None):
+    return ' '.join(sentence(r) for _ in range(n or r.randint(3, 8)))
+
+def article_id(r, i):
+    prefix, suffix = r.choice(ARTICLE_PREFIXES)
+    y = r.randint(2012, 2024)
+    # n grows with i, so ids never repeat
+    return f"{prefix}_" + suffix.format(n=i * 10 + r.randint(0, 9), y=y, y2=y % 1000, k=r.randint(1, 9)).lower()
+
+def text_doi(r, doi):
+    style = r.random()
+    if style < 0.4:
+        return f"https://doi.org/{doi}"
+    if style < 0.7:
+        return f"doi:{doi}"
+    if style < 0.85:
+        return f"http://dx.doi.org/{doi}"
+    return doi
+
+def dataset(r):
+    """(repo, dataset_id as labelled, id as written in the text)"""
+    if r.random() < 0.55:
+        repo, make = r.choice(ACCESSIONS)
+        acc = make(r)
+        if repo == 'Protein Data Bank':
+            return repo, acc, f"PDB {acc}" if r.random() < 0.7 else f"PDB{acc}"
+        return repo, acc, acc
+    repo, make = r.choice(DATA_DOIS)
+    doi = make(r)
+    return repo, f"{DOI_LINK}{doi.lower()}", text_doi(r, doi)
+
+def reference(r, n, doi=None):
+    authors = ', '.join(f"{r.choice(SURNAMES)} {r.choice(string.ascii_uppercase)}" for _ in range(r.randint(1, 4)))
+    title = sentence(r, 6, 14)
+    entry = f"{n}. {authors} ({r.randint(1985, 2024)}) {title} {r.choice(JOURNALS)} {r.randint(1, 120)}:{r.randint(1, 900)}–{r.randint(901, 2000)}."
+    if doi is None and r.random() < 0.8:
+        doi = f"{r.choice(PAPER_PREFIXES)}/{alnum(r, r.randint(6, 14)).lower()}"
+    return entry + (f" {text_doi(r, doi)}" if doi else '')
+
+def article(seed: int, i: int, pdf_fraction: float = 0.25, size: float = 1.0):
+    """(article_id, source, text, labels) of synthetic article i."""
+    r = random.Random(f"{seed}:{i}")
+    aid = article_id(r, i)
+    is_pdf = r.random() < pdf_fraction
+    n_refs = max(3, int(r.randint(15, 60) * size))
+
+    citations = []
+    for _ in range(r.choices([0, 1, 2, 3, 4], weights=[35, 30, 18, 10, 7])[0]):
+        repo, dataset_id, written = dataset(r)
+        kind = 'Primary' if r.random() < 0.4 else 'Secondary'
+        citations.append((repo, dataset_id, written, kind))
+
+    blocks = [sentence(r, 8, 16).rstrip('.'), ', '.join(f"{r.choice(SURNAMES)} {r.choice(string.ascii_uppercase)}" for _ in range(r.randint(2, 6))),
+              f"https://doi.org/{aid.replace('_', '/', 1)}", 'Abstract', paragraph(r)]
+    mentions = [(c, r.randrange(len(SECTIONS))) for c in citations for _ in range(r.randint(1, 3))]
+    for s, section in enumerate(SECTIONS):
+        blocks.append(f"{s + 1}. {section}" if r.random() < 0.5 else section)
+        for _ in range(max(1, int(r.randint(2, 6) * size))):
+            text = paragraph(r)
+            for (repo, _, written, kind), at in mentions:
+                if at == s and r.random() < 0.5:
+                    template = r.choice(PRIMARY if kind == 'Primary' else SECONDARY)
+                    text += ' ' + template.format(kind=r.choice(KINDS), repo=repo, id=written, ref=r.randint(1, n_refs), author=r.choice(SURNAMES))
+            blocks.append(text)
+    if citations:
+        blocks += ['Data Availability', ' '.join(
+            r.choice(PRIMARY).format(kind=r.choice(KINDS), repo=repo, id=written)
+            for repo, _, written, kind in citations if kind == 'Primary'
+        ) or paragraph(r, 2)]
+    blocks += ['Acknowledgements', paragraph(r, 2)]
+
+    refs = [reference(r, n + 1) for n in range(n_refs)]
+    for repo, dataset_id, written, kind in citations:
+        if kind == 'Secondary' and dataset_id.startswith(DOI_LINK) and r.random() < 0.5:
+            refs[r.randrange(n_refs)] = reference(r, 0, dataset_id[len(DOI_LINK):]).split('. ', 1)[1]
+    refs = [ref if ref[0].isdigit() else f"{n + 1}. {ref}" for n, ref in enumerate(refs)]
+    header = r.choice(REF_HEADERS) if r.random() < 0.85 else None
+
+    if is_pdf:
+        text = pdf_layout(r, blocks, header, refs)
+    else:
+        text = '  '.join(blocks + ([header] if header else []) + refs)
+
+    labels = sorted({(aid, dataset_id, kind) for _, dataset_id, _, kind in citations})
+    return aid, 'pdf' if is_pdf else 'xml', text, labels or [(aid, 'Missing', 'Missing')]
+
+def wrap(r, text, width):
+    """Greedy line wrap like PDF text: long words are hyphenated, DOIs sometimes broken after the '/'."""
+    lines, line = [], ''
+    for word in text.split(' '):
+        if line and len(line) + 1 + len(word) > width:
+            room = width - len(line) - 2
+            if word.isalpha() and len(word) > 7 and room > 3 and r.random() < 0.3:
+                lines.append(f"{line} {word[:room]}-")
+                line = word[room:]
+                continue
+            if '/' in word and r.random() < 0.4:
+                head, tail = word.split('/', 1)
+                lines.append(f"{line} {head}/")
+                line = tail
+                continue
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    return lines + [line]
+
+def pdf_layout(r, blocks, header, refs):
+    width = r.randint(70, 100)
+    lines = []
+    for block in blocks:
+        lines += wrap(r, block, width)
+    if header:
+        lines.append(header)
+    for ref in refs:
+        lines += wrap(r, ref, width)
+    # page numbers every ~50 lines
+    for at in range(len(lines) - len(lines) % 50, 0, -50):
+        lines.insert(at, str(at // 50))
+    return '\n'.join(lines)
+
+def check_families(samples: int = 50) -> None:
+    """Every generated accession must be found, whole, by REGEX_IDS."""
+    r = random.Random(0)
+    rx = re.compile(REGEX_IDS)
+    for repo, make in ACCESSIONS:
+        for _ in range(samples):
+            acc = make(r)
+            # PDB ids are only matched with their PDB prefix, which dataset() always writes
+            written = f"PDB {acc}" if repo == 'Protein Data Bank' else acc
+            m = rx.search(f" {written} ")
+            if m is None or m.group() != written:
+                raise ValueError(f"{repo} id {acc!r} is not matched whole by REGEX_IDS")
+
+def write_range(output_dir: str, seed: int, start: int, stop: int, pdf_fraction: float, size: float):
+    """Write articles start..stop-1; returns their (source, labels) in order."""
+    out = []
+    for i in range(start, stop):
+        aid, source, text, labels = article(seed, i, pdf_fraction, size)
+        (Path(output_dir) / f"{aid}.txt").write_text(text, encoding='utf-8')
+        out.append((aid, source, labels))
+    return out
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=1000, help='Number of articles')
+    parser.add_argument('--output-dir', type=Path, default=Path('temp/synth'), help='Directory for the .txt files and train_labels.csv')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pdf-fraction', type=float, default=0.25, help='Share of articles laid out like PDF text')
+    parser.add_argument('--size', type=float, default=1.0, help='Scale the number of paragraphs and references per article')
+    parser.add_argument('--corpus', type=Path, default=None, help='Also write all texts to this Parquet file')
+    parser.add_argument('--workers', type=int, default=1, help='Generator processes (0 = one per CPU core)')
+    parser.add_argument('--chunk-size', type=int, default=500, help='Articles per worker task')
+    args = parser.parse_args()
+
+    check_families()
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [
+        (str(args.output_dir), args.seed, start, min(start + args.chunk_size, args.docs), args.pdf_fraction, args.size)
+        for start in range(0, args.docs, args.chunk_size)
+    ]
+    chunks = {}
+    for job, result in run_pool(write_range, jobs, args.workers):
+        chunks[job[2]] = result
+        l.info(f"Wrote articles {job[2]}..{job[3] - 1}")
+    articles = [a for start in sorted(chunks) for a in chunks[start]]
+
+    labels = pl.DataFrame([row for _, _, rows in articles for row in rows], schema=['article_id', 'dataset_id', 'type'], orient='row')
+    labels.write_csv(args.output_dir / 'train_labels.csv')
+    l.info(f"{len(articles)} articles, {labels.filter(pl.col('type') != 'Missing').height} dataset citations -> {args.output_dir}")
+
+    if args.corpus is not None:
+        write_corpus(args.output_dir, articles, args.corpus, args.chunk_size)
+
+def write_corpus(output_dir: Path, articles: list, corpus_path: Path, chunk_size: int) -> None:
+    """Same columns as parse_com.write_corpus; written in chunks and streamed into one file, so 100k articles fit in memory."""
+    parts = corpus_path.parent / f".{corpus_path.name}.parts"
+    parts.mkdir(parents=True, exist_ok=True)
+    for start in range(0, len(articles), chunk_size):
+        chunk = articles[start:start + chunk_size]
+        pl.DataFrame({
+            'article_id': [aid for aid, _, _ in chunk],
+            'source': [source for _, source, _ in chunk],
+            'text': [(output_dir / f"{aid}.txt").read_text(encoding='utf-8') for aid, _, _ in chunk],
+        }).write_parquet(parts / f"{start:09d}.parquet")
+    pl.scan_parquet(parts / '*.parquet').sink_parquet(corpus_path, compression='zstd')
+    for part in parts.glob('*.parquet'):
+        part.unlink()
+    parts.rmdir()
+    l.info(f"Wrote {len(articles)} articles to {corpus_path}.")
+
+if __name__=='__main__': main()
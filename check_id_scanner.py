@@ -0,0 +1,96 @@
+import argparse
+import importlib
+import re
+import time
+from helpers import *
+from id_scanner import DOI_PATTERN
+
+"""
+Parity + throughput check for the identifier scanner of a getid variant (variant.SCANNER).
+- extract_all: the str.extract_all(DOI) + str.extract_all(REGEX_IDS) pair tidy_extraction used to run (no offsets)
+- match_lists: the same lists through SCANNER.match_lists, which tidy_extraction_lazy now reads
+- hits: SCANNER.hits on those lists, the offsets occurrence_df adds on top of extraction (no second regex scan)
+- union: one extract_all of DOI|REGEX_IDS, timed only, to show a combined scan would not be cheaper than the pair
+  (it also hides accessions inside DOI spans, so its hits are not compared)
+- re.finditer: the same two patterns through re, a span reference for hits (not a speed baseline)
+- For every article and family the scanner must give the same matches as extract_all and the same spans as re
+"""
+
+l = get_logger()
+
+def two_pass(df, regex_ids):
+    return df.select(
+        'article_id',
+        pl.col('text').str.extract_all(DOI_PATTERN).alias('doi'),
+        pl.col('text').str.extract_all(regex_ids).alias('acc'),
+    )
+
+def union_pass(df, regex_ids):
+    flags = re.match(r'\(\?([a-z]+)\)', regex_ids)
+    scoped = f'(?{flags.group(1)}:{regex_ids[flags.end():]})' if flags else f'(?:{regex_ids})'
+    return df.select('article_id', pl.col('text').str.extract_all(f'(?:{DOI_PATTERN})|{scoped}').alias('hits'))
+
+def two_pass_re(df, regex_ids):
+    patterns = {'doi': re.compile(DOI_PATTERN), 'acc': re.compile(regex_ids)}
+    return {
+        article_id: {family: [m.span() for m in rx.finditer(text)] for family, rx in patterns.items()}
+        for article_id, text in df.select('article_id', 'text').rows()
+    }
+
+def best_of(func, *args, repeat=1):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input-dir', type=str, default='./temp/parse_combine', help='Corpus directory or .parquet file')
+    parser.add_argument('--variant', type=str, default='getid_xml_5', help='getid module whose SCANNER is checked')
+    parser.add_argument('--repeat', type=int, default=3, help='Keep the best of N timed runs')
+    parser.add_argument('--skip-re', action='store_true', help='Skip the slow re.finditer two-pass run')
+    args = parser.parse_args()
+
+    variant = importlib.import_module(args.variant)
+    df = get_df(args.input_dir)
+    if hasattr(variant, 'preprocess_text'):
+        df = df.with_columns(pl.col('text').map_elements(variant.preprocess_text, return_dtype=pl.String))
+    mb = df['text'].str.len_bytes().sum() / 1e6
+    scanner = variant.SCANNER
+
+    expected, t_two = best_of(two_pass, df, variant.REGEX_IDS, repeat=args.repeat)
+    lists, t_lists = best_of(scanner.match_lists, df.select('article_id', 'text'), repeat=args.repeat)
+    hits, t_hits = best_of(scanner.hits, lists, repeat=args.repeat)
+    _, t_union = best_of(union_pass, df, variant.REGEX_IDS, repeat=args.repeat)
+    l.info(f"{args.variant}: {len(df)} articles, {mb:.1f} MB, {len(hits)} hits")
+    l.info(f"extract_all (no offsets): {t_two:.3f}s ({mb / t_two:.0f} MB/s)")
+    l.info(f"union extract_all (one scan, no offsets): {t_union:.3f}s ({mb / t_union:.0f} MB/s)")
+    l.info(f"match_lists (extraction, two scans): {t_lists:.3f}s, hits (offsets on top): {t_hits:.3f}s; "
+           f"extraction + offsets {t_lists + t_hits:.3f}s vs extract_all alone {t_two:.3f}s")
+
+    got = hits.group_by('article_id', 'family', maintain_order=True).agg('match', 'start', 'end')
+    got = {(a, f): (m, list(zip(s, e))) for a, f, m, s, e in got.rows()}
+    mismatches = [
+        (article_id, family)
+        for row in expected.rows(named=True)
+        for article_id, family in [(row['article_id'], 'doi'), (row['article_id'], 'acc')]
+        if got.get((article_id, family), ([], []))[0] != row[family]
+    ]
+    if not args.skip_re:
+        spans, t_re = best_of(two_pass_re, df, variant.REGEX_IDS)
+        l.info(f"re.finditer span reference: {t_re:.3f}s")
+        mismatches += [
+            (article_id, family)
+            for article_id, families in spans.items()
+            for family, family_spans in families.items()
+            if got.get((article_id, family), ([], []))[1] != family_spans
+        ]
+    l.info(f"scanner vs extract_all / re.finditer: {len(mismatches)} mismatches")
+    for article_id, family in mismatches[:10]:
+        l.warning(f"mismatch: {article_id} {family}")
+    if mismatches:
+        raise SystemExit(1)
+
+if __name__=='__main__': main()
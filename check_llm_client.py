@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import time
+from helpers import *
+from llm_client import OpenAIClient, score_prompts
+from llm_stub_server import StubServer, stub_choice, stub_hidden
+from llm_validate import build_df
+
+"""
+Check of llm_client against llm_stub_server, no model needed: python check_llm_client.py
+- The DOI windows are sent as prompts through one client at --concurrency, the stub failing every
+  --fail-every-th request with 503 and answering after --delay seconds
+- Every window must get the stub's choice back in input order, every failure must have been retried, and
+  neither requests in flight nor open connections may exceed the concurrency limit
+- With --hide-every, windows whose A/B the stub pushes below the top logprobs must be rescored and resolved,
+  and those it leaves out must come back unresolved (None)
+- A second run at concurrency 1 gives the speedup of the concurrent one
+"""
+
+l = get_logger()
+
+async def run(endpoint, prompts, concurrency, retries):
+    async with OpenAIClient(endpoint, concurrency, retries, timeout=10) as client:
+        start = time.perf_counter()
+        scores = await score_prompts(client, prompts)
+        return scores, {**client.stats, 'prompts_per_s': len(prompts) / max(time.perf_counter() - start, 1e-9)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--extracted', type=str, default='./temp/extracted.parquet')
+    parser.add_argument('--limit', type=int, default=200, help='DOI windows to send (0 = all)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--fail-every', type=int, default=7)
+    parser.add_argument('--delay', type=float, default=0.02)
+    parser.add_argument('--hide-every', type=int, default=10)
+    args = parser.parse_args()
+
+    windows = build_df(args.extracted, '/dev/null')['window'].fill_null('').to_list()
+    windows = windows[:args.limit] if args.limit else windows
+    ok = True
+    speed = {}
+    for concurrency in (args.concurrency, 1):
+        server = StubServer(fail_every=args.fail_every, delay=args.delay, hide_every=args.hide_every)
+        endpoint = server.start()
+        scores, stats = asyncio.run(run(endpoint, windows, concurrency, args.retries))
+        speed[concurrency] = stats['prompts_per_s']
+        expected = [None if stub_hidden(w, args.hide_every) == 'never' else stub_choice(w) for w in windows]
+        wrong = sum((s and ('A' if s[0] >= s[1] else 'B')) != e for s, e in zip(scores, expected))
+        late = sum(stub_hidden(w, args.hide_every) == 'late' for w in windows)
+        l.info(f"concurrency {concurrency}: {len(scores)} windows, {wrong} wrong, {stats['prompts_per_s']:.1f} prompts/s, "
+               f"{stats['requests']} requests, {stats['retries']} retries ({server.stats['failed']} failed on the server), "
+               f"{stats['connections']} connections, at most {server.stats['max_in_flight']} in flight, "
+               f"{stats['rescored']} rescored with more logprobs, {expected.count(None)} unresolved")
+        if len(scores) != len(windows) or wrong:
+            l.error('choices differ from the stub'); ok = False
+        if stats['rescored'] != late + expected.count(None):
+            l.error('windows without A/B in the top logprobs were not all rescored'); ok = False
+        if stats['retries'] != server.stats['failed']:
+            l.error('not every failed request was retried'); ok = False
+        if server.stats['max_in_flight'] > concurrency or stats['connections'] > concurrency:
+            l.error(f'more than {concurrency} requests in flight / connections'); ok = False
+    l.info(f"speedup of concurrency {args.concurrency} over 1: {speed[args.concurrency] / max(speed[1], 1e-9):.2f}x")
+    if not ok:
+        raise SystemExit(1)
+
+if __name__=='__main__': main()
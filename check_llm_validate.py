@@ -0,0 +1,81 @@
+import argparse
+import time
+from helpers import *
+from llm_scoring import CHOICES, PrefixScorer, PromptScorer, build_prompts, choice_ids, load_model
+from llm_validate import SYS_PROMPT_CLASSIFY_DOI, build_df
+
+"""
+Check for the llm_validate scorers: PromptScorer (the default) and the batched prefix-cache one (--prefix-cache).
+- Reference: every prompt on its own through model.generate(max_new_tokens=1, greedy) with the logits limited
+  to A/B, as MultipleChoiceLogitsProcessor does, and log_softmax of the two scores
+- Both scorers must pick the same token for every window; logprob differences (batching/padding) are logged
+- All three report prompts/s
+"""
+
+l = get_logger()
+
+def greedy_choices(model, tokenizer, prompts):
+    import torch
+    from transformers import LogitsProcessor, LogitsProcessorList
+    ids = choice_ids(tokenizer)
+
+    class OnlyChoices(LogitsProcessor):
+        def __call__(self, input_ids, scores):
+            limited = torch.full_like(scores, float('-inf'))
+            limited[:, ids] = scores[:, ids]
+            return limited
+
+    results = []
+    for prompt in prompts:
+        input_ids = tokenizer(prompt, return_tensors='pt').input_ids
+        with torch.inference_mode():
+            out = model.generate(input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=1, do_sample=False,
+                                 logits_processor=LogitsProcessorList([OnlyChoices()]), output_scores=True,
+                                 return_dict_in_generate=True, pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id)
+        token = tokenizer.decode(out.sequences[0, -1])
+        logprobs = torch.log_softmax(out.scores[0][0, ids].float(), dim=-1).tolist()
+        results.append((token, *logprobs))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-path', type=str, default='./models/qwen2.5')
+    parser.add_argument('--extracted', type=str, default='./temp/extracted.parquet')
+    parser.add_argument('--limit', type=int, default=64, help='DOI windows to compare')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-batch-tokens', type=int, default=8192)
+    parser.add_argument('--dtype', type=str, default='float32')
+    parser.add_argument('--threads', type=int, default=0)
+    args = parser.parse_args()
+
+    windows = build_df(args.extracted, '/dev/null')['window'].head(args.limit).to_list()
+    tokenizer, model = load_model(args.model_path, args.dtype, args.threads)
+
+    start = time.perf_counter()
+    reference = greedy_choices(model, tokenizer, build_prompts(tokenizer, SYS_PROMPT_CLASSIFY_DOI, windows))
+    t_ref = time.perf_counter() - start
+    scorers = {
+        'one prompt per pass': PromptScorer(model, tokenizer, SYS_PROMPT_CLASSIFY_DOI),
+        'prefix-cache batches': PrefixScorer(model, tokenizer, SYS_PROMPT_CLASSIFY_DOI, args.batch_size, args.max_batch_tokens),
+    }
+
+    flips = 0
+    for name, scorer in scorers.items():
+        start = time.perf_counter()
+        scores = scorer.score(windows)
+        t_new = time.perf_counter() - start
+        differ = 0
+        for i, ((token, ref_a, _), (lp_a, lp_b)) in enumerate(zip(reference, scores)):
+            choice = CHOICES[0] if lp_a >= lp_b else CHOICES[1]
+            if choice != token:
+                differ += 1
+                l.debug(f"{name} window {i}: generate {token} ({ref_a:.4f}), scorer {choice} ({lp_a:.4f}, {lp_b:.4f})")
+        max_diff = max((abs(ref[1] - new[0]) for ref, new in zip(reference, scores)), default=0.0)
+        l.info(f"{name}: {len(windows)} windows, {differ} choices differ, max |logprob_a diff| {max_diff:.5f}; "
+               f"generate {len(windows) / t_ref:.2f} prompts/s, {name} {len(windows) / t_new:.2f} prompts/s "
+               f"({scorer.stats['uncached']} without the cache)")
+        flips += differ
+    if flips:
+        raise SystemExit(1)
+
+if __name__=='__main__': main()
@@ -0,0 +1,63 @@
+import argparse
+import importlib
+import time
+from helpers import *
+from occurrences import first_windows, occurrence_df
+
+"""
+Check for the offset-based context windows.
+- Every candidate must have at least one occurrence, and text[start:end] must be one of its raw matches
+- First-occurrence windows are compared with the previous text.find(match[0]) windows; they differ only
+  where find landed on an earlier copy of the string inside a longer id (logged for review)
+"""
+
+l = get_logger()
+
+def find_windows(text_df, ids_df, window=100):
+    """The previous get_window_df: join text onto every candidate, window around text.find(match[0])."""
+    df = ids_df.join(text_df, on='article_id')
+    windows = []
+    for text, match_ids in df.select('text', 'match').rows():
+        idx = text.find(match_ids[0])
+        windows.append(text[max(idx - window, 0):min(idx + len(match_ids[0]) + window, len(text))])
+    return df.with_columns(pl.Series('window', windows)).select('article_id', 'dataset_id', 'window')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input-dir', type=str, default='./temp/parse_combine', help='Corpus directory or .parquet file')
+    parser.add_argument('--variants', type=str, nargs='+', default=['getid', 'getid_xml', 'getid_xml_3', 'getid_xml_5'])
+    args = parser.parse_args()
+
+    failed = False
+    for name in args.variants:
+        variant = importlib.import_module(name)
+        text_lf = scan_df(args.input_dir)
+        if hasattr(variant, 'preprocess_text'):
+            text_lf = text_lf.with_columns(pl.col('text').map_elements(variant.preprocess_text, return_dtype=pl.String))
+            ids_df = variant.tidy_extraction(text_lf.collect())
+        else:
+            ids_df = variant.tidy_extraction(variant.get_splits(text_lf.collect()))
+        text_df = text_lf.collect()
+
+        start = time.perf_counter()
+        old = find_windows(text_df, ids_df)
+        t_old = time.perf_counter() - start
+        start = time.perf_counter()
+        occ_df = occurrence_df(text_df, ids_df, variant.SCANNER)
+        new = first_windows(ids_df, occ_df)
+        t_new = time.perf_counter() - start
+
+        texts = dict(text_df.select('article_id', 'text').rows())
+        matches = {(a, d): set(m) for a, d, m in ids_df.select('article_id', 'dataset_id', 'match').rows()}
+        bad_spans = sum(texts[a][s:e] not in matches[(a, d)] for a, d, s, e in occ_df.select('article_id', 'dataset_id', 'start', 'end').rows())
+        missing = new['window'].null_count()
+        diff = old.join(new, on=['article_id', 'dataset_id'], suffix='_offset').filter(pl.col('window') != pl.col('window_offset'))
+        l.info(f"{name}: {len(ids_df)} candidates, {len(occ_df)} occurrences, {missing} without occurrence, {bad_spans} bad spans, "
+               f"{len(diff)} first windows differ from text.find; find {t_old:.3f}s, offsets {t_new:.3f}s")
+        for article_id, dataset_id, *_ in diff.head(5).rows():
+            l.debug(f"{name} window differs: {article_id} {dataset_id}")
+        failed |= bool(missing or bad_spans)
+    if failed:
+        raise SystemExit(1)
+
+if __name__=='__main__': main()
@@ -0,0 +1,95 @@
+import argparse
+import tempfile
+from array import array
+from helpers import *
+from occurrences import occurrence_pages
+
+"""
+Check of the .pages sidecars on non-ASCII documents: python check_page_offsets.py
+- Pages with ligatures, accents, CJK, fullwidth and circled digits and a zenodo record URL change length under
+  string_normalization, so raw .txt offsets drift from the offsets getid's occurrences count
+- Every page carries a PAGE<k> marker and an accession / DOI; page_of on the marker's offset in the text
+  get_df returns must give page k, and occurrence_pages must put every occurrence on the page its id is on
+- The same runs on a PDF written with pymupdf and converted by parse_com.convert_pdf_to_txt
+- The drift the raw offsets would have had is logged for comparison
+"""
+
+l = get_logger()
+
+PAGES = [
+    'Résumé of the ﬁrst ﬁeld campaign PAGE0 — “quoted” naïve café, 数据集 見出し\nSamples GSE123456 deposited.\n',
+    'Ｆｕｌｌｗｉｄｔｈ ｔｅｘｔ ①②③ PAGE1 São Paulo Zürich\nData: https://zenodo.org/record/7654321 and PRJNA765432.\n',
+    'Straße ½ Ω µm PAGE2 ﬂuorescence ﬀ\nArchived as 10.5061/dryad.abc123 with GSE123456 again.\n',
+]
+
+def pdf_pages(path: Path, pages: list[str]) -> None:
+    import pymupdf
+    with pymupdf.open() as doc:
+        for text in pages:
+            doc.new_page().insert_text((72, 72), text, fontname='helv')
+        doc.save(path)
+
+def normalized(text: str) -> str:
+    return pl.DataFrame({'text': [text]}).select(string_normalization('text'))['text'][0]
+
+def check_dir(name: str, parse_dir: Path, expected: dict) -> int:
+    """Mismatches of page_of / occurrence_pages against expected {article_id: page texts} in parse_dir."""
+    import getid
+    text_df = get_df(parse_dir)
+    bad = 0
+    for article_id, text in text_df.iter_rows():
+        pages = expected[article_id]
+        offsets = load_page_offsets(parse_dir / f'{article_id}.txt')
+        raw = array('i', [0])
+        for page in pages:
+            raw.append(raw[-1] + len(page))
+        l.info(f"{name} {article_id}: {len(text)} normalized chars, {raw[-1]} raw; offsets {list(offsets)}, raw {list(raw)}")
+        if offsets[-1] != len(text):
+            l.error(f"{name} {article_id}: last offset {offsets[-1]} != normalized length {len(text)}"); bad += 1
+        for k in range(len(pages)):
+            start = text.find(f'PAGE{k}')
+            if start == -1 or page_of(offsets, start) != k:
+                l.error(f"{name} {article_id}: PAGE{k} at {start} is on page {page_of(offsets, start)}"); bad += 1
+            elif page_of(raw, start) != k:
+                l.info(f"{name} {article_id}: raw offsets would put PAGE{k} on page {page_of(raw, start)}")
+
+    ids_df, occ_df = getid.extract_batch(text_df)
+    occ_df = occurrence_pages(occ_df, parse_dir)
+    for article_id, match, page in occ_df.join(ids_df.explode('match'), on=['article_id', 'dataset_id']).select('article_id', 'match', 'page').iter_rows():
+        on = [k for k, p in enumerate(expected[article_id]) if match in normalized(p)]
+        if page not in on:
+            l.error(f"{name} {article_id}: {match} put on page {page}, it is on {on}"); bad += 1
+    l.info(f"{name}: {len(occ_df)} occurrences, pages {occ_df['page'].to_list()}")
+    return bad
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--skip-pdf', action='store_true', help='Only check the sidecar written from the pages directly')
+    args = parser.parse_args()
+
+    bad = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        parse_dir = Path(tmp) / 'parse'
+        parse_dir.mkdir()
+        txt_file = parse_dir / 'synthetic.txt'
+        txt_file.write_text(''.join(PAGES), encoding='utf-8')
+        write_page_offsets(txt_file, PAGES)
+        bad += check_dir('pages', parse_dir, {'synthetic': PAGES})
+
+        if not args.skip_pdf:
+            from parse_com import convert_pdf_to_txt
+            import pymupdf
+            pdf_dir, pdf_parse_dir = Path(tmp) / 'pdf', Path(tmp) / 'parse_pdf'
+            pdf_dir.mkdir(); pdf_parse_dir.mkdir()
+            pdf_pages(pdf_dir / 'synthetic.pdf', PAGES)
+            if not convert_pdf_to_txt(pdf_dir / 'synthetic.pdf', pdf_parse_dir / 'synthetic.txt'):
+                l.error('convert_pdf_to_txt failed'); bad += 1
+            else:
+                with pymupdf.open(pdf_dir / 'synthetic.pdf') as doc:
+                    extracted = [page.get_text() for page in doc]
+                bad += check_dir('pdf', pdf_parse_dir, {'synthetic': extracted})
+    l.info(f"{bad} page mismatches")
+    if bad:
+        raise SystemExit(1)
+
+if __name__=='__main__': main()
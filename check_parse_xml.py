@@ -0,0 +1,72 @@
+import argparse
+import io
+import time
+import xml.etree.ElementTree as ET
+from functools import partial
+from helpers import *
+from parse_com import (
+    XML_PARSE_ERRORS, lxml_etree, list_xml_files, detect_xml_style, get_block_elements,
+    extract_text_with_structure, stream_text_with_structure,
+)
+
+"""
+Parity + throughput check for the XML engines.
+- tree: the recursive ElementTree extractor, used as the reference
+- etree / lxml: the streaming engines used by parse_com.py
+- Every engine must give the reference text for every file the reference can parse
+"""
+
+l = get_logger()
+
+def tree_text(xml_file):
+    root = ET.parse(xml_file).getroot()
+    style = detect_xml_style(root)
+    return extract_text_with_structure(root, style, get_block_elements(style))
+
+def stream_text(xml_file, engine):
+    out = io.StringIO()
+    stream_text_with_structure(xml_file, out, engine=engine)
+    return out.getvalue()
+
+def run_engine(convert, xml_files):
+    texts = {}
+    start = time.perf_counter()
+    for xml_file in xml_files:
+        try:
+            texts[xml_file] = convert(xml_file)
+        except XML_PARSE_ERRORS + (RecursionError,):
+            texts[xml_file] = None
+    return texts, len(xml_files) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--xml-dir', type=str, default='data/train/XML', help='Directory containing XML files')
+    parser.add_argument('--limit', type=int, default=None, help='Only check the first N files')
+    args = parser.parse_args()
+
+    xml_files = sorted(list_xml_files(args.xml_dir))[:args.limit]
+    engines = {'tree': tree_text, 'etree': partial(stream_text, engine='etree')}
+    if lxml_etree is not None:
+        engines['lxml'] = partial(stream_text, engine='lxml')
+    else:
+        l.warning("lxml is not installed, only checking the ElementTree engines")
+
+    results = {}
+    for name, convert in engines.items():
+        results[name], files_per_sec = run_engine(convert, xml_files)
+        l.info(f"{name}: {files_per_sec:.1f} files/s over {len(xml_files)} files")
+
+    reference = results['tree']
+    failed = False
+    for name in engines:
+        if name == 'tree':
+            continue
+        mismatches = [f for f in xml_files if reference[f] is not None and results[name][f] != reference[f]]
+        l.info(f"{name} vs tree: {len(mismatches)} mismatches")
+        for f in mismatches[:10]:
+            l.warning(f"{name} mismatch: {f}")
+        failed |= bool(mismatches)
+    if failed:
+        raise SystemExit(1)
+
+if __name__=='__main__': main()
@@ -0,0 +1,71 @@
+import argparse
+import time
+from helpers import *
+from profiling import path_bytes
+from llm_scoring import load_model, make_scorer, quantized_path
+from llm_validate import SYS_PROMPT_CLASSIFY_DOI, build_df
+
+"""
+Check of the int8 llm_validate backend against the fp32 baseline on the training windows.
+- Both score the same DOI windows with llm_validate's scorer (PrefixScorer with --prefix-cache); reported per dtype: load time, prompts/s, size on disk
+  (checkpoint directory vs the cached int8 file) and, with train_labels.csv, accuracy of A = labelled dataset
+- int8 must pick the same choice as fp32 for at least --min-agreement of the windows
+- Run it twice: the first run quantizes and writes temp/quantized/, the second shows the cached load
+"""
+
+l = get_logger()
+
+def run(model_path, dtype, windows, args):
+    start = time.perf_counter()
+    tokenizer, model = load_model(model_path, dtype, args.threads)
+    scorer = make_scorer(model, tokenizer, SYS_PROMPT_CLASSIFY_DOI, args.batch_size, args.max_batch_tokens, args.prefix_cache)
+    load_s = time.perf_counter() - start
+    start = time.perf_counter()
+    scores = scorer.score(windows)
+    score_s = max(time.perf_counter() - start, 1e-9)
+    disk = path_bytes(quantized_path(model_path)) if dtype == 'int8' else path_bytes(model_path)
+    return scores, {'load_s': load_s, 'disk_mb': disk / 1e6, 'prompts_per_s': len(windows) / score_s}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-path', type=str, default='./models/qwen2.5')
+    parser.add_argument('--extracted', type=str, default='./temp/extracted.parquet')
+    parser.add_argument('--limit', type=int, default=256, help='DOI windows to score (0 = all)')
+    parser.add_argument('--prefix-cache', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-batch-tokens', type=int, default=8192)
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--min-agreement', type=float, default=0.95)
+    args = parser.parse_args()
+
+    df = build_df(args.extracted, '/dev/null')
+    if args.limit:
+        df = df.head(args.limit)
+    windows = df['window'].to_list()
+    l.info(f"{len(windows)} windows; int8 cache {'present' if quantized_path(args.model_path).exists() else 'missing, will be built'}")
+
+    labels = COMP_DIR / 'train_labels.csv'
+    truth = None
+    if labels.exists():
+        gt = pl.read_csv(labels).filter(pl.col('type') != 'Missing').select('article_id', 'dataset_id').unique()
+        truth = df.join(gt.with_columns(is_data=pl.lit(True)), on=['article_id', 'dataset_id'], how='left')['is_data'].fill_null(False).to_list()
+
+    results = {}
+    for dtype in ('float32', 'int8'):
+        scores, stats = run(args.model_path, dtype, windows, args)
+        choices = [a >= b for a, b in scores]
+        if truth is not None:
+            stats['accuracy'] = sum(c == t for c, t in zip(choices, truth)) / max(len(choices), 1)
+        results[dtype] = (scores, choices, stats)
+        l.info(f"{dtype:<8} load {stats['load_s']:6.1f}s  {stats['disk_mb']:7.0f} MB on disk  {stats['prompts_per_s']:6.2f} prompts/s"
+               + (f"  accuracy {stats['accuracy']:.4f}" if 'accuracy' in stats else ''))
+
+    (base, base_choices, base_stats), (quant, quant_choices, quant_stats) = results['float32'], results['int8']
+    agreement = sum(a == b for a, b in zip(base_choices, quant_choices)) / max(len(windows), 1)
+    max_diff = max((abs(a[0] - b[0]) for a, b in zip(base, quant)), default=0.0)
+    l.info(f"int8 vs fp32: agreement {agreement:.4f}, max |logprob_a diff| {max_diff:.4f}, "
+           f"speedup {quant_stats['prompts_per_s'] / base_stats['prompts_per_s']:.2f}x, load {base_stats['load_s'] / max(quant_stats['load_s'], 1e-9):.2f}x faster")
+    if agreement < args.min_agreement:
+        raise SystemExit(1)
+
+if __name__=='__main__': main()
@@ -0,0 +1,105 @@
+import argparse
+import importlib
+import time
+from helpers import *
+from ref_split import LINE_BREAKS_RE, SPLIT_CHUNK_SIZE, reference_split, slice_splits, split_columns, split_lazy, split_offsets, split_references, split_point
+
+"""
+Parity + timing check for the reference splitter.
+- reference_split (the previous implementation) is the reference
+- split_point must give the same strings by slicing, except for texts with \\r-style line breaks that
+  the old code rejoined with \\n
+- Every text is also checked with leading whitespace, \\r\\n line breaks and its headers removed,
+  so the rescan, rejoin and line-based paths are all covered
+- split_columns / split_lazy / split_offsets with --workers, sharing one process_pool, must match the serial split row for row
+- Timing runs on the corpus and on long documents made by joining --join articles, like long PDFs
+"""
+
+l = get_logger()
+
+def variants(text, patterns):
+    yield 'plain', text
+    yield 'leading_ws', '  \n' + text
+    yield 'crlf', text.replace('\n', '\r\n')
+    no_header = text
+    for pattern in patterns['ref_header_patterns']:
+        no_header = pattern.sub(' ', no_header)
+    yield 'no_header', no_header
+
+def best_of(split, texts, patterns, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            split(text, patterns)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def check_parallel(name, texts, patterns, args):
+    df = pl.DataFrame({'text': texts})
+    start = time.perf_counter()
+    expected = [split_references(text, patterns) for text in texts]
+    t_serial = time.perf_counter() - start
+    # one pool for the three runs, as a getid run shares one across its batches
+    with process_pool(args.workers) as executor:
+        start = time.perf_counter()
+        columns = split_columns(df, patterns, args.workers, args.chunk_size, executor)
+        t_columns = time.perf_counter() - start
+        start = time.perf_counter()
+        sliced = slice_splits(split_offsets(df, patterns, args.workers, args.chunk_size, executor))
+        t_offsets = time.perf_counter() - start
+        lazy = split_lazy(df.lazy(), patterns, args.workers, args.chunk_size, executor).collect(engine='streaming')
+
+    mismatches = [i for i, row in enumerate(columns.select('body', 'ref').rows()) if row != expected[i]]
+    mismatches += [i for i, row in enumerate(lazy.select('body', 'ref').rows()) if row != expected[i]]
+    mismatches += [
+        i for i, row in enumerate(sliced.select('body', 'ref').rows())
+        if row != expected[i] and not LINE_BREAKS_RE.search(texts[i])
+    ]
+    l.info(f"{name} parallel (workers={resolve_workers(args.workers)}, chunk_size={args.chunk_size}): {len(mismatches)} mismatches; "
+           f"serial {t_serial:.3f}s, split_columns {t_columns:.3f}s, split_offsets + slice {t_offsets:.3f}s")
+    for i in mismatches[:10]:
+        l.warning(f"{name} parallel mismatch: text {i}")
+    return bool(mismatches)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input-dir', type=str, default='./temp/parse', help='Corpus directory or .parquet file')
+    parser.add_argument('--variants', type=str, nargs='+', default=['getid', 'getid_xml_5'], help='getid modules whose COMPILED_PATTERNS are checked')
+    parser.add_argument('--join', type=int, default=20, help='Articles per synthetic long document')
+    parser.add_argument('--repeat', type=int, default=3, help='Keep the best of N timed runs')
+    parser.add_argument('--workers', type=int, default=0, help='Processes for the parallel split (0 = one per CPU core)')
+    parser.add_argument('--chunk-size', type=int, default=SPLIT_CHUNK_SIZE, help='Articles per pool task')
+    args = parser.parse_args()
+
+    texts = get_df(args.input_dir)['text'].to_list()
+    long_texts = ['\n'.join(texts[i:i + args.join]) for i in range(0, len(texts), args.join)]
+    failed = False
+    for name in args.variants:
+        patterns = importlib.import_module(name).COMPILED_PATTERNS
+        mismatches = []
+        for i, text in enumerate(texts):
+            for kind, t in variants(text, patterns):
+                expected = reference_split(t, patterns)
+                if split_references(t, patterns) != expected:
+                    mismatches.append((i, kind))
+                elif not LINE_BREAKS_RE.search(t):
+                    cut = split_point(t, patterns)
+                    if (t[:cut].strip(), t[cut:].strip()) != expected:
+                        mismatches.append((i, kind + '/split_point'))
+        l.info(f"{name}: {len(mismatches)} mismatches over {len(texts)} texts x 4 variants")
+        for i, kind in mismatches[:10]:
+            l.warning(f"{name} mismatch: text {i} ({kind})")
+        failed |= bool(mismatches)
+
+        for label, batch in [('corpus', texts), (f'long x{args.join}', long_texts)]:
+            mb = sum(map(len, batch)) / 1e6
+            t_old = best_of(reference_split, batch, patterns, args.repeat)
+            t_new = best_of(split_references, batch, patterns, args.repeat)
+            l.info(f"{name} {label} ({len(batch)} docs, {mb:.1f} MB): previous {t_old:.3f}s, single pass {t_new:.3f}s, {t_old / t_new:.1f}x")
+
+        failed |= check_parallel(name, texts, patterns, args)
+    if failed:
+        raise SystemExit(1)
+
+if __name__=='__main__': main()
@@ -0,0 +1,24 @@
+import json
+import os
+from pathlib import Path
+import polars as pl
+
+"""
+Rule-based confidence score for candidate ids (getid_xml_3.py / getid_xml_5.py).
+- score = base + the weight of every rule whose pattern is found in dataset_id (case-insensitive)
+- The score is clipped to [min, max]; rows at or below threshold are dropped
+- Rules are applied in file order, so the sum matches the old per-row Python loop bit for bit
+- Rules and weights live in confidence_rules.json; point CONFIDENCE_RULES at another file to tune them
+"""
+
+CONFIDENCE_RULES = os.getenv("CONFIDENCE_RULES", str(Path(__file__).with_name("confidence_rules.json")))
+
+def load_rules(path: str = CONFIDENCE_RULES) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def confidence_expr(rules: dict, col: str = "dataset_id") -> pl.Expr:
+    score = pl.lit(rules["base"], dtype=pl.Float64)
+    for rule in rules["rules"]:
+        score = score + pl.when(pl.col(col).str.contains(f"(?i){rule['pattern']}")).then(rule["weight"]).otherwise(0.0)
+    return score.clip(rules["min"], rules["max"])
@@ -0,0 +1,49 @@
+import re
+import polars as pl
+from helpers import DOI_LINK
+
+"""
+Registry of DOI prefixes that belong to publishers (papers, not datasets).
+- PAPER_PREFIXES: the core list used by post_filter.py
+- PAPER_PREFIXES_EXTENDED: core + the longer list used by getid_xml_5.py, deduplicated
+- Checks extract the registrant prefix (10.xxxx) once and test it with is_in, a hash lookup per row
+"""
+
+PAPER_PREFIXES = [
+    "10.1038","10.1007","10.1126","10.1016","10.1101","10.1021","10.1145","10.1177",
+    "10.1093","10.1080","10.1111","10.1098","10.1103","10.1186","10.1371","10.7554",
+    "10.1039","10.1002","10.3390","10.1073","10.1097","10.15252","10.1136","10.1091",
+    "10.1523", "10.1152", "10.1128", "10.1155", "10.1242", "10.1182", "10.1012"
+]
+
+EXTRA_PAPER_PREFIXES = [
+    "10.1023","10.1001","10.1006","10.1017","10.1029","10.1034","10.1037","10.1042","10.1044","10.1046",
+    "10.1053","10.1056","10.1061","10.1063","10.5194","10.1175","10.2307","10.3389","10.1590","10.1130",
+    "10.1088","10.1146","10.1890","10.1086","10.3133","10.1109","10.1140","10.3354","10.1534","10.6084",
+    "10.1158","10.1139","10.4319","10.1785","10.1099","10.1143","10.1089","10.1104","10.1074","10.3897",
+    "10.1071","10.1121","10.3201","10.3109","10.18637","10.1364","10.1163","10.1144","10.1159","10.1161",
+    "10.1113","10.7717","10.1515","10.11646","10.1108","10.1115","10.6070","10.1617","10.1306","10.1645",
+    "10.14379","10.1899","10.4271","10.1210","10.4161","10.21105","10.1183","10.14411","10.12688","10.1148",
+    "10.1105","10.3892","10.18632","10.3945","10.1107","10.1659","10.1162","10.1586","10.3322","10.1641",
+    "10.2147","10.1603","10.1067","10.1201","10.5441","10.48550","10.1200","10.5860","10.1078","10.3168",
+    "10.2217","10.1127","10.2193","10.1164","10.5027","10.17161","10.2136","10.1142","10.7589","10.1292",
+    "10.13155","10.1554","10.3920","10.2337","10.5065","10.2134","10.1248","10.17600","10.5479","10.5751",
+    "10.2110","10.3174","10.1212","10.17660","10.1530","10.4067","10.1172","10.1094","10.1674","10.18194",
+    "10.4103","10.1190","10.2174","10.1117","10.3233","10.1577","10.2737","10.4172","10.2475","10.3732",
+    "10.15454","10.1643","10.1214","10.1642",
+    # from getid_xml_blacklist.py (temp/doi_prefix_blacklist.txt)
+    "10.13039","10.2135","10.1084","10.4049","10.1124","10.1261","10.5155","10.1118","10.1083","10.3324",
+    "10.7326","10.1055","10.1270","10.1213","10.3835","10.1385","10.3171","10.1373","10.1637","10.4269",
+    "10.2478","10.1096","10.1137","10.1378","10.4143","10.26197","10.1194","10.7150","10.13140","10.1246",
+    "10.2987","10.2144","10.4315","10.1593","10.2202","10.1196","10.1110","10.1134","10.3748","10.21273",
+    "10.1503","10.1517","10.1215"
+]
+
+PAPER_PREFIXES_EXTENDED = list(dict.fromkeys(PAPER_PREFIXES + EXTRA_PAPER_PREFIXES))
+
+def doi_prefix(col: str = "dataset_id") -> pl.Expr:
+    """Registrant prefix (10.xxxx) of a DOI link column, null for anything else."""
+    return pl.col(col).str.extract(rf"^{re.escape(DOI_LINK)}(10\.\d+)/", 1)
+
+def is_paper_prefix(col: str = "dataset_id", prefixes: list[str] = PAPER_PREFIXES) -> pl.Expr:
+    return doi_prefix(col).is_in(prefixes).fill_null(False)
@@ -1,8 +1,13 @@
 import re
 import polars as pl
-from typing import Optional, Tuple
+from typing import Tuple
 
 from helpers import *
+from profiling import metrics, path_bytes, profile_cli
+from id_scanner import IdScanner, id_families
+from occurrences import extract_corpus, first_windows, occurrence_df, occurrences_path
+from ref_split import SPLIT_CHUNK_SIZE, split_columns, split_lazy, split_offsets, split_references
+from confidence import load_rules, confidence_expr
 
 COMPILED_PATTERNS = {
     # 'ref_header_patterns': [re.compile(r'\b(R\s*E\s*F\s*E\s*R\s*E\s*N\s*C\s*E\s*S|BIBLIOGRAPHY|LITERATURE CITED|WORKS CITED|CITED WORKS|ACKNOWLEDGEMENTS)\b[:\s]*', re.IGNORECASE)],    
@@ -17,74 +22,62 @@ COMPILED_PATTERNS = {
     ],
 }
 
-l = get_logger()
+# 建议替换的 REGEX_IDS
+REGEX_IDS = (
+    r"(?i)\b(?:"
+    # Original Patterns
+    r"CHEMBL\d+|"
+    r"E-(?:GEOD|PROT|MTAB|MEXP)-\d+|EMPIAR-\d+|"
+    r"ENS[A-Z]+\d+|" # More general Ensembl pattern
+    r"EPI_ISL_\d{5,}|EPI\d{6,7}|"
+    r"HPA\d+|CP\d{6,}|IPR\d{6}|PF\d{5}|BX\d{6}|KX\d{6}|K0\d{4}|CAB\d{6}|"
+    r"NC_\d{6,}\.\d+|NM_\d{6,}|" # Loosened length constraints
+    r"PRJNA\d+|PRJEB\d+|PRJDB\d+|PXD\d+|SAMN\d+|"
+    r"GSE\d+|GSM\d+|"
+    r"(?:PDB\s?)?[1-9][A-Z0-9]{3}|HMDB\d+|" # Made "PDB" prefix optional
+    r"dryad\.[^\s\"<>]+|pasta\/[^\s\"<>]+|"
+    r"(?:SR[RPAX]|STH|ERR|DRR|DRX|DRP|ERP|ERX)\d+|"
+    r"CVCL_[A-Z0-9]{4}|"
+    
+    # === New Patterns based on train_labels.csv analysis ===
+    r"rs\d+|"                     # dbSNP IDs, e.g., rs33912345
+    r"HGNC:\d+|"                  # HGNC IDs, e.g., HGNC:13735
+    r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|" # CATH IDs, e.g., 3.10.180.10
+    r"[OPQ][0-9][A-Z0-9]{3}[0-9]|[A-NR-Z][0-9]([A-Z][A-Z0-9]{2}[0-9]){1,2}|" # UniProt IDs
+    r"MODEL\d+|"                  # BioModels ID
+    r"SRP\d+|"                    # SRA Project
+    r"GDS\d+"                     # GEO Datasets
+
+
+    # === Final additions for edge cases ===
+    r"NCT\d+|"          # ClinicalTrials.gov ID
+    r"[A-Z]{2}\d{6,}|"   # GenBank accession format (e.g., AF123456)
+    r"GPL\d+"           # GEO Platform ID
+    r")"
+)
+
+SCANNER = IdScanner(id_families(REGEX_IDS))
 
-def find_last_reference_header(text: str, header_patterns: list[re.Pattern]) -> Optional[int]:
-    last_match_idx = None
-    for pattern in header_patterns:
-        matches = list(pattern.finditer(text))
-        if matches:
-            last_match_idx = matches[-1].start()
-    return last_match_idx
-
-def find_last_first_citation(text: str) -> Optional[int]:
-    lines = text.splitlines()
-    last_match_line = None
-    for line_num, line in enumerate(lines):
-        line = line.strip()
-        for pattern in COMPILED_PATTERNS['first_citation_patterns']:
-            if pattern.match(line):
-                next_lines = lines[line_num:line_num+3]
-                if any(COMPILED_PATTERNS['citation_pattern'].match(l.strip()) for l in next_lines[1:]):
-                    last_match_line = line_num
-                break
-    return last_match_line
-
-def find_reference_start(text: str) -> Optional[int]:
-    lines = text.splitlines()
-    last_first_citation = find_last_first_citation(text)
-    if last_first_citation is not None:
-        return last_first_citation
-    start_search_idx = int(len(lines) * 0.5)
-    for i in range(start_search_idx, len(lines)):
-        line = lines[i].strip()
-        if COMPILED_PATTERNS['citation_pattern'].match(line):
-            next_lines = lines[i:i+3]
-            if sum(1 for l in next_lines if COMPILED_PATTERNS['citation_pattern'].match(l.strip())) >= 2:
-                for j in range(i, max(-1, i-10), -1):
-                    if not COMPILED_PATTERNS['citation_pattern'].match(lines[j].strip()):
-                        return j + 1
-                return max(0, i-10)
-    return None
+l = get_logger()
 
 def split_text_and_references(text: str) -> Tuple[str, str]:
-    header_idx = find_last_reference_header(text, COMPILED_PATTERNS['ref_header_patterns'])
-    if header_idx is not None:
-        header_idx2 = find_last_reference_header(text[:header_idx].strip(), COMPILED_PATTERNS['ref_header_patterns'])
-        if header_idx2 is not None:
-            header_idx3 = find_last_reference_header(text[:header_idx2].strip(), COMPILED_PATTERNS['ref_header_patterns'])
-            if header_idx3 is not None:
-                return text[:header_idx3].strip(), text[header_idx3:].strip()
-            return text[:header_idx2].strip(), text[header_idx2:].strip()
-        return text[:header_idx].strip(), text[header_idx:].strip()
-    ref_start_line = find_reference_start(text)
-    if ref_start_line is not None:
-        lines = text.splitlines()
-        body = '\n'.join(lines[:ref_start_line])
-        refs = '\n'.join(lines[ref_start_line:])
-        return body.strip(), refs.strip()
-    return text.strip(), ''
-
-def get_splits(df: pl.DataFrame) -> pl.DataFrame:
-    bodies, refs = [], []
-    for raw_text in df['text']:
-        main, ref = split_text_and_references(raw_text)
-        bodies.append(main)
-        refs.append(ref)
-    return df.with_columns(pl.Series('body', bodies), pl.Series('ref', refs))
-
-def tidy_extraction(df) -> pl.DataFrame:
+    return split_references(text, COMPILED_PATTERNS)
+
+def get_splits(df: pl.DataFrame, workers: int = 1, chunk_size: int = SPLIT_CHUNK_SIZE, executor=None) -> pl.DataFrame:
+    return split_columns(df, COMPILED_PATTERNS, workers, chunk_size, executor)
+
+def get_split_offsets(df: pl.DataFrame, workers: int = 1, chunk_size: int = SPLIT_CHUNK_SIZE, executor=None) -> pl.DataFrame:
+    return split_offsets(df, COMPILED_PATTERNS, workers, chunk_size, executor)
+
+def get_splits_lazy(lf: pl.LazyFrame, workers: int = 1, chunk_size: int = SPLIT_CHUNK_SIZE, executor=None) -> pl.LazyFrame:
+    return split_lazy(lf, COMPILED_PATTERNS, workers, chunk_size, executor)
+
+def tidy_extraction(df, rules: dict | None = None) -> pl.DataFrame:
+    return tidy_extraction_lazy(df.lazy(), rules).collect()
+
+def tidy_extraction_lazy(lf: pl.LazyFrame, rules: dict | None = None) -> pl.LazyFrame:
     bad_ids = [f'{DOI_LINK}{e}' for e in ['10.5061/dryad', '10.5281/zenodo', '10.6073/pasta']]
+    lf = SCANNER.match_lists(lf)
     
     # doi_df = (
     #     df.with_columns(pl.col('body').str.extract_all(r'10\s*\.\s*\d{4,9}\s*/\s*\S+').alias('match'))
@@ -104,7 +97,7 @@ def tidy_extraction(df) -> pl.DataFrame:
 
 
     doi_df = (
-        df.with_columns(pl.col('text').str.extract_all(r'10\s*\.\s*\d{4,9}\s*/\s*\S+').alias('match'))
+        lf.select('article_id', pl.col('doi_match').alias('match'))
         .explode('match')
         .drop_nulls('match')
         .with_columns(
@@ -119,44 +112,8 @@ def tidy_extraction(df) -> pl.DataFrame:
     )
 
 
-    # 建议替换的 REGEX_IDS
-    REGEX_IDS = (
-        r"(?i)\b(?:"
-        # Original Patterns
-        r"CHEMBL\d+|"
-        r"E-(?:GEOD|PROT|MTAB|MEXP)-\d+|EMPIAR-\d+|"
-        r"ENS[A-Z]+\d+|" # More general Ensembl pattern
-        r"EPI_ISL_\d{5,}|EPI\d{6,7}|"
-        r"HPA\d+|CP\d{6,}|IPR\d{6}|PF\d{5}|BX\d{6}|KX\d{6}|K0\d{4}|CAB\d{6}|"
-        r"NC_\d{6,}\.\d+|NM_\d{6,}|" # Loosened length constraints
-        r"PRJNA\d+|PRJEB\d+|PRJDB\d+|PXD\d+|SAMN\d+|"
-        r"GSE\d+|GSM\d+|"
-        r"(?:PDB\s?)?[1-9][A-Z0-9]{3}|HMDB\d+|" # Made "PDB" prefix optional
-        r"dryad\.[^\s\"<>]+|pasta\/[^\s\"<>]+|"
-        r"(?:SR[RPAX]|STH|ERR|DRR|DRX|DRP|ERP|ERX)\d+|"
-        r"CVCL_[A-Z0-9]{4}|"
-        
-        # === New Patterns based on train_labels.csv analysis ===
-        r"rs\d+|"                     # dbSNP IDs, e.g., rs33912345
-        r"HGNC:\d+|"                  # HGNC IDs, e.g., HGNC:13735
-        r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|" # CATH IDs, e.g., 3.10.180.10
-        r"[OPQ][0-9][A-Z0-9]{3}[0-9]|[A-NR-Z][0-9]([A-Z][A-Z0-9]{2}[0-9]){1,2}|" # UniProt IDs
-        r"MODEL\d+|"                  # BioModels ID
-        r"SRP\d+|"                    # SRA Project
-        r"GDS\d+"                     # GEO Datasets
-
-
-        # === Final additions for edge cases ===
-        r"NCT\d+|"          # ClinicalTrials.gov ID
-        r"[A-Z]{2}\d{6,}|"   # GenBank accession format (e.g., AF123456)
-        r"GPL\d+"           # GEO Platform ID
-        r")"
-    )
-    
     acc_df = (
-        df.with_columns(
-            pl.col('text').str.extract_all(REGEX_IDS).alias('match')
-        )
+        lf.select('article_id', pl.col('acc_match').alias('match'))
         .explode('match')
         .drop_nulls('match')
         .with_columns(
@@ -185,54 +142,19 @@ def tidy_extraction(df) -> pl.DataFrame:
     
     # ======== 智能过滤策略 ========
     # 1. 基本过滤（保留所有可能的匹配）
-    df = df.unique(['article_id', 'dataset_id'])
+    df = df.unique(['article_id', 'dataset_id'], keep='first')
     
     # 2. 添加置信度评分而不是直接过滤
-    def calculate_confidence(dataset_id):
-        """为每个ID计算置信度分数"""
-        score = 0.5  # 基础分数
-        
-        # 高置信度模式
-        high_confidence_patterns = [
-            r'10\.\d{4,9}/',  # DOI格式
-            r'chebi\.org',    # 已知仓库
-            r'ensembl\.org',
-            r'GSE\d+',
-            r'PRJNA\d+',
-            r'CHEMBL\d+',
-            r'PXD\d+',
-        ]
-        
-        # 低置信度模式（可能误判）
-        low_confidence_patterns = [
-            r'^\d+$',  # 纯数字
-            r'^\d+\.\d+$',  # 简单小数
-            r'^[A-Z]{1,2}\d{1,3}$',  # 短字母数字组合
-            r'^Figure\s+\d+',  # 图表引用
-            r'^Table\s+\d+',  # 表格引用
-        ]
-        
-        # 应用规则
-        for pattern in high_confidence_patterns:
-            if re.search(pattern, dataset_id, re.IGNORECASE):
-                score += 0.3
-        
-        for pattern in low_confidence_patterns:
-            if re.search(pattern, dataset_id, re.IGNORECASE):
-                score -= 0.4
-        
-        # 确保分数在0-1之间
-        return max(0.1, min(1.0, score))
-    
-    # 添加置信度列
-    confidence_scores = [calculate_confidence(id) for id in df['dataset_id'].to_list()]
-    df = df.with_columns(pl.Series('confidence', confidence_scores))
+    # 规则和权重见 confidence_rules.json
+    if rules is None:
+        rules = load_rules()
+    df = df.with_columns(confidence_expr(rules).alias('confidence'))
     
     # 3. 应用智能过滤（只过滤明显错误的匹配）
     df = (
         df
         # 排除明显错误的匹配（置信度极低）
-        .filter(pl.col('confidence') > 0.2)
+        .filter(pl.col('confidence') > rules['threshold'])
         # 弱化自身引用过滤
         .filter(
             ~pl.col('dataset_id').str.replace("https?://", "")
@@ -243,24 +165,15 @@ def tidy_extraction(df) -> pl.DataFrame:
     )
     
     # 保留原有的match去重
-    df = df.with_columns(pl.col('match').list.unique())
+    df = df.with_columns(pl.col('match').list.unique(maintain_order=True))
     # ======== 智能过滤结束 ========
     return df
 
-def get_context_window(text: str, substring: str, window: int = 100) -> str:
-    idx = text.find(substring)
-    if idx == -1:
-        raise ValueError
-    start = max(idx - window, 0)
-    end = min(idx + len(substring) + window, len(text))
-    return text[start:end]
+def get_occurrence_df(text_df, ids_df):
+    return occurrence_df(text_df, ids_df, SCANNER)
 
 def get_window_df(text_df, ids_df):
-    df = ids_df.join(text_df, on='article_id')
-    windows = []
-    for text, match_ids in df.select('text', 'match').rows():
-        windows.append(get_context_window(text, match_ids[0]))
-    return df.with_columns(pl.Series('window', windows)).select('article_id', 'dataset_id', 'window')
+    return first_windows(ids_df, get_occurrence_df(text_df, ids_df))
 
 
 
@@ -285,33 +198,45 @@ def preprocess_text(text: str) -> str:
             i += 1
     return '\n'.join(processed_lines)
 
-def main(input_dir: str, parquet_dir: str, output_dir: str) -> None:
-
-    text_df = get_df(input_dir)
-
-    # !!! ADD THIS PREPROCESSING STEP !!!
-    original_texts = text_df['text'].to_list()
-    preprocessed_texts = [preprocess_text(t) for t in original_texts]
-    text_df = text_df.with_columns(pl.Series("text", preprocessed_texts))
-
-
-    df = get_splits(text_df)
-    df = tidy_extraction(df)
-    df = get_window_df(text_df, df)
-    df.write_parquet(parquet_dir)
-    # df.write_parquet('./temp/extracted.parquet_xml')
-    df = assume_type(df)
-    df.select(['article_id', 'dataset_id', 'type']).with_row_index(name='row_id').write_csv(output_dir)
-    if not IS_KAGGLE_SUBMISSION:
-        print("*"*10)
-        results = evaluate(df)
-        for r in results: l.info(r)
-        print("*"*10)
-        results = evaluate(df, on=['article_id', 'dataset_id', 'type'])
-        for r in results: l.info(r)
+def extract_batch(text_df: pl.DataFrame) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """Candidates and their occurrences for one batch of preprocessed articles."""
+    # body/ref are not used by tidy_extraction here, so get_splits is skipped
+    text_df = SCANNER.match_lists(text_df)
+    ids_df = tidy_extraction(text_df)
+    return ids_df, get_occurrence_df(text_df, ids_df)
+
+def main(input_dir: str, parquet_dir: str, output_dir: str, chunk_size: int = STREAMING_CHUNK_SIZE) -> None:
+
+    with metrics('getid_xml_3', bytes_read=path_bytes(input_dir)) as run:
+        # !!! ADD THIS PREPROCESSING STEP !!!
+        text_lf = scan_df(input_dir).with_columns(pl.col('text').map_elements(preprocess_text, return_dtype=pl.String))
+
+        with metrics('extract') as m:
+            df, occ_df, articles = extract_corpus(text_lf, extract_batch, chunk_size)
+            m.update(rows_in=articles, rows_out=df.height, occurrences=occ_df.height)
+        with metrics('windows', rows_in=df.height) as m:
+            df = first_windows(df, occ_df)
+            m['rows_out'] = df.height
+        with metrics('write') as m:
+            occ_df.write_parquet(occurrences_path(parquet_dir))
+            df.write_parquet(parquet_dir)
+            # df.write_parquet('./temp/extracted.parquet_xml')
+            df = assume_type(df)
+            df.select(['article_id', 'dataset_id', 'type']).with_row_index(name='row_id').write_csv(output_dir)
+            m['bytes_written'] = sum(path_bytes(p) for p in (occurrences_path(parquet_dir), parquet_dir, output_dir))
+        run.update(rows_in=articles, rows_out=df.height, bytes_written=m['bytes_written'])
+        if not IS_KAGGLE_SUBMISSION:
+            with metrics('evaluate'):
+                print("*"*10)
+                results = evaluate(df)
+                for r in results: l.info(r)
+                print("*"*10)
+                results = evaluate(df, on=['article_id', 'dataset_id', 'type'])
+                for r in results: l.info(r)
 
 
 if __name__=='__main__': 
+    profile_cli()
 
     input_dir = './temp/parse_xml'
     parquet_dir = './temp/extracted.parquet_xml_3'
@@ -2,6 +2,7 @@
 import polars as pl
 import re
 from collections import Counter
+from profiling import profile_cli, timed
 
 def extract_doi_prefix(doi: str) -> str | None:
     """Extracts '10.xxxx' prefix from a DOI starting with 'https://doi.org/'."""
@@ -16,6 +17,7 @@ def extract_doi_prefix(doi: str) -> str | None:
             return prefix
     return None
 
+@timed('blacklist')
 def main(input_path: str, output_path: str) -> None:
     # Read F1_details_xml.csv
     df = pl.read_csv(input_path)
@@ -70,6 +72,7 @@ def main(input_path: str, output_path: str) -> None:
     print(f"\nBlacklist saved to: {output_path}")
 
 if __name__ == '__main__':
+    profile_cli()
     input_path = './temp/F1_details_xml.csv'
     output_path = './temp/doi_prefix_blacklist.txt'
     main(input_path, output_path)
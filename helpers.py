@@ -1,6 +1,11 @@
-import logging, os, kagglehub, inspect
+import logging, os, kagglehub, inspect, sys, multiprocessing
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
 import polars as pl
+from polars.io.plugins import register_io_source
 
 IS_KAGGLE_ENV = sum(['KAGGLE' in k for k in os.environ]) > 0
 IS_KAGGLE_SUBMISSION = bool(os.getenv("KAGGLE_IS_COMPETITION_RERUN"))
@@ -44,21 +49,136 @@ def get_logger(name=None):
         logger.propagate = False
     return logger
 
+def resolve_workers(workers: int) -> int:
+    if workers == 0:
+        return os.cpu_count() or 1
+    return max(1, workers)
+
+# workers start from a clean interpreter, not a fork of a process that already runs polars / pymupdf threads
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+@contextmanager
+def process_pool(workers: int = 1):
+    """One ProcessPoolExecutor of workers processes for a whole run, to pass on to map_chunks; None for 1 worker."""
+    workers = resolve_workers(workers)
+    if workers == 1:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(POOL_START_METHOD)) as executor:
+        yield executor
+
+def run_pool(func, jobs, workers: int = 1):
+    """Run func(*job) for every job, yielding (job, result) as each one finishes."""
+    with process_pool(workers) as executor:
+        if executor is None:
+            for job in jobs:
+                yield job, func(*job)
+            return
+        futures = {executor.submit(func, *job): job for job in jobs}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def map_chunks(func, items: list, workers: int = 1, chunk_size: int = 64, executor: ProcessPoolExecutor = None) -> list:
+    """
+    func(chunk) -> list for consecutive chunks of items; results come back flattened in input order.
+    executor (from process_pool) is used as is, so repeated calls share its workers; without one, workers > 1
+    starts a pool for this call only.
+    """
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), max(1, chunk_size))]
+    if executor is None:
+        workers = min(resolve_workers(workers), len(chunks))
+        if workers > 1:
+            with process_pool(workers) as executor:
+                return map_chunks(func, items, chunk_size=chunk_size, executor=executor)
+    if executor is None or len(chunks) <= 1:
+        return [r for chunk in chunks for r in func(chunk)]
+    return [r for result in executor.map(func, chunks) for r in result]
+
+def page_offsets_path(txt_file) -> Path:
+    return Path(txt_file).with_suffix('.pages')
+
+def write_page_offsets(txt_file, pages: list[str]) -> None:
+    """
+    Sidecar for a PDF-derived .txt: little-endian int32 start offset of every page, plus the text length.
+    Offsets count characters of the text scan_df returns (after string_normalization), as occurrence start / end
+    do; each page is normalized on its own, so only an NFKC composition or zenodo URL across two pages can shift them.
+    """
+    lengths = pl.DataFrame({'text': pages}, schema={'text': pl.String}).select(string_normalization('text').str.len_chars())
+    offsets = array('i', [0])
+    for length in lengths['text']:
+        offsets.append(offsets[-1] + length)
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    with open(page_offsets_path(txt_file), 'wb') as f:
+        offsets.tofile(f)
+
+def load_page_offsets(txt_file):
+    path = page_offsets_path(txt_file)
+    if not path.exists():
+        return None
+    offsets = array('i', path.read_bytes())
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    return offsets
+
+def page_of(offsets, char_idx: int) -> int:
+    """0-based page holding text[char_idx] of the normalized text (scan_df), given the offsets from load_page_offsets."""
+    return max(0, min(bisect_right(offsets, char_idx), len(offsets) - 1) - 1)
+
 def is_doi_link(name: str) -> pl.Expr:
     return pl.col(name).str.starts_with(DOI_LINK)
 
 def string_normalization(name: str) -> pl.Expr:
     return pl.col(name).str.normalize("NFKC").str.replace_all(r"[^\p{Ascii}]", '').str.replace_all(r"https?://zenodo\.org/record/(\d+)", r" 10.5281/zenodo.$1 ")
 
+TEXT_SCHEMA = {'article_id': pl.String, 'text': pl.String}
+TEXT_BATCH_SIZE = 64  # .txt files read per batch when a directory is scanned
+
+def scan_txt_dir(parse_dir: str) -> pl.LazyFrame:
+    """
+    Lazy (article_id, text) of the .txt files of parse_dir, read TEXT_BATCH_SIZE files at a time as the engine pulls
+    batches, so a streaming collect only holds the texts of the batches in flight; files are read only if text is selected.
+    """
+    files = list(Path(parse_dir).glob('*.txt'))
+
+    def read_batches(with_columns, predicate, n_rows, batch_size):
+        left = len(files) if n_rows is None else n_rows
+        for i in range(0, len(files), TEXT_BATCH_SIZE):
+            if left <= 0:
+                return
+            batch = files[i:i + TEXT_BATCH_SIZE]
+            columns = {'article_id': [f.stem for f in batch]}
+            if with_columns is None or 'text' in with_columns or predicate is not None:
+                texts = []
+                for txt_file in batch:
+                    with open(txt_file, 'r') as f:
+                        texts.append(f.read())
+                columns['text'] = texts
+            df = pl.DataFrame(columns, schema={k: TEXT_SCHEMA[k] for k in columns})
+            if predicate is not None:
+                df = df.filter(predicate)
+            df = df.head(left)
+            left -= df.height
+            yield df.select(with_columns) if with_columns is not None else df
+
+    return register_io_source(read_batches, schema=TEXT_SCHEMA)
+
+def scan_df(parse_dir: str) -> pl.LazyFrame:
+    """Lazy (article_id, text) corpus from a corpus .parquet file or a directory of .txt files."""
+    if Path(parse_dir).suffix == '.parquet':
+        lf = pl.scan_parquet(parse_dir).select('article_id', 'text')
+    else:
+        lf = scan_txt_dir(parse_dir)
+    return lf.with_columns(string_normalization('text').alias('text'))
+
 def get_df(parse_dir: str):
-    records = []
-    txt_files = list(Path(parse_dir).glob('*.txt'))
-    for txt_file in txt_files:
-        id_ = txt_file.stem
-        with open(txt_file, 'r') as f:
-            text = f.read()
-        records.append({'article_id': id_, 'text': text})
-    return pl.DataFrame(records).with_columns(string_normalization('text').alias('text'))
+    return scan_df(parse_dir).collect()
+
+STREAMING_CHUNK_SIZE = 256  # articles per streaming batch
+
+def iter_batches(lf: pl.LazyFrame, chunk_size: int = STREAMING_CHUNK_SIZE):
+    """DataFrames of about chunk_size rows of lf, in order, from the streaming engine; lf runs once."""
+    yield from lf.collect_batches(chunk_size=chunk_size)
 
 def assume_type(df: pl.DataFrame) -> pl.DataFrame:
     return (
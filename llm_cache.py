@@ -0,0 +1,83 @@
+import hashlib
+import json
+import sqlite3
+import time
+from helpers import *
+
+"""
+Persistent cache of llm_validate's A/B decisions (SQLite, temp/llm_cache.sqlite)
+- key = sha256(model fingerprint, system prompt, window); the model fingerprint covers the backend, dtype and
+  the model directory's file names / sizes / mtimes, so a new checkpoint or prompt never reuses old answers
+- Stores logprob_a / logprob_b; hits refresh last_used, and when the file grows past max_mb the least recently
+  used rows are deleted down to 90% of it
+"""
+
+l = get_logger()
+
+BATCH = 500  # keys per SQL statement, under SQLite's host-parameter limit
+
+def model_fingerprint(model_path: str, **settings) -> str:
+    """Model directory listing plus scoring settings (backend, dtype, ...)."""
+    path = Path(model_path)
+    files = sorted(f for f in path.rglob('*') if f.is_file()) if path.is_dir() else []
+    listing = [(str(f.relative_to(path)), f.stat().st_size, f.stat().st_mtime_ns) for f in files]
+    return hashlib.sha256(json.dumps([str(path.resolve()), listing, settings], sort_keys=True).encode()).hexdigest()
+
+def decision_key(model: str, prompt: str, window: str) -> str:
+    return hashlib.sha256('\0'.join((model, prompt, window)).encode()).hexdigest()
+
+class DecisionCache:
+    def __init__(self, path='./temp/llm_cache.sqlite', max_mb: float = 512):
+        self.path, self.max_mb = Path(path), max_mb
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS decisions ('
+            'key TEXT PRIMARY KEY, logprob_a REAL, logprob_b REAL, model TEXT, created REAL, last_used REAL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS decisions_last_used ON decisions (last_used)')
+        self.stats = {'hits': 0, 'misses': 0, 'evicted': 0}
+
+    def get_many(self, keys: list[str]) -> dict[str, tuple[float, float]]:
+        found = {}
+        now = time.time()
+        for i in range(0, len(keys), BATCH):
+            chunk = keys[i:i + BATCH]
+            marks = ','.join('?' * len(chunk))
+            found.update((k, (a, b)) for k, a, b in self.db.execute(f'SELECT key, logprob_a, logprob_b FROM decisions WHERE key IN ({marks})', chunk))
+            self.db.execute(f'UPDATE decisions SET last_used = ? WHERE key IN ({marks})', [now, *chunk])
+        self.db.commit()
+        self.stats['hits'] += len(found)
+        self.stats['misses'] += len(keys) - len(found)
+        return found
+
+    def put_many(self, model: str, items: dict[str, tuple[float, float]]) -> None:
+        now = time.time()
+        self.db.executemany(
+            'INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?, ?, ?)',
+            [(k, a, b, model, now, now) for k, (a, b) in items.items()],
+        )
+        self.db.commit()
+        self.evict()
+
+    def size_mb(self) -> float:
+        pages, page_size = self.db.execute('PRAGMA page_count').fetchone()[0], self.db.execute('PRAGMA page_size').fetchone()[0]
+        return pages * page_size / 1e6
+
+    def evict(self) -> int:
+        """Delete least recently used rows until the database is under 90% of max_mb."""
+        size = self.size_mb()
+        if not self.max_mb or size <= self.max_mb:
+            return 0
+        rows = self.db.execute('SELECT COUNT(*) FROM decisions').fetchone()[0]
+        drop = rows - int(rows * 0.9 * self.max_mb / size)
+        self.db.execute('DELETE FROM decisions WHERE key IN (SELECT key FROM decisions ORDER BY last_used LIMIT ?)', (drop,))
+        self.db.commit()
+        self.db.execute('VACUUM')
+        self.stats['evicted'] += drop
+        l.info(f"LLM cache over {self.max_mb} MB ({size:.1f} MB): evicted {drop} of {rows} decisions")
+        return drop
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import math
+import ssl
+import time
+from urllib.parse import urlsplit
+from helpers import *
+from llm_scoring import CHOICES, prompt_parts
+
+"""
+A/B scoring of llm_validate's prompt through a long-lived OpenAI-compatible server (llama.cpp, vLLM serve, ...)
+instead of a model loaded in-process, so one server is shared by many pipeline runs and workers.
+- One POST /v1/completions per window, max_tokens=1, temperature=0, logprobs=TOP_LOGPROBS; logprob_a / logprob_b
+  are the A and B entries of the first token's top logprobs, renormalized over the two like the other backends
+  (-inf when only one of them is in the top list, as in score_vllm)
+- A window with neither A nor B in its top TOP_LOGPROBS is asked again with MAX_LOGPROBS; if they are still
+  missing its score is None (unresolved), which llm_validate decides as B and does not cache
+- asyncio with stdlib streams only: at most `concurrency` requests in flight, over a pool of at most as many
+  HTTP/1.1 keep-alive connections; connection errors, timeouts, 429 and 5xx are retried with exponential backoff
+- Prompts are the chat template of model_path's tokenizer around the window, as build_prompts renders them,
+  so the server must be serving that model; the model name sent is --server-model or the first of GET /v1/models
+- llm_stub_server.py is a small server with the same API for check_llm_client.py
+"""
+
+l = get_logger()
+
+DEFAULT_ENDPOINT = 'http://127.0.0.1:8000/v1'
+TOP_LOGPROBS = 5
+MAX_LOGPROBS = 20  # the OpenAI API's cap on logprobs
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+class ServerError(Exception):
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"HTTP {status}: {body[:200].decode(errors='replace')}")
+        self.status = status
+
+class OpenAIClient:
+    """JSON over HTTP/1.1 keep-alive connections to one endpoint, e.g. http://127.0.0.1:8000/v1."""
+
+    def __init__(self, endpoint: str, concurrency: int = 8, retries: int = 3, timeout: float = 60.0, api_key: str = None):
+        url = urlsplit(endpoint.rstrip('/'))
+        self.host, self.path = url.hostname, url.path
+        self.ssl = ssl.create_default_context() if url.scheme == 'https' else None
+        self.port = url.port or (443 if self.ssl else 80)
+        self.retries, self.timeout = retries, timeout
+        self.headers = {'Host': url.netloc, 'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+        if api_key:
+            self.headers['Authorization'] = f'Bearer {api_key}'
+        self.limit = asyncio.Semaphore(concurrency)
+        self.idle = []  # (reader, writer) pairs free for the next request
+        self.stats = {'requests': 0, 'retries': 0, 'connections': 0}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        while self.idle:
+            _, writer = self.idle.pop()
+            writer.close()
+
+    async def _connect(self):
+        if self.idle:
+            return self.idle.pop()
+        self.stats['connections'] += 1
+        return await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+
+    async def _exchange(self, method: str, path: str, body: bytes):
+        reader, writer = await self._connect()
+        try:
+            headers = {**self.headers, 'Content-Length': str(len(body))}
+            head = f'{method} {self.path}{path} HTTP/1.1\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n'
+            writer.write(head.encode() + body)
+            await writer.drain()
+            status = int((await reader.readuntil(b'\r\n')).split()[1])
+            response = {}
+            while (line := await reader.readuntil(b'\r\n')) != b'\r\n':
+                key, _, value = line.decode('latin-1').partition(':')
+                response[key.strip().lower()] = value.strip()
+            if response.get('transfer-encoding', '').lower() == 'chunked':
+                data = b''
+                while size := int((await reader.readuntil(b'\r\n')).split(b';')[0], 16):
+                    data += (await reader.readexactly(size + 2))[:-2]
+                await reader.readuntil(b'\r\n')
+            else:
+                data = await reader.readexactly(int(response.get('content-length', 0)))
+        except BaseException:
+            writer.close()
+            raise
+        if response.get('connection', '').lower() == 'close':
+            writer.close()
+        else:
+            self.idle.append((reader, writer))
+        return status, response, data
+
+    async def request(self, method: str, path: str, payload: dict = None) -> dict:
+        """Response JSON of one call, retried on connection errors, timeouts and RETRY_STATUS."""
+        body = json.dumps(payload).encode() if payload is not None else b''
+        async with self.limit:
+            for attempt in range(self.retries + 1):
+                self.stats['requests'] += 1
+                delay = 0.5 * 2 ** attempt
+                try:
+                    status, headers, data = await asyncio.wait_for(self._exchange(method, path, body), self.timeout)
+                    if status == 200:
+                        return json.loads(data)
+                    if status not in RETRY_STATUS:
+                        raise ServerError(status, data)
+                    error = ServerError(status, data)
+                    delay = float(headers['retry-after']) if headers.get('retry-after', '').isdigit() else delay
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+                    error = e
+                if attempt == self.retries:
+                    raise error
+                self.stats['retries'] += 1
+                l.debug(f"{method} {path} failed ({error!r}), retry {attempt + 1}/{self.retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def model(self) -> str:
+        return (await self.request('GET', '/models'))['data'][0]['id']
+
+def choice_logprobs(choice: dict) -> tuple[float, float] | None:
+    """
+    (logprob_a, logprob_b) from a completion choice, in the legacy or the llama.cpp logprobs format; None without
+    either, or when both are -inf
+    """
+    logprobs = choice.get('logprobs') or {}
+    if logprobs.get('top_logprobs'):
+        top = logprobs['top_logprobs'][0]
+    else:
+        content = logprobs.get('content') or [{}]
+        top = {t['token']: t['logprob'] for t in content[0].get('top_logprobs') or []}
+    found = {}
+    for token, logprob in top.items():
+        found.setdefault(token.strip(), logprob)  # ' A' and 'A' both count, the likelier one first
+    if not any(c in found for c in CHOICES):
+        return None
+    a, b = (found.get(c, -math.inf) for c in CHOICES)
+    m = max(a, b)
+    if m == -math.inf:
+        return None
+    total = m + math.log(math.exp(a - m) + math.exp(b - m))  # logsumexp: exp(a) underflows to 0 for a < -745
+    return a - total, b - total
+
+async def score_prompts(client: OpenAIClient, prompts: list[str], model: str = None) -> list[tuple[float, float] | None]:
+    model = model or await client.model()
+
+    async def score(prompt, logprobs):
+        response = await client.request('POST', '/completions', {
+            'model': model, 'prompt': prompt, 'max_tokens': 1, 'temperature': 0, 'logprobs': logprobs,
+        })
+        return choice_logprobs(response['choices'][0])
+
+    scores = await asyncio.gather(*(score(prompt, TOP_LOGPROBS) for prompt in prompts))
+    missing = [i for i, s in enumerate(scores) if s is None]
+    client.stats['rescored'] = len(missing)
+    for i, s in zip(missing, await asyncio.gather(*(score(prompts[i], MAX_LOGPROBS) for i in missing))):
+        scores[i] = s
+    return scores
+
+def server_model(endpoint: str = DEFAULT_ENDPOINT, name: str = None) -> str:
+    """name, or the first model the server at endpoint lists."""
+    async def first():
+        async with OpenAIClient(endpoint, 1, api_key=os.environ.get('OPENAI_API_KEY')) as client:
+            return await client.model()
+    return name or asyncio.run(first())
+
+def score_server(windows: list[str], model_path: str, system_prompt: str, endpoint: str = DEFAULT_ENDPOINT,
+                 concurrency: int = 8, retries: int = 3, timeout: float = 60.0, server_model: str = None):
+    """(logprob_a, logprob_b) per window (None = unresolved) from the server at endpoint, plus run stats."""
+    from transformers import AutoTokenizer
+    prefix, suffix = prompt_parts(AutoTokenizer.from_pretrained(model_path), system_prompt)
+
+    async def run():
+        async with OpenAIClient(endpoint, concurrency, retries, timeout, os.environ.get('OPENAI_API_KEY')) as client:
+            return await score_prompts(client, [prefix + window + suffix for window in windows], server_model), client.stats
+
+    start = time.perf_counter()
+    scores, stats = asyncio.run(run())
+    seconds = time.perf_counter() - start
+    unresolved = sum(s is None for s in scores)
+    if stats['rescored']:
+        l.warning(f"{stats['rescored']} windows had neither A nor B in the top {TOP_LOGPROBS} logprobs, "
+                  f"{unresolved} still not in the top {MAX_LOGPROBS}: decided as B and not cached")
+    return scores, {**stats, 'prompts': len(windows), 'concurrency': concurrency, 'seconds': round(seconds, 3),
+                    'prompts_per_s': round(len(windows) / max(seconds, 1e-9), 2), 'unresolved': unresolved}
@@ -0,0 +1,284 @@
+import copy
+import inspect
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from helpers import *
+from llm_cache import model_fingerprint
+
+"""
+CPU scoring of the A/B classification prompt with transformers, no generate loop.
+- PromptScorer, the default, runs every full prompt on its own and reads the A/B logits of its last position,
+  the step generate(max_new_tokens=1) takes; make_scorer(prefix_cache=True) selects PrefixScorer instead,
+  one forward pass per batch, whose parity with generate (check_llm_validate) has not been run against a model yet
+- Every prompt is the chat template around one window with the same system prompt first, so the KV cache of
+  everything before the window is computed once and copied into each batch; only window + template tail run
+- Rows are sorted by token length and cut into batches of at most batch_size rows / max_batch_tokens padded
+  tokens; right padding keeps the real tokens' positions, results come back in input order
+- The last real position's hidden state is projected onto the A and B rows of the LM head only (no 150k-wide
+  logits). log_softmax over those two logits is what vLLM reports with MultipleChoiceLogitsProcessor and
+  max_tokens=1, so A wins when logprob_a >= logprob_b, as in the greedy one-token decode
+- A window whose tokens do not start with the prefix's own tokens (a BPE merge across the boundary) is scored
+  from the full prompt without the cache, so tokenization always matches the rendered template
+- dtype='int8' runs dynamic int8 quantization of every Linear but the LM head (whose A/B rows are read
+  directly) once, saves the whole module under temp/quantized/, and later runs torch.load it with mmap=True
+  instead of reading the fp32 safetensors and quantizing again
+- score_sharded spreads the windows over worker processes, each pinned to its own slice of cores with
+  torch.set_num_threads(len(slice)) and holding one make_scorer scorer; length-sorted chunks stream back as they finish
+  and are put back in input order. Every worker holds its own copy of the weights
+- torch / transformers are imported when a model is loaded, as the rest of llm_validate does
+"""
+
+l = get_logger()
+
+CHOICES = ('A', 'B')
+WINDOW_MARK = '\x00window\x00'
+QUANTIZED_DIR = Path('./temp/quantized')
+SHARD_THREADS = 4  # intra-op threads per worker when not given; small-batch matmuls stop scaling around here
+_shard = {}        # the scorer of a score_sharded worker process
+
+def load_model(model_path: str, dtype: str = 'float32', threads: int = 0):
+    """dtype is a torch dtype name, or int8 for the cached dynamically quantized model."""
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    if threads:
+        torch.set_num_threads(threads)
+    tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+    if dtype == 'int8':
+        return tokenizer, load_quantized(model_path)
+    model = AutoModelForCausalLM.from_pretrained(model_path, trust_remote_code=True, torch_dtype=getattr(torch, dtype), device_map='cpu')
+    return tokenizer, model.eval()
+
+def quantized_path(model_path: str) -> Path:
+    return QUANTIZED_DIR / f"{Path(model_path).name}-{model_fingerprint(model_path)[:16]}-int8.pt"
+
+def load_quantized(model_path: str):
+    """int8 dynamic quantization of the model's Linear layers, built once per checkpoint and memory-mapped after."""
+    import torch
+    from transformers import AutoModelForCausalLM
+    path = quantized_path(model_path)
+    if path.exists():
+        l.info(f"Loading quantized model {path}")
+        return torch.load(path, mmap=True, weights_only=False).eval()
+    l.info(f"Quantizing {model_path} to int8, cached as {path}")
+    model = AutoModelForCausalLM.from_pretrained(model_path, trust_remote_code=True, torch_dtype=torch.float32).eval()
+    head = model.get_output_embeddings()
+    spec = {name: torch.ao.quantization.default_dynamic_qconfig for name, module in model.named_modules() if isinstance(module, torch.nn.Linear) and module is not head}
+    model = torch.ao.quantization.quantize_dynamic(model, spec, dtype=torch.qint8)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')  # own name per process, replace() is atomic
+    torch.save(model, tmp)
+    tmp.replace(path)
+    return model
+
+def prompt_parts(tokenizer, system_prompt: str) -> tuple[str, str]:
+    """The rendered chat template before and after the user message."""
+    messages = [{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': WINDOW_MARK}]
+    rendered = tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+    if rendered.count(WINDOW_MARK) != 1:
+        raise ValueError('chat template does not place the user message verbatim')
+    prefix, suffix = rendered.split(WINDOW_MARK)
+    return prefix, suffix
+
+def build_prompts(tokenizer, system_prompt: str, windows: list[str]) -> list[str]:
+    prefix, suffix = prompt_parts(tokenizer, system_prompt)
+    return [prefix + window + suffix for window in windows]
+
+def choice_ids(tokenizer) -> list[int]:
+    ids = []
+    for choice in CHOICES:
+        tokens = tokenizer.encode(choice, add_special_tokens=False)
+        if len(tokens) != 1:
+            raise ValueError(f"choice {choice!r} is not a single token: {tokens}")
+        ids.append(tokens[0])
+    return ids
+
+def length_buckets(lengths: list[int], batch_size: int, max_batch_tokens: int) -> list[list[int]]:
+    """Indices grouped into batches of similar length, shortest first."""
+    batches, batch = [], []
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        # ascending, so row i is the longest of its batch and sets the padded width
+        if batch and (len(batch) == batch_size or (len(batch) + 1) * lengths[i] > max_batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+class PrefixScorer:
+    """(logprob_a, logprob_b) for windows under one system prompt, reusing the prompt prefix's KV cache."""
+
+    def __init__(self, model, tokenizer, system_prompt: str, batch_size: int = 16, max_batch_tokens: int = 8192):
+        import torch
+        from transformers import DynamicCache
+        self.model, self.tokenizer = model, tokenizer
+        self.batch_size, self.max_batch_tokens = batch_size, max_batch_tokens
+        self.prefix, self.suffix = prompt_parts(tokenizer, system_prompt)
+        self.pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+        # decoder stack with its final norm; the LM head is applied by hand to the two choice rows
+        self.base = model.base_model
+        head = model.get_output_embeddings()
+        ids = choice_ids(tokenizer)
+        with torch.inference_mode():
+            self.choice_weight = head.weight[ids].float()
+            self.choice_bias = head.bias[ids].float() if head.bias is not None else None
+            self.prefix_ids = tokenizer(self.prefix).input_ids
+            self.prefix_cache = self.base(input_ids=torch.tensor([self.prefix_ids]), past_key_values=DynamicCache(), use_cache=True).past_key_values
+        self.stats = {'prompts': 0, 'uncached': 0, 'batches': 0, 'tokens': 0, 'padded_tokens': 0, 'seconds': 0.0}
+
+    def score(self, windows: list[str]) -> list[tuple[float, float]]:
+        start = time.perf_counter()
+        ids = self.tokenizer([self.prefix + window + self.suffix for window in windows]).input_ids
+        n_prefix = len(self.prefix_ids)
+        cached = [i for i, row in enumerate(ids) if row[:n_prefix] == self.prefix_ids]
+        uncached = sorted(set(range(len(ids))) - set(cached))
+        results = [None] * len(ids)
+        for rows, use_cache in ((cached, True), (uncached, False)):
+            tails = [ids[i][n_prefix:] if use_cache else ids[i] for i in rows]
+            for batch in length_buckets([len(t) for t in tails], self.batch_size, self.max_batch_tokens):
+                for j, result in zip(batch, self.forward([tails[j] for j in batch], use_cache)):
+                    results[rows[j]] = result
+        self.stats['prompts'] += len(ids)
+        self.stats['uncached'] += len(uncached)
+        self.stats['seconds'] += time.perf_counter() - start
+        return results
+
+    def forward(self, rows: list[list[int]], use_cache: bool = True) -> list[tuple[float, float]]:
+        """One padded batch of token rows (continuing the prefix when use_cache) to A/B logprobs."""
+        import torch
+        n, width = len(rows), max(map(len, rows))
+        input_ids = torch.full((n, width), self.pad_id, dtype=torch.long)
+        mask = torch.zeros((n, width), dtype=torch.long)
+        for k, row in enumerate(rows):
+            input_ids[k, :len(row)] = torch.tensor(row)
+            mask[k, :len(row)] = 1
+        with torch.inference_mode():
+            kwargs = {}
+            if use_cache:
+                # the forward pass appends to the cache it is given, so each batch gets its own copy
+                cache = copy.deepcopy(self.prefix_cache)
+                cache.batch_repeat_interleave(n)
+                kwargs['past_key_values'] = cache
+                mask = torch.cat([torch.ones((n, len(self.prefix_ids)), dtype=torch.long), mask], dim=1)
+            hidden = self.base(input_ids=input_ids, attention_mask=mask, use_cache=use_cache, **kwargs).last_hidden_state
+            last = hidden[torch.arange(n), torch.tensor([len(row) for row in rows]) - 1].float()
+            logits = last @ self.choice_weight.T
+            if self.choice_bias is not None:
+                logits += self.choice_bias
+            logprobs = torch.log_softmax(logits, dim=-1)
+        self.stats['batches'] += 1
+        self.stats['tokens'] += sum(map(len, rows))
+        self.stats['padded_tokens'] += n * width
+        return [tuple(row) for row in logprobs.tolist()]
+
+class PromptScorer:
+    """
+    (logprob_a, logprob_b) for windows under one system prompt, one whole prompt per forward pass: no shared
+    KV cache, batching or padding, so the A/B logits are the ones generate's first step sees.
+    """
+
+    def __init__(self, model, tokenizer, system_prompt: str):
+        self.model, self.tokenizer = model, tokenizer
+        self.prefix, self.suffix = prompt_parts(tokenizer, system_prompt)
+        self.ids = choice_ids(tokenizer)
+        # logits of the last position only, where transformers supports it (the full row is vocab-wide per token)
+        self.keep = {'logits_to_keep': 1} if 'logits_to_keep' in inspect.signature(model.forward).parameters else {}
+        self.stats = {'prompts': 0, 'uncached': 0, 'batches': 0, 'tokens': 0, 'padded_tokens': 0, 'seconds': 0.0}
+
+    def score(self, windows: list[str]) -> list[tuple[float, float]]:
+        import torch
+        start = time.perf_counter()
+        results = []
+        for window in windows:
+            input_ids = self.tokenizer(self.prefix + window + self.suffix, return_tensors='pt').input_ids
+            with torch.inference_mode():
+                logits = self.model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), **self.keep).logits
+                results.append(tuple(torch.log_softmax(logits[0, -1, self.ids].float(), dim=-1).tolist()))
+            self.stats['tokens'] += input_ids.shape[1]
+            self.stats['padded_tokens'] += input_ids.shape[1]
+        self.stats['prompts'] += len(windows)
+        self.stats['uncached'] += len(windows)
+        self.stats['batches'] += len(windows)
+        self.stats['seconds'] += time.perf_counter() - start
+        return results
+
+def make_scorer(model, tokenizer, system_prompt: str, batch_size: int = 16, max_batch_tokens: int = 8192, prefix_cache: bool = False):
+    """PromptScorer, or PrefixScorer with prefix_cache (batch_size / max_batch_tokens only apply to it)."""
+    if prefix_cache:
+        return PrefixScorer(model, tokenizer, system_prompt, batch_size, max_batch_tokens)
+    return PromptScorer(model, tokenizer, system_prompt)
+
+def available_cores() -> list[int]:
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+
+def core_slices(workers: int = 0, threads: int = 0) -> list[list[int]]:
+    """
+    CPU ids per worker. 0 = auto: threads defaults to SHARD_THREADS (or cores / workers), workers to as many
+    slices as fit; more workers x threads than cores wraps around.
+    """
+    cores = available_cores()
+    if not threads:
+        threads = len(cores) // workers if workers else SHARD_THREADS
+    threads = max(1, min(threads, len(cores)))
+    workers = workers or max(1, len(cores) // threads)
+    return [[cores[(k * threads + j) % len(cores)] for j in range(threads)] for k in range(workers)]
+
+def _init_shard(slices, model_path, dtype, system_prompt, batch_size, max_batch_tokens, prefix_cache):
+    cores = slices.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    tokenizer, model = load_model(model_path, dtype, threads=len(cores))
+    _shard['scorer'] = make_scorer(model, tokenizer, system_prompt, batch_size, max_batch_tokens, prefix_cache)
+
+def _score_shard(chunk: int, windows: list[str]):
+    start = time.perf_counter()
+    scores = _shard['scorer'].score(windows)
+    return chunk, scores, os.getpid(), time.perf_counter() - start
+
+def score_sharded(windows: list[str], model_path: str, system_prompt: str, dtype: str = 'float32', workers: int = 0, threads: int = 0,
+                  batch_size: int = 16, max_batch_tokens: int = 8192, chunk_size: int = 0, prefix_cache: bool = False):
+    """(logprob_a, logprob_b) per window from pinned worker processes, plus run stats (prompts/s, utilization)."""
+    slices = core_slices(workers, threads)
+    if dtype == 'int8' and not quantized_path(model_path).exists():
+        load_quantized(model_path)  # quantize once here; the workers then only mmap the cached file
+    chunk_size = chunk_size or batch_size * 4
+    order = sorted(range(len(windows)), key=lambda i: len(windows[i]))
+    chunks = [order[i:i + chunk_size] for i in range(0, len(order), chunk_size)]
+    ctx = multiprocessing.get_context('spawn')  # fresh interpreters: no forked torch thread pools
+    queue = ctx.Queue()
+    for cores in slices:
+        queue.put(cores)
+    results, busy, done = [None] * len(windows), {}, 0
+    start = time.perf_counter()
+    initargs = (queue, model_path, dtype, system_prompt, batch_size, max_batch_tokens, prefix_cache)
+    with ProcessPoolExecutor(len(slices), mp_context=ctx, initializer=_init_shard, initargs=initargs) as executor:
+        futures = [executor.submit(_score_shard, k, [windows[i] for i in chunk]) for k, chunk in enumerate(chunks)]
+        for future in as_completed(futures):
+            k, scores, pid, seconds = future.result()
+            for i, score in zip(chunks[k], scores):
+                results[i] = score
+            busy[pid] = busy.get(pid, 0.0) + seconds
+            if (done + len(scores)) * 10 // len(windows) > done * 10 // len(windows):
+                l.debug(f"{done + len(scores)}/{len(windows)} windows scored")
+            done += len(scores)
+    wall = time.perf_counter() - start
+    stats = {
+        'workers': len(slices), 'threads': len(slices[0]), 'cores': len(available_cores()), 'prompts': len(windows),
+        'seconds': round(wall, 3), 'prompts_per_s': round(len(windows) / max(wall, 1e-9), 2),
+        # share of the workers' wall time spent scoring; the rest is model loading, stragglers and the last chunks
+        'utilization': round(sum(busy.values()) / (len(slices) * max(wall, 1e-9)), 3),
+    }
+    return results, stats
+
+def score_vllm(model_path: str, system_prompt: str, windows: list[str]) -> list[tuple[float, float]]:
+    """The GPU path: vLLM with MultipleChoiceLogitsProcessor, one greedy token, logprobs of A and B."""
+    import vllm
+    from logits_processor_zoo.vllm import MultipleChoiceLogitsProcessor
+    llm = vllm.LLM(model_path, trust_remote_code=True, enable_prefix_caching=True)
+    tokenizer = llm.get_tokenizer()
+    mclp = MultipleChoiceLogitsProcessor(tokenizer, choices=list(CHOICES))
+    params = vllm.SamplingParams(seed=777, temperature=0, skip_special_tokens=True, max_tokens=1, logits_processors=[mclp], logprobs=len(mclp.choices))
+    outputs = llm.generate(build_prompts(tokenizer, system_prompt, windows), params, use_tqdm=True)
+    logprobs = [{lp.decoded_token: lp.logprob for lp in output.outputs[0].logprobs[0].values()} for output in outputs]
+    return [tuple(d.get(choice, float('-inf')) for choice in CHOICES) for d in logprobs]
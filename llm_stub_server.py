@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import json
+import math
+import re
+import threading
+import zlib
+from helpers import *
+
+"""
+Tiny OpenAI-compatible server for llm_client without a model: python llm_stub_server.py --port 8000
+- GET /v1/models and POST /v1/completions with HTTP/1.1 keep-alive; the completion is one token whose top
+  logprobs hold A and B, A being the likelier one when the prompt matches STUB_DATA_RE (stub_choice)
+- --fail-every k answers every k-th request with 503 and --delay sleeps before answering, to exercise
+  llm_client's retries and concurrency; stats counts requests, connections and the most requests in flight
+- --hide-every k puts STUB_FILLER tokens ahead of A and B for prompts with crc32 % k == 0, so they only show
+  up with logprobs > len(STUB_FILLER), and leaves them out altogether for crc32 % k == 1 (stub_hidden)
+"""
+
+l = get_logger()
+
+STUB_MODEL = 'stub'
+STUB_DATA_RE = re.compile(r'\b(?:data(?:set)?|deposited|repository|zenodo|dryad|figshare)\b', re.I)
+
+STUB_FILLER = ['the', 'of', 'and', 'to', 'in', 'is', 'that', 'for']
+
+def stub_choice(prompt: str) -> str:
+    return 'A' if STUB_DATA_RE.search(prompt) else 'B'
+
+def stub_hidden(prompt: str, hide_every: int) -> str | None:
+    """'late' when A/B follow STUB_FILLER in the top list, 'never' when they are left out, else None."""
+    if not hide_every:
+        return None
+    return {0: 'late', 1: 'never'}.get(zlib.crc32(prompt.encode()) % hide_every)
+
+class StubServer:
+    def __init__(self, host='127.0.0.1', port=0, fail_every=0, delay=0.0, hide_every=0):
+        self.host, self.port, self.fail_every, self.delay, self.hide_every = host, port, fail_every, delay, hide_every
+        self.stats = {'requests': 0, 'failed': 0, 'connections': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    def completion(self, payload: dict) -> dict:
+        prompt = payload.get('prompt', '')
+        winner = stub_choice(prompt)
+        top = {' ' + winner: -0.05, winner: -0.2, ('B' if winner == 'A' else 'A'): -3.0, '\n': -4.0}
+        hidden = stub_hidden(prompt, self.hide_every)
+        if hidden:
+            filler = STUB_FILLER * 3 if hidden == 'never' else STUB_FILLER
+            top = {**{f'{t}{k}': -0.01 * (k + 1) for k, t in enumerate(filler)}, **({} if hidden == 'never' else top)}
+        top = dict(list(top.items())[:payload.get('logprobs') or 1])
+        return {
+            'object': 'text_completion', 'model': payload.get('model', STUB_MODEL),
+            'choices': [{'index': 0, 'text': winner, 'finish_reason': 'length',
+                         'logprobs': {'tokens': [winner], 'token_logprobs': [math.log(0.9)], 'top_logprobs': [top]}}],
+        }
+
+    async def respond(self, method: str, path: str, body: bytes) -> tuple[int, dict]:
+        self.stats['requests'] += 1
+        self.stats['in_flight'] += 1
+        self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if self.fail_every and self.stats['requests'] % self.fail_every == 0:
+                self.stats['failed'] += 1
+                return 503, {'error': 'stub failure'}
+            if method == 'GET' and path.endswith('/models'):
+                return 200, {'object': 'list', 'data': [{'id': STUB_MODEL, 'object': 'model'}]}
+            if method == 'POST' and path.endswith('/completions'):
+                return 200, self.completion(json.loads(body))
+            return 404, {'error': f'no route {method} {path}'}
+        finally:
+            self.stats['in_flight'] -= 1
+
+    async def handle(self, reader, writer):
+        self.stats['connections'] += 1
+        try:
+            while line := await reader.readline():
+                method, path, _ = line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await self.respond(method, path, body)
+                data = json.dumps(payload).encode()
+                writer.write(f'HTTP/1.1 {status} Stub\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n'.encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, started: threading.Event = None):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        l.info(f"stub server on http://{self.host}:{self.port}/v1")
+        if started:
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+    def start(self) -> str:
+        """Serve from a daemon thread; returns the endpoint."""
+        started = threading.Event()
+        threading.Thread(target=asyncio.run, args=(self.serve(started),), daemon=True).start()
+        started.wait()
+        return f'http://{self.host}:{self.port}/v1'
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--fail-every', type=int, default=0, help='Answer every k-th request with 503')
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds before every answer')
+    parser.add_argument('--hide-every', type=int, default=0, help='Push A/B down or out of the top logprobs for some prompts')
+    args = parser.parse_args()
+    asyncio.run(StubServer(args.host, args.port, args.fail_every, args.delay, args.hide_every).serve())
@@ -1,7 +1,16 @@
+import argparse
+import json
+import re
 import polars as pl
 import os
 
 from helpers import *
+from profiling import metrics, timed, path_bytes, add_profile_args, start_profiling
+from doi_prefixes import PAPER_PREFIXES_EXTENDED, is_paper_prefix
+from llm_cache import DecisionCache, decision_key, model_fingerprint
+from llm_client import DEFAULT_ENDPOINT, score_server, server_model as resolve_server_model
+from llm_scoring import load_model, make_scorer, score_sharded, score_vllm
+from post_filter import CONTEXT_RE
 
 l = get_logger()
 
@@ -90,54 +99,232 @@ Few-shot examples
 "Protein structure described in Science (DOI 10.1126/science.abc1234)." → B
 """.strip()
 
-def build_df():
-    df = pl.read_parquet('./temp/extracted.parquet')
-    df.filter(~is_doi_link('dataset_id')).select('article_id', 'dataset_id').write_csv('./temp/accid_sub.csv')
+@timed()
+def build_df(extracted_path='./temp/extracted.parquet', accid_sub_path='./temp/accid_sub.csv'):
+    df = pl.read_parquet(extracted_path)
+    df.filter(~is_doi_link('dataset_id')).select('article_id', 'dataset_id').write_csv(accid_sub_path)
     return df.filter(is_doi_link('dataset_id'))
 
-def build_prompt(tokenizer, df):
-    prompts = []
-    for doi, text in df.select('dataset_id', 'window').rows():
-        messages = [{'role':'system','content': SYS_PROMPT_CLASSIFY_DOI}, {'role':'user', 'content': text}]
-        prompts.append(tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False))
-    return df.with_columns(pl.Series('prompt', prompts))
+# 规则级联：有把握的DOI直接用规则判定，剩下的才交给LLM
+# repository prefixes are the "Name: 10.xxxx" lines of the prompt's rule 1.1
+REPOSITORY_PREFIXES = [p.lower() for p in re.findall(r"^\s*[^:\n]+:\s*(10\.\d+(?:/\S+)?)\s*$", SYS_PROMPT_CLASSIFY_DOI, re.M)]
+REPOSITORY_RE = rf"^(?:{'|'.join(re.escape(p) for p in REPOSITORY_PREFIXES)})[/.]"
+BLACKLIST_PATH = './temp/doi_prefix_blacklist.txt'
+CONTEXT_HITS = 2  # CONTEXT_RE matches that make a window data without asking the LLM
+TIERS = ['repository', 'paper_prefix', 'context', 'llm']
 
-if __name__=='__main__':
-    os.environ["VLLM_USE_V1"] = "1"  # CPU backend需要V1
-    import vllm
-    from logits_processor_zoo.vllm import MultipleChoiceLogitsProcessor
-    model_path = "./models/qwen2.5"
-    # 尝试使用transformers库代替vLLM进行CPU推理
-    from transformers import AutoTokenizer, AutoModelForCausalLM
-    import torch
-    
-    # 使用transformers库加载模型
-    tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-    model = AutoModelForCausalLM.from_pretrained(
-        model_path, 
-        trust_remote_code=True,
-        torch_dtype=torch.float16,
-        device_map="cpu",
-        # 禁用量化相关参数
-        attn_implementation="eager"
+def load_prefix_blacklist(path=BLACKLIST_PATH) -> list[str]:
+    """Publisher prefixes written by getid_xml_blacklist.py (a JSON list); empty when not built yet."""
+    return json.loads(Path(path).read_text()) if path and Path(path).exists() else []
+
+@timed()
+def cascade(df, blacklist_path=BLACKLIST_PATH, context_hits=CONTEXT_HITS):
+    """
+    tier of every DOI row, first match wins, and type (True = A) for the rule tiers; 'llm' rows get a null type.
+    - repository: a data repository prefix from SYS_PROMPT_CLASSIFY_DOI -> A
+    - paper_prefix: a publisher prefix (PAPER_PREFIXES_EXTENDED + blacklist) with no CONTEXT_RE word nearby -> B,
+      what post_filter drops for its shorter list
+    - context: any other prefix with at least context_hits CONTEXT_RE matches in the window -> A
+    """
+    doi = pl.col('dataset_id').str.strip_prefix(DOI_LINK)
+    hits = pl.col('window').fill_null('').str.count_matches(CONTEXT_RE)
+    paper = is_paper_prefix('dataset_id', PAPER_PREFIXES_EXTENDED + load_prefix_blacklist(blacklist_path))
+    tier = (
+        pl.when(doi.str.contains(REPOSITORY_RE)).then(pl.lit('repository'))
+        .when(paper & (hits == 0)).then(pl.lit('paper_prefix'))
+        .when(~paper & (hits >= context_hits)).then(pl.lit('context'))
+        .otherwise(pl.lit('llm'))
+    )
+    return df.with_columns(tier=tier).with_columns(
+        type=pl.when(pl.col('tier') == 'llm').then(pl.lit(None, dtype=pl.Boolean)).otherwise(pl.col('tier') != 'paper_prefix')
     )
-    # tokenizer已经在上面定义了
-    df = build_df()
-    df = build_prompt(tokenizer, df)
-    prompts = df['prompt'].to_list()
-    mclp = MultipleChoiceLogitsProcessor(tokenizer, choices=["A", "B"])
-    outputs = llm.generate(prompts, vllm.SamplingParams(seed=777, temperature=0, skip_special_tokens=True, max_tokens=1, logits_processors=[mclp], logprobs=len(mclp.choices)), use_tqdm=True)
-    logprobs = [{lp.decoded_token: lp.logprob for lp in list(lps)} for lps in [output.outputs[0].logprobs[0].values() for output in outputs]]
-    choices = [max(d, key=d.get) for d in logprobs]
-    types = {'A': True, 'B': False}
-    choices = [types[c] for c in choices]
-    df = df.with_columns(pl.Series('type', choices))
-    df.filter(pl.col('type')).select('article_id', 'dataset_id').write_csv('./temp/doi_sub.csv')
-    df = pl.concat([pl.read_csv('./temp/doi_sub.csv'), pl.read_csv('./temp/accid_sub.csv')])
-    df = assume_type(df)
-    df.select(['article_id', 'dataset_id', 'type']).with_row_index(name='row_id').write_csv('./output/submission.csv')
-    if not IS_KAGGLE_SUBMISSION:
-        results = evaluate(df)
-        for r in results: l.info(r) 
-        results = evaluate(df, on=['article_id', 'dataset_id', 'type'])
-        for r in results: l.info(r)
+
+def tier_report(df) -> pl.DataFrame:
+    """rows and share of every tier, and the accuracy of its type against train_labels.csv when that exists."""
+    report = df.group_by('tier').agg(rows=pl.len()).with_columns(share=pl.col('rows') / pl.col('rows').sum())
+    labels = COMP_DIR / 'train_labels.csv'
+    if labels.exists():
+        gt = pl.read_csv(labels).filter(pl.col('type') != 'Missing').select('article_id', 'dataset_id').unique()
+        truth = df.join(gt.with_columns(is_data=pl.lit(True)), on=['article_id', 'dataset_id'], how='left')
+        accuracy = truth.group_by('tier').agg(accuracy=(pl.col('type') == pl.col('is_data').fill_null(False)).mean())
+        report = report.join(accuracy, on='tier', how='left')
+    order = pl.DataFrame({'tier': TIERS})
+    return order.join(report, on='tier', how='left').with_columns(pl.col('rows').fill_null(0), pl.col('share').fill_null(0.0))
+
+def score_windows(windows, model_path='./models/qwen2.5', backend='transformers', dtype='float32', batch_size=16, max_batch_tokens=8192, threads=0, workers=1,
+                  prefix_cache=False, endpoint=DEFAULT_ENDPOINT, concurrency=8, retries=3, server_model=None):
+    """
+    (logprob_a, logprob_b) for every window; prefix_cache scores them with the batched shared-prefix scorer instead
+    of one prompt per forward pass, workers != 1 shards them over processes (0 = from the core count),
+    backend='openai' sends them to the server at endpoint with at most concurrency requests in flight; a window
+    whose A/B the server never ranks in its top logprobs gets None.
+    """
+    if backend == 'openai':
+        with metrics('score_server', rows_in=len(windows)) as s:
+            scores, stats = score_server(windows, model_path, SYS_PROMPT_CLASSIFY_DOI, endpoint, concurrency, retries, server_model=server_model)
+            s.update(rows_out=len(scores), **stats)
+        l.info(f"{stats['prompts']} prompts in {stats['seconds']:.1f}s: {stats['prompts_per_s']:.2f} prompts/s from {endpoint}, "
+               f"{stats['concurrency']} in flight, {stats['connections']} connections, {stats['retries']} retries")
+        return scores
+    if backend == 'vllm':
+        os.environ["VLLM_USE_V1"] = "1"  # CPU backend需要V1
+        return score_vllm(model_path, SYS_PROMPT_CLASSIFY_DOI, windows)
+    if workers != 1:
+        with metrics('score_sharded', rows_in=len(windows)) as s:
+            scores, stats = score_sharded(windows, model_path, SYS_PROMPT_CLASSIFY_DOI, dtype, workers, threads, batch_size, max_batch_tokens,
+                                          prefix_cache=prefix_cache)
+            s.update(rows_out=len(scores), **stats)
+        l.info(f"{stats['prompts']} prompts in {stats['seconds']:.1f}s: {stats['prompts_per_s']:.2f} prompts/s on {stats['workers']} workers "
+               f"x {stats['threads']} threads ({stats['cores']} cores), worker utilization {stats['utilization']:.0%}")
+        return scores
+    # transformers库做CPU推理；prefix_cache时系统提示的KV cache只算一次
+    with metrics('load_model', bytes_read=path_bytes(model_path)):
+        tokenizer, model = load_model(model_path, dtype, threads)
+        scorer = make_scorer(model, tokenizer, SYS_PROMPT_CLASSIFY_DOI, batch_size, max_batch_tokens, prefix_cache)
+    with metrics('score') as s:
+        scores = scorer.score(windows)
+        stats = scorer.stats
+        s.update(rows_out=len(scores), prompts_per_s=round(stats['prompts'] / max(stats['seconds'], 1e-9), 2), **stats)
+    l.info(f"{stats['prompts']} prompts in {stats['seconds']:.1f}s: {stats['prompts'] / max(stats['seconds'], 1e-9):.2f} prompts/s, "
+           f"{stats['batches']} batches, {stats['tokens']} tokens ({stats['padded_tokens']} padded), {stats['uncached']} without the prefix cache")
+    return scores
+
+def cached_scores(windows, model_path='./models/qwen2.5', backend='transformers', dtype='float32', cache_path='./temp/llm_cache.sqlite', cache_mb=512, **options):
+    """
+    (logprob_a, logprob_b) for every window, None where unresolved. Identical windows are scored once, and decisions
+    already in the cache at cache_path (None = no cache) are not scored again. options go to score_windows.
+    """
+    unique = list(dict.fromkeys(windows))
+    settings = {'backend': backend, 'dtype': dtype}
+    if options.get('prefix_cache'):
+        settings['scorer'] = 'prefix_cache'  # batching / padding can move the logprobs a little
+    if backend == 'openai':
+        # the answers come from whatever the server runs, not from model_path
+        endpoint = options.get('endpoint', DEFAULT_ENDPOINT).rstrip('/')
+        options['server_model'] = resolve_server_model(endpoint, options.get('server_model'))
+        settings.update(endpoint=endpoint, server_model=options['server_model'])
+    model = model_fingerprint(model_path, **settings)
+    keys = {window: decision_key(model, SYS_PROMPT_CLASSIFY_DOI, window) for window in unique}
+    cache = DecisionCache(cache_path, cache_mb) if cache_path else None
+    known = cache.get_many(list(keys.values())) if cache else {}
+    todo = [window for window in unique if keys[window] not in known]
+    l.info(f"{model_path}: {len(windows)} windows, {len(unique)} unique, {len(unique) - len(todo)} from the cache, {len(todo)} to score")
+    new = score_windows(todo, model_path, backend, dtype=dtype, **options) if todo else []
+    scored = {keys[window]: s for window, s in zip(todo, new)}
+    if cache:
+        cache.put_many(model, {k: s for k, s in scored.items() if s is not None})
+        cache.close()
+    known.update(scored)
+    return [known[keys[window]] for window in windows]
+
+def logprob_columns(scores, prefix=''):
+    """Unresolved (None) scores become nulls."""
+    logprob_a, logprob_b = zip(*(s or (None, None) for s in scores)) if scores else ((), ())
+    return [pl.Series(f'{prefix}logprob_a', logprob_a, dtype=pl.Float64), pl.Series(f'{prefix}logprob_b', logprob_b, dtype=pl.Float64)]
+
+def classify(df, model_path='./models/qwen2.5', small_model_path=None, margin=2.0, small_endpoint=None, small_server_model=None, **options):
+    """
+    logprob_a / logprob_b and type (True = A, data) for every window of df; options go to cached_scores.
+    With small_model_path every window is scored by the small model first, and only those whose
+    |logprob_a - logprob_b| is below margin (or unresolved) are scored again by model_path. small_logprob_* /
+    large_logprob_* keep both (large is null where the small model was trusted), logprob_* is the one used,
+    escalated says which. With backend='openai' the small model is small_server_model at small_endpoint
+    (default: endpoint), one of which must be given. Windows left unresolved are B.
+    """
+    windows = df['window'].to_list()
+    with metrics('classify', rows_in=len(windows)) as m:
+        if small_model_path is None:
+            df = df.with_columns(*logprob_columns(cached_scores(windows, model_path, **options)))
+        else:
+            small_options = options
+            if options.get('backend') == 'openai':
+                if small_endpoint is None and small_server_model is None:
+                    raise ValueError('backend openai with small_model_path needs small_endpoint or small_server_model, '
+                                     'otherwise both passes ask the same server model')
+                small_options = {**options, 'endpoint': small_endpoint or options.get('endpoint', DEFAULT_ENDPOINT), 'server_model': small_server_model}
+            small = df.with_columns(*logprob_columns(cached_scores(windows, small_model_path, **small_options), 'small_'))
+            escalate = ((pl.col('small_logprob_a') - pl.col('small_logprob_b')).abs() < margin).fill_null(True)
+            todo = small.with_row_index('i').filter(escalate)
+            large = todo.select('i', *logprob_columns(cached_scores(todo['window'].to_list(), model_path, **options), 'large_'))
+            df = small.with_row_index('i').join(large, on='i', how='left').drop('i').with_columns(
+                escalated=escalate,
+                logprob_a=pl.when(escalate).then('large_logprob_a').otherwise('small_logprob_a'),
+                logprob_b=pl.when(escalate).then('large_logprob_b').otherwise('small_logprob_b'),
+            )
+            l.info(f"escalated {todo.height} of {len(windows)} windows (margin < {margin}) to {model_path}")
+            m['escalated'] = todo.height
+        m['rows_out'] = df.height
+    return df.with_columns(type=(pl.col('logprob_a') >= pl.col('logprob_b')).fill_null(False))
+
+SCORE_COLUMNS = ['logprob_a', 'logprob_b', 'small_logprob_a', 'small_logprob_b', 'large_logprob_a', 'large_logprob_b', 'escalated']
+
+def main(extracted_path='./temp/extracted.parquet', doi_sub_path='./temp/doi_sub.csv', accid_sub_path='./temp/accid_sub.csv',
+         submission_path='./temp/submission_llm.csv', scores_path='./temp/doi_scores.parquet', use_cascade=True,
+         blacklist_path=BLACKLIST_PATH, context_hits=CONTEXT_HITS, **options):
+    """
+    options go to classify (model_path, small_model_path, margin, backend, dtype, cache_path, cache_mb, batch_size, ...).
+    Every DOI window with its tier, type and the logprobs it was decided on is kept at scores_path.
+    """
+    with metrics('llm_validate', bytes_read=path_bytes(extracted_path)) as run:
+        df = build_df(extracted_path, accid_sub_path).with_row_index('row')
+        if use_cascade:
+            df = cascade(df, blacklist_path, context_hits)
+        else:
+            df = df.with_columns(tier=pl.lit('llm'), type=pl.lit(None, dtype=pl.Boolean))
+        routed = df.filter(pl.col('tier') == 'llm')
+        df = pl.concat([df.filter(pl.col('tier') != 'llm'), classify(routed, **options)], how='diagonal').sort('row')
+        report = tier_report(df)
+        for tier, rows, share, *accuracy in report.rows():
+            l.info(f"tier {tier:<13} {rows:>6} rows {share:7.1%}" + (f"  accuracy {accuracy[0]:.3f}" if accuracy and accuracy[0] is not None else ''))
+        run['routed_to_llm'] = routed.height
+        l.info(f"{routed.height} of {df.height} DOI windows ({routed.height / max(df.height, 1):.1%}) went to the LLM")
+        score_columns = [c for c in SCORE_COLUMNS if c in df.columns]
+        df.select('row', 'article_id', 'dataset_id', 'tier', 'type', *score_columns).write_parquet(scores_path)
+        df.filter(pl.col('type')).select('article_id', 'dataset_id').write_csv(doi_sub_path)
+        df = pl.concat([pl.read_csv(doi_sub_path), pl.read_csv(accid_sub_path)])
+        df = assume_type(df)
+        df.select(['article_id', 'dataset_id', 'type']).with_row_index(name='row_id').write_csv(submission_path)
+        run.update(rows_out=df.height, bytes_written=path_bytes(submission_path))
+        if not IS_KAGGLE_SUBMISSION:
+            with metrics('evaluate'):
+                results = evaluate(df)
+                for r in results: l.info(r) 
+                results = evaluate(df, on=['article_id', 'dataset_id', 'type'])
+                for r in results: l.info(r)
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-path', type=str, default='./models/qwen2.5')
+    parser.add_argument('--small-model-path', type=str, default=None, help='Score with this model first and escalate only low-margin windows')
+    parser.add_argument('--margin', type=float, default=2.0, help='|logprob_a - logprob_b| of the small model below which the large one decides')
+    parser.add_argument('--backend', choices=['transformers', 'vllm', 'openai'], default='transformers',
+                        help='transformers = CPU in this process, openai = a running OpenAI-compatible server at --endpoint')
+    parser.add_argument('--prefix-cache', action='store_true', help='transformers: batched forward passes reusing the system prompt KV cache '
+                        '(faster; not yet checked against generate, see check_llm_validate.py)')
+    parser.add_argument('--batch-size', type=int, default=16, help='Windows per forward pass with --prefix-cache')
+    parser.add_argument('--max-batch-tokens', type=int, default=8192, help='Cap on padded window tokens per forward pass with --prefix-cache')
+    parser.add_argument('--dtype', type=str, default='float32', help='torch dtype of the weights (bfloat16 halves memory, fast only with AVX512-BF16/AMX), '
+                        'or int8: dynamic int8 Linear layers, quantized once and cached under temp/quantized (opt-in until check_quantized.py '
+                        'has been run against the model)')
+    parser.add_argument('--threads', type=int, default=0, help='torch.set_num_threads, per worker when sharded (0 = torch default / auto)')
+    parser.add_argument('--workers', type=int, default=1, help='Scoring processes pinned to core slices (0 = from the core count); '
+                        'default 1 = in this process, sharding is opt-in until benchmarks/llm_shards.py has been run against the model')
+    parser.add_argument('--endpoint', type=str, default=DEFAULT_ENDPOINT, help='Base URL of the server for --backend openai')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight to the server')
+    parser.add_argument('--retries', type=int, default=3, help='Retries of a failed request, with exponential backoff')
+    parser.add_argument('--server-model', type=str, default=None, help='Model name sent to the server (default: the first it lists)')
+    parser.add_argument('--small-endpoint', type=str, default=None, help='Server of the small model for --backend openai (default: --endpoint)')
+    parser.add_argument('--small-server-model', type=str, default=None, help='Name of the small model on its server')
+    parser.add_argument('--cache', dest='cache_path', type=str, default='./temp/llm_cache.sqlite', help='Decision cache; "" to score everything again')
+    parser.add_argument('--cache-mb', type=float, default=512, help='Evict least recently used decisions past this size')
+    parser.add_argument('--scores', dest='scores_path', type=str, default='./temp/doi_scores.parquet', help='Where the scored DOI windows are kept')
+    parser.add_argument('--no-cascade', dest='use_cascade', action='store_false', help='Send every DOI window to the LLM')
+    parser.add_argument('--blacklist', dest='blacklist_path', type=str, default=BLACKLIST_PATH, help='Extra publisher prefixes for the paper_prefix tier')
+    parser.add_argument('--context-hits', type=int, default=CONTEXT_HITS, help='CONTEXT_RE matches that settle a window as data')
+    add_profile_args(parser)
+    args = parser.parse_args()
+    if args.backend == 'openai' and args.small_model_path and not (args.small_endpoint or args.small_server_model):
+        parser.error('--backend openai with --small-model-path needs --small-endpoint or --small-server-model')
+    start_profiling(args)
+    options = {k: v for k, v in vars(args).items() if not k.startswith('profile')}
+    main(**{**options, 'cache_path': args.cache_path or None})
@@ -0,0 +1,295 @@
+import argparse
+import ast
+import hashlib
+import importlib
+import json
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from helpers import *
+from profiling import RUN_ID, add_profile_args, start_profiling
+from parse_manifest import file_digest
+
+"""
+Pipeline runner: python mdc.py run --until post_filter
+- STAGES declares every step: the function it runs, its input / output paths and config, and the
+  stages it depends on; inputs, outputs and config are passed to the function as keyword arguments
+- A stage's fingerprint hashes its config and paths, the source of its module plus every local module it imports,
+  the fingerprints of its dependencies and the content of its external inputs (paths no stage writes)
+- A stage is skipped when its fingerprint matches the last successful run and its outputs exist;
+  everything downstream of a stage that runs is rerun too
+- Ready stages run concurrently (--jobs), each in its own python process, so the PDF and XML branches overlap
+- Fingerprints are kept in temp/pipeline_state.json; `python mdc.py list` shows what would run
+"""
+
+l = get_logger()
+
+ROOT = Path(__file__).resolve().parent
+STATE_PATH = Path(os.getenv("MDC_STATE", "temp/pipeline_state.json"))
+
+# in dependency order; paths are the ones the scripts' __main__ blocks use
+STAGES = [
+    {
+        'name': 'parse_pdf', 'run': 'parse_com:pdf_to_txt', 'deps': [],
+        'inputs': {'pdf_dir': str(PDF_DIR)}, 'outputs': {'output_dir': 'temp/parse'},
+        'config': {'workers': 1},
+    },
+    {
+        'name': 'parse_xml', 'run': 'parse_com:batch_convert_xml_folder', 'deps': [],
+        'inputs': {'input_folder': 'data/train/XML'}, 'outputs': {'output_folder': 'temp/parse_xml'},
+        'config': {'workers': 1, 'engine': 'etree'},
+    },
+    {
+        'name': 'parse_combine', 'run': 'parse_com:parse_combine', 'deps': [],
+        'inputs': {'pdf_dir': str(PDF_DIR), 'xml_dir': 'data/train/XML'}, 'outputs': {'output_dir': 'temp/parse_combine'},
+        'config': {'workers': 1, 'xml_engine': 'etree'},
+    },
+    {
+        'name': 'getid', 'run': 'getid:main', 'deps': ['parse_pdf'],
+        'inputs': {'input_dir': 'temp/parse'},
+        'outputs': {'parquet_dir': 'temp/extracted.parquet', 'output_dir': 'temp/submission.csv'},
+        'config': {'workers': 1},
+    },
+    {
+        'name': 'getid_xml', 'run': 'getid_xml:main', 'deps': ['parse_xml'],
+        'inputs': {'input_dir': 'temp/parse_xml'},
+        'outputs': {'parquet_dir': 'temp/extracted.parquet_xml', 'output_dir': 'temp/submission_xml.csv'},
+        'config': {'workers': 1},
+    },
+    {
+        'name': 'getid_xml_3', 'run': 'getid_xml_3:main', 'deps': ['parse_xml'],
+        'inputs': {'input_dir': 'temp/parse_xml'},
+        'outputs': {'parquet_dir': 'temp/extracted.parquet_xml_3', 'output_dir': 'temp/submission_xml_3.csv'},
+        'reads': ['confidence_rules.json'],
+    },
+    {
+        'name': 'getid_xml_5', 'run': 'getid_xml_5:main', 'deps': ['parse_combine'],
+        'inputs': {'input_dir': 'temp/parse_combine'},
+        'outputs': {'parquet_dir': 'temp/extracted.parquet_combine', 'output_dir': 'temp/submission_xml_combine.csv'},
+        'reads': ['confidence_rules.json'],
+    },
+    {
+        # F1 of getid_xml_5 over parse_combine, the latest extraction, which the prefix blacklist is built from;
+        # F1.py's __main__ uses the same paths
+        'name': 'F1', 'run': 'F1:main', 'deps': ['getid_xml_5'],
+        'inputs': {'pred_path': 'temp/submission_xml_combine.csv', 'truth_path': 'data/train_labels.csv'},
+        'outputs': {'output_path': 'temp/F1_details_xml.csv'},
+    },
+    {
+        'name': 'blacklist', 'run': 'getid_xml_blacklist:main', 'deps': ['F1'],
+        'inputs': {'input_path': 'temp/F1_details_xml.csv'}, 'outputs': {'output_path': 'temp/doi_prefix_blacklist.txt'},
+    },
+    {
+        # model_path is config, not an input: fingerprinting a model directory is not worth it
+        # the paper_prefix tier of the cascade reads the blacklist that F1 over getid_xml_5 gives
+        'name': 'llm_validate', 'run': 'llm_validate:main', 'deps': ['getid', 'blacklist'],
+        'inputs': {'extracted_path': 'temp/extracted.parquet', 'blacklist_path': 'temp/doi_prefix_blacklist.txt'},
+        'outputs': {'doi_sub_path': 'temp/doi_sub.csv', 'accid_sub_path': 'temp/accid_sub.csv', 'submission_path': 'temp/submission_llm.csv',
+                    'scores_path': 'temp/doi_scores.parquet'},
+        # int8 and sharding are opt-in (--set llm_validate.dtype=int8 / llm_validate.workers=0) until check_quantized
+        # and benchmarks/llm_shards have been run against the model
+        'config': {'model_path': './models/qwen2.5', 'backend': 'transformers', 'batch_size': 16, 'dtype': 'float32', 'workers': 1},
+    },
+    {
+        'name': 'post_filter', 'run': 'post_filter:main', 'deps': ['llm_validate'],
+        'inputs': {'submission_path': 'temp/submission_llm.csv', 'extracted_path': 'temp/extracted.parquet'},
+        'outputs': {'output_path': 'output/submission.csv'},
+    },
+    {
+        # F1 of what is submitted, after llm_validate and post_filter
+        'name': 'F1_submission', 'run': 'F1:main', 'deps': ['post_filter'],
+        'inputs': {'pred_path': 'output/submission.csv', 'truth_path': 'data/train_labels.csv'},
+        'outputs': {'output_path': 'temp/F1_details_submission.csv'},
+    },
+]
+
+def stage_module(stage: dict) -> str:
+    return stage['run'].split(':')[0]
+
+def local_modules(module: str) -> list[str]:
+    """module and every repo module it imports, directly or not, as sorted file names."""
+    seen, todo = set(), [module]
+    while todo:
+        name = todo.pop()
+        path = ROOT / f'{name}.py'
+        if name in seen or not path.exists():
+            continue
+        seen.add(name)
+        for node in ast.walk(ast.parse(path.read_text())):
+            if isinstance(node, ast.Import):
+                todo += [alias.name.split('.')[0] for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                todo.append(node.module.split('.')[0])
+    return sorted(f'{name}.py' for name in seen)
+
+def path_digest(path) -> str:
+    """sha256 of a file; for a directory, of its listing with sizes and mtimes (like parse_manifest's quick check)."""
+    path = Path(path)
+    if path.is_file():
+        return file_digest(path)
+    if not path.is_dir():
+        return 'missing'
+    h = hashlib.sha256()
+    for f in sorted(p for p in path.rglob('*') if p.is_file()):
+        st = f.stat()
+        h.update(f'{f.relative_to(path)}\t{st.st_size}\t{st.st_mtime_ns}\n'.encode())
+    return h.hexdigest()
+
+def fingerprints(stages: list[dict]) -> dict:
+    produced = {path for stage in stages for path in stage['outputs'].values()}
+    result = {}
+    for stage in stages:
+        external = [p for p in [*stage['inputs'].values(), *stage.get('reads', [])] if p not in produced]
+        parts = {
+            'spec': {k: stage.get(k) for k in ('run', 'inputs', 'outputs', 'config')},
+            'code': {f: file_digest(ROOT / f) for f in local_modules(stage_module(stage))},
+            'deps': {dep: result[dep] for dep in stage['deps']},
+            'external': {p: path_digest(p) for p in external},
+        }
+        result[stage['name']] = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+    return result
+
+def load_state() -> dict:
+    return json.loads(STATE_PATH.read_text()) if STATE_PATH.exists() else {}
+
+def save_state(state: dict) -> None:
+    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    STATE_PATH.write_text(json.dumps(state, indent=2, sort_keys=True))
+
+def select(stages: list[dict], until: list[str]) -> list[dict]:
+    """The --until stages and everything they depend on, in STAGES order."""
+    by_name = {stage['name']: stage for stage in stages}
+    unknown = set(until) - set(by_name)
+    if unknown:
+        raise SystemExit(f"unknown stage(s): {', '.join(sorted(unknown))}; see `python mdc.py list`")
+    wanted, todo = set(), list(until or by_name)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo += by_name[name]['deps']
+    return [stage for stage in stages if stage['name'] in wanted]
+
+def plan(stages: list[dict], prints: dict, state: dict, force: bool = False) -> dict:
+    """stage name -> reason to run it, or None to skip."""
+    reasons = {}
+    for stage in stages:
+        name = stage['name']
+        if force:
+            reasons[name] = 'forced'
+        elif any(reasons.get(dep) for dep in stage['deps']):
+            reasons[name] = 'upstream ran'
+        elif state.get(name, {}).get('fingerprint') != prints[name]:
+            reasons[name] = 'new' if name not in state else 'changed'
+        elif not all(Path(p).exists() for p in stage['outputs'].values()):
+            reasons[name] = 'outputs missing'
+        else:
+            reasons[name] = None
+    return reasons
+
+def apply_overrides(stages: list[dict], overrides: list[str]) -> list[dict]:
+    """--set stage.key=value, value parsed as JSON when it can be (workers=4, not "4")."""
+    stages = json.loads(json.dumps(stages))
+    by_name = {stage['name']: stage for stage in stages}
+    for item in overrides:
+        target, _, value = item.partition('=')
+        name, _, key = target.partition('.')
+        if not key or not _:
+            raise SystemExit(f"bad --set {item!r}, expected stage.key=value")
+        if name not in by_name:
+            raise SystemExit(f"bad --set {item!r}, unknown stage {name!r}")
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            pass
+        stage = by_name[name]
+        section = next((s for s in ('inputs', 'outputs', 'config') if key in stage.get(s, {})), 'config')
+        stage.setdefault(section, {})[key] = value
+    return stages
+
+def execute(stage: dict, profile: list[str]) -> None:
+    """Body of one stage, in the process `run` starts for it; `profile` are the --profile* options to pass on."""
+    start_profiling(add_profile_args(argparse.ArgumentParser()).parse_args(profile))
+    module, func = stage['run'].split(':')
+    kwargs = {**stage['inputs'], **stage['outputs'], **stage.get('config', {})}
+    getattr(importlib.import_module(module), func)(**kwargs)
+
+def profile_options(args) -> list[str]:
+    """--profile* options for the stage processes; they all write into one directory under this run's id."""
+    if not (args.profile or args.profile_memory):
+        return []
+    return [*(['--profile'] if args.profile else []), *(['--profile-memory'] if args.profile_memory else []),
+            '--profile-dir', str(args.profile_dir or LOG_DIR / 'profile' / RUN_ID)]
+
+def run_stage(stage: dict, profile: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, str(ROOT / 'mdc.py'), 'exec', json.dumps(stage), *profile], check=True)
+    return time.perf_counter() - start
+
+def run(stages: list[dict], reasons: dict, prints: dict, jobs: int, profile: list[str] = ()) -> bool:
+    state = load_state()
+    pending = [stage for stage in stages if reasons[stage['name']]]
+    done = {stage['name'] for stage in stages if not reasons[stage['name']]}
+    running, failed = {}, []
+    with ThreadPoolExecutor(max_workers=resolve_workers(jobs)) as executor:
+        while pending or running:
+            if not failed:
+                for stage in [s for s in pending if all(dep in done for dep in s['deps'])]:
+                    l.info(f"[{stage['name']}] start ({reasons[stage['name']]})")
+                    running[executor.submit(run_stage, stage, list(profile))] = stage
+                    pending.remove(stage)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                name = stage['name']
+                try:
+                    seconds = future.result()
+                except subprocess.CalledProcessError as e:
+                    l.error(f"[{name}] failed with exit code {e.returncode}")
+                    failed.append(name)
+                    continue
+                done.add(name)
+                state[name] = {'fingerprint': prints[name], 'seconds': round(seconds, 2), 'finished': time.strftime(LOG_DATEFMT)}
+                save_state(state)
+                l.info(f"[{name}] done in {seconds:.1f}s")
+    for stage in pending:
+        l.warning(f"[{stage['name']}] not run, upstream failed")
+    return not failed
+
+def main():
+    parser = argparse.ArgumentParser(description='Make Data Count pipeline runner')
+    sub = parser.add_subparsers(dest='command', required=True)
+    for command in ('run', 'list'):
+        p = sub.add_parser(command)
+        p.add_argument('--until', nargs='+', default=[], help='Stop after these stages (default: every stage)')
+        p.add_argument('--set', dest='overrides', nargs='+', default=[], metavar='STAGE.KEY=VALUE', help='Override a stage path or config value')
+        p.add_argument('--force', action='store_true', help='Rerun the selected stages even if nothing changed')
+    sub.choices['run'].add_argument('--jobs', type=int, default=2, help='Stages run at the same time (0 = one per CPU core)')
+    sub.choices['run'].add_argument('--dry-run', action='store_true', help='Only show what would run')
+    add_profile_args(sub.choices['run'])
+    p = sub.add_parser('exec', help=argparse.SUPPRESS)
+    p.add_argument('stage', help='JSON stage spec')
+    args, profile = parser.parse_known_args()
+    if args.command != 'exec' and profile:
+        parser.error(f"unrecognized arguments: {' '.join(profile)}")
+
+    if args.command == 'exec':
+        execute(json.loads(args.stage), profile)
+        return
+
+    stages = select(apply_overrides(STAGES, args.overrides), args.until)
+    prints = fingerprints(stages)
+    reasons = plan(stages, prints, load_state(), args.force)
+    for stage in stages:
+        reason = reasons[stage['name']]
+        deps = ', '.join(stage['deps']) or '-'
+        l.info(f"{stage['name']:<14} {'run: ' + reason if reason else 'up to date':<22} after: {deps}")
+    if args.command == 'list' or args.dry_run:
+        return
+    if not run(stages, reasons, prints, args.jobs, profile_options(args)):
+        raise SystemExit(1)
+
+if __name__=='__main__': main()
@@ -0,0 +1,96 @@
+from pathlib import Path
+import polars as pl
+
+from helpers import STREAMING_CHUNK_SIZE, iter_batches, load_page_offsets, page_of
+from id_scanner import IdScanner
+
+"""
+Offset-based context windows.
+- IdScanner records (start, end) of every DOI / accession hit of a variant's SCANNER; candidates from tidy_extraction are joined
+  to the hits of their raw `match` strings, so every occurrence is kept, not just text.find(match[0])
+  (which could also land inside a longer id, e.g. 10.5256/x.13622. inside 10.5256/x.13622.d194234)
+- Windows are sliced article by article straight from the corpus; text is never joined onto candidate
+  rows, so memory follows the number of occurrences, not occurrences x article size
+- Occurrences are all hits of the raw match in the text, references included, also for the variants
+  that only extract DOIs from the body
+- occurrence_pages adds the PDF page of each occurrence from parse_com's .pages sidecars (getid, over temp/parse)
+- extract_corpus runs a variant's extraction + occurrence scan over the corpus one streaming batch of articles
+  at a time: every step is per article, so the result is the one of a single run, the text (including any
+  preprocess_text) is produced once, and only one batch of it is held in memory
+"""
+
+WINDOW = 100  # characters on each side of a match
+OCCURRENCE_SCHEMA = {
+    'article_id': pl.String, 'dataset_id': pl.String, 'occurrence': pl.UInt32,
+    'start': pl.Int64, 'end': pl.Int64, 'window': pl.String,
+}
+
+def window_slices(text_df: pl.DataFrame, spans: pl.DataFrame, window: int = WINDOW) -> list:
+    """text[start - window:end + window] for every (article_id, start, end) row of spans, in row order."""
+    by_article = {}
+    for i, (article_id, start, end) in enumerate(spans.select('article_id', 'start', 'end').iter_rows()):
+        by_article.setdefault(article_id, []).append((i, start, end))
+    windows = [None] * len(spans)
+    for article_id, text in text_df.select('article_id', 'text').iter_rows():
+        for i, start, end in by_article.get(article_id, ()):
+            windows[i] = text[max(start - window, 0):end + window]
+    return windows
+
+def occurrence_df(text_df: pl.DataFrame, ids_df: pl.DataFrame, scanner: IdScanner, window: int = WINDOW) -> pl.DataFrame:
+    """
+    One row per occurrence of every candidate: (article_id, dataset_id, occurrence, start, end, window).
+    text_df must hold the text tidy_extraction scanned (after preprocess_text where a variant has one);
+    <family>_match columns it already has from the variant's scanner are used instead of scanning again.
+    """
+    hits = scanner.hits(scanner.match_lists(text_df))
+    occ = (
+        ids_df.select('article_id', 'dataset_id', 'match')
+        .with_row_index('candidate')
+        .explode('match')
+        .join(hits.select('article_id', 'match', 'start', 'end'), on=['article_id', 'match'])
+        # the same span can come from both families
+        .unique(['candidate', 'start', 'end'])
+        .sort('candidate', 'start', 'end')
+        .with_columns(pl.int_range(pl.len(), dtype=pl.UInt32).over('candidate').alias('occurrence'))
+    )
+    return (
+        occ.with_columns(pl.Series('window', window_slices(text_df, occ, window), dtype=pl.String))
+        .select(list(OCCURRENCE_SCHEMA))
+    )
+
+def first_windows(ids_df: pl.DataFrame, occ_df: pl.DataFrame) -> pl.DataFrame:
+    """(article_id, dataset_id, window) for every candidate, window of its first occurrence."""
+    first = occ_df.filter(pl.col('occurrence') == 0).select('article_id', 'dataset_id', 'window')
+    return ids_df.select('article_id', 'dataset_id').join(first, on=['article_id', 'dataset_id'], how='left', maintain_order='left')
+
+def occurrence_pages(occ_df: pl.DataFrame, parse_dir) -> pl.DataFrame:
+    """
+    occ_df plus page: the 0-based PDF page of every occurrence's start, from the .pages sidecars of a .txt corpus
+    directory; null for articles without one (XML-derived texts, .parquet corpora). Only for text as scan_df
+    returns it: preprocess_text moves offsets.
+    """
+    parse_dir, offsets, pages = Path(parse_dir), {}, []
+    for article_id, start in occ_df.select('article_id', 'start').iter_rows():
+        if article_id not in offsets:
+            offsets[article_id] = None if parse_dir.suffix == '.parquet' else load_page_offsets(parse_dir / f'{article_id}.txt')
+        pages.append(None if offsets[article_id] is None else page_of(offsets[article_id], start))
+    return occ_df.with_columns(pl.Series('page', pages, dtype=pl.UInt32))
+
+def occurrences_path(parquet_dir) -> Path:
+    """./temp/extracted.parquet_xml_5 -> ./temp/occurrences.parquet_xml_5"""
+    path = Path(parquet_dir)
+    name = path.name.replace('extracted', 'occurrences') if 'extracted' in path.name else f'occurrences.{path.name}'
+    return path.with_name(name)
+
+def extract_corpus(text_lf: pl.LazyFrame, extract, chunk_size: int = STREAMING_CHUNK_SIZE):
+    """(ids_df, occ_df, articles): extract(text_df) -> (ids_df, occ_df) over every batch of text_lf, concatenated."""
+    ids, occs, articles = [], [], 0
+    for text_df in iter_batches(text_lf, chunk_size):
+        ids_df, occ_df = extract(text_df)
+        ids.append(ids_df)
+        occs.append(occ_df)
+        articles += text_df.height
+    if not ids:
+        ids_df, occ_df = extract(text_lf.clear().collect())
+        return ids_df, occ_df, 0
+    return pl.concat(ids), pl.concat(occs), articles
@@ -1,32 +1,16 @@
 import argparse
 from pathlib import Path
-import pymupdf
 from helpers import get_logger, PDF_DIR
+from parse_com import pdf_to_txt
 
 l = get_logger()
 
-def pdf_to_txt(output_dir: Path):
-    output_dir.mkdir(parents=True, exist_ok=True)
-    pdf_files = list(PDF_DIR.glob("*.pdf")) + list(PDF_DIR.glob("*.PDF"))
-    existing_txt_files = {f.stem for f in output_dir.glob("*.txt")}
-    for pdf_file in pdf_files:
-        txt_file = output_dir / f"{pdf_file.stem}.txt"
-        if pdf_file.stem in existing_txt_files:
-            continue
-        try:
-            text = ""
-            with pymupdf.open(pdf_file) as doc:
-                for page in doc:
-                    text += page.get_text()
-            txt_file.write_text(text, encoding='utf-8')
-        except Exception:
-            pass
-
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('output_dir', type=Path, help='Directory to save text files')
+    parser.add_argument('--workers', type=int, default=1, help='Number of conversion processes (0 = one per CPU core)')
     args = parser.parse_args()
-    pdf_to_txt(args.output_dir)
+    pdf_to_txt(args.output_dir, PDF_DIR, args.workers)
 
 if __name__ == "__main__":
     main()
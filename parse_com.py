@@ -1,42 +1,107 @@
 import argparse
+from functools import partial
 from pathlib import Path
 import pymupdf
 import xml.etree.ElementTree as ET
 import os
 import glob
 import re
-from helpers import get_logger, PDF_DIR
+import tempfile
+import polars as pl
+from helpers import get_logger, run_pool, page_offsets_path, write_page_offsets, PDF_DIR
+from profiling import metrics, path_bytes, add_profile_args, start_profiling
+from parse_manifest import open_manifest, outputs_digest, prune_manifest, stale_jobs, record
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
 
 l = get_logger()
 
-def pdf_to_txt(output_dir: Path):
+XML_ENGINES = ('auto', 'etree', 'lxml')
+XML_PARSE_ERRORS = (ET.ParseError,) + ((lxml_etree.XMLSyntaxError,) if lxml_etree is not None else ())
+
+# Bump these whenever the extraction logic changes so cached outputs get refreshed
+PDF_EXTRACTOR = f"pymupdf-{pymupdf.VersionBind}/3"
+XML_EXTRACTOR = "etree/1"
+
+def convert_pdf_to_txt(pdf_file, txt_file):
+    try:
+        with pymupdf.open(pdf_file) as doc:
+            pages = [page.get_text() for page in doc]
+        txt_file.write_text(''.join(pages), encoding='utf-8')
+        write_page_offsets(txt_file, pages)
+        return True
+    except Exception:
+        return False
+
+def read_pdf_page(pdf_file, page_no: int) -> str:
+    """Re-extract a single page, e.g. one located with helpers.page_of."""
+    with pymupdf.open(pdf_file) as doc:
+        return doc[page_no].get_text()
+
+def remove_outputs(output_dir, outputs):
+    for output in outputs:
+        txt_file = Path(output_dir) / output
+        txt_file.unlink(missing_ok=True)
+        page_offsets_path(txt_file).unlink(missing_ok=True)
+
+def pdf_to_txt(output_dir: Path, pdf_dir: Path = PDF_DIR, workers: int = 1, exclude=frozenset()):
+    """Convert new or changed PDFs; stems in `exclude` are owned by another source (e.g. XML)."""
+    output_dir, pdf_dir = Path(output_dir), Path(pdf_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
-    pdf_files = list(PDF_DIR.glob("*.pdf")) + list(PDF_DIR.glob("*.PDF"))
-    existing_txt_files = {f.stem for f in output_dir.glob("*.txt")}
+    pdf_files = list(pdf_dir.glob("*.pdf")) + list(pdf_dir.glob("*.PDF"))
     pdf_count = len(pdf_files)
-    for pdf_file in pdf_files:
-        txt_file = output_dir / f"{pdf_file.stem}.txt"
-        if pdf_file.stem in existing_txt_files:
-            continue
-        try:
-            text = ""
-            with pymupdf.open(pdf_file) as doc:
-                for page in doc:
-                    text += page.get_text()
-            txt_file.write_text(text, encoding='utf-8')
-        except Exception:
-            pass
+    conn = open_manifest(output_dir)
+    try:
+        removed = prune_manifest(conn)
+        remove_outputs(output_dir, removed)
+        sources = {f"{f.stem}.txt": f for f in pdf_files if f.stem not in exclude}
+        jobs = stale_jobs(conn, output_dir, sources, PDF_EXTRACTOR)
+        for (pdf_file, txt_file), converted in run_pool(convert_pdf_to_txt, jobs, workers):
+            if converted:
+                record(conn, txt_file.name, pdf_file, 'pdf', PDF_EXTRACTOR)
+        conn.commit()
+    finally:
+        conn.close()
+    l.info(f"PDF: {len(jobs)} converted, {len(sources) - len(jobs)} cached, {len(removed)} removed.")
     return pdf_count
 
+TEI_NAMESPACE = 'http://www.tei-c.org/ns/1.0'
+HTML_TAGS = {'html', 'body', 'div', 'p', 'span', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+WHITESPACE_RE = re.compile(r'\s+')
+
 def detect_xml_style(root):
-    if '}' in root.tag and 'http://www.tei-c.org/ns/1.0' in root.tag:
+    if '}' in root.tag and TEI_NAMESPACE in root.tag:
         return 'tei'
-    html_tags = {'html', 'body', 'div', 'p', 'span', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
     for elem in root.iter():
-        if elem.tag in html_tags:
+        if elem.tag in HTML_TAGS:
             return 'html'
     return 'generic'
 
+def resolve_xml_engine(engine='auto'):
+    if engine == 'auto':
+        return 'lxml' if lxml_etree is not None else 'etree'
+    if engine == 'lxml' and lxml_etree is None:
+        l.warning("lxml is not installed, falling back to ElementTree")
+        return 'etree'
+    return engine
+
+def iterparse(source, events, engine='etree'):
+    if engine == 'lxml':
+        # Comments/PIs are dropped so the text around them merges exactly like ElementTree's TreeBuilder
+        return lxml_etree.iterparse(source, events=events, remove_comments=True, remove_pis=True, huge_tree=True)
+    return ET.iterparse(source, events=events)
+
+def event_style(event, elem, first):
+    """The style an iterparse event settles, as detect_xml_style would: a TEI root, or any HTML tag; else None."""
+    if event != 'start':
+        return None
+    if first and '}' in elem.tag and TEI_NAMESPACE in elem.tag:
+        return 'tei'
+    return 'html' if elem.tag in HTML_TAGS else None
+
 def get_block_elements(style):
     if style == 'tei':
         return {
@@ -80,60 +145,250 @@ def extract_text_with_structure(element, style, block_elements, short_content_th
     else:
         return result_text + ' '
 
-def convert_xml_to_txt(xml_file_path, txt_file_path):
+def stream_text_with_structure(xml_file_path, out, short_content_threshold=50, engine='etree'):
+    """
+    Streaming equivalent of extract_text_with_structure: writes the same text to `out`
+    from iterparse events, keeping only the open path of the tree in memory.
+    An element is finished once its tail is known (next sibling start or parent end),
+    then cleared and detached from its parent. `engine` picks the ElementTree or lxml parser.
+    The style comes from the same stream: events are held back, elements intact, until the root (TEI) or
+    the first HTML tag settles it, then replayed; a document with neither is held whole and ends up generic.
+    """
+    style = None
+    block_elements = None
+    held = []  # events before the style is known
+    stack = []  # open elements as [elem, n_parts, length, text_done]
+    pending = None  # closed element still waiting for its tail
+
+    def open_part(frame):
+        if frame[1]:
+            out.write(' ')
+            frame[2] += 1
+        frame[1] += 1
+
+    def add_part(frame, text):
+        open_part(frame)
+        out.write(text)
+        frame[2] += len(text)
+
+    def add_text(frame):
+        if not frame[3]:
+            frame[3] = True
+            text = frame[0].text
+            if text and text.strip():
+                add_part(frame, WHITESPACE_RE.sub(' ', text.strip()))
+
+    def finish(frame):
+        elem = frame[0]
+        if elem.tail and elem.tail.strip():
+            add_part(frame, WHITESPACE_RE.sub(' ', elem.tail.strip()))
+        tag_name = elem.tag.split('}', 1)[1] if '}' in elem.tag else elem.tag
+        suffix = '\n\n' if tag_name in block_elements and frame[2] >= short_content_threshold else ' '
+        out.write(suffix)
+        if stack:
+            parent = stack[-1]
+            parent[2] += frame[2] + len(suffix)
+            if len(parent[0]) and parent[0][0] is elem:
+                del parent[0][0]
+        elem.clear()
+
+    def handle(event, elem):
+        nonlocal pending
+        if pending is not None:
+            finish(pending)
+            pending = None
+        if event == 'start':
+            if stack:
+                add_text(stack[-1])
+                open_part(stack[-1])
+            stack.append([elem, 0, 0, False])
+        else:
+            frame = stack.pop()
+            add_text(frame)
+            if stack:
+                pending = frame
+            else:
+                finish(frame)
+
+    with open(xml_file_path, 'rb') as f:
+        for event, elem in iterparse(f, ('start', 'end'), engine):
+            if style is not None:
+                handle(event, elem)
+                continue
+            held.append((event, elem))
+            style = event_style(event, elem, len(held) == 1)
+            if style is not None:
+                block_elements = get_block_elements(style)
+                for event, elem in held:
+                    handle(event, elem)
+                held = None
+    if style is None:
+        style = 'generic'
+        block_elements = get_block_elements(style)
+        for event, elem in held:
+            handle(event, elem)
+    return style
+
+def convert_xml_to_txt(xml_file_path, txt_file_path, engine='etree'):
+    part_file_path = f"{txt_file_path}.part"
+
+    def write_part(engine):
+        with open(part_file_path, 'w', encoding='utf-8') as txt_file:
+            return stream_text_with_structure(xml_file_path, txt_file, engine=engine)
+
     try:
-        tree = ET.parse(xml_file_path)
-        root = tree.getroot()
-        style = detect_xml_style(root)
+        try:
+            style = write_part(engine)
+        except XML_PARSE_ERRORS:
+            if engine != 'lxml':
+                raise
+            # libxml2 caps nesting depth even with huge_tree; let ElementTree decide
+            style = write_part('etree')
+        os.replace(part_file_path, txt_file_path)
         l.info(f"Detected XML style: {style}")
-        block_elements = get_block_elements(style)
-        short_content_threshold = 50
-        structured_text = extract_text_with_structure(root, style, block_elements, short_content_threshold)
-        with open(txt_file_path, 'w', encoding='utf-8') as txt_file:
-            txt_file.write(structured_text)
         return True
-    except ET.ParseError as e:
+    except XML_PARSE_ERRORS as e:
         l.error(f"Error: Could not parse file {xml_file_path}. It may not be valid XML. Error: {e}")
         return False
     except Exception as e:
         l.error(f"Unknown error processing file {xml_file_path}: {e}")
         return False
+    finally:
+        if os.path.exists(part_file_path):
+            os.remove(part_file_path)
 
-def batch_convert_xml_folder(input_folder, output_folder):
+def list_xml_files(input_folder):
+    return glob.glob(os.path.join(input_folder, "*.xml"))
+
+def batch_convert_xml_folder(input_folder, output_folder, workers: int = 1, engine='etree'):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
-    xml_files = glob.glob(os.path.join(input_folder, "*.xml"))
+    xml_files = list_xml_files(input_folder)
     xml_count = len(xml_files)
-    overwrite_count = 0
-    for xml_file in xml_files:
-        original_filename = os.path.splitext(os.path.basename(xml_file))[0]
-        txt_file_path = os.path.join(output_folder, original_filename + ".txt")
-        if os.path.exists(txt_file_path):
-            overwrite_count += 1
-        if convert_xml_to_txt(xml_file, txt_file_path):
-            l.info(f"Converted: {original_filename}.xml -> {original_filename}.txt")
+    conn = open_manifest(output_folder)
+    try:
+        removed = prune_manifest(conn)
+        remove_outputs(output_folder, removed)
+        sources = {os.path.splitext(os.path.basename(f))[0] + ".txt": f for f in xml_files}
+        jobs = stale_jobs(conn, output_folder, sources, XML_EXTRACTOR)
+        existing = {txt_file for _, txt_file in jobs if txt_file.exists()}
+        overwrite_count = converted_count = 0
+        convert = partial(convert_xml_to_txt, engine=resolve_xml_engine(engine))
+        for (xml_file, txt_file), converted in run_pool(convert, jobs, workers):
+            if converted:
+                converted_count += 1
+                overwrite_count += txt_file in existing
+                # an XML replacing PDF text has no pages
+                page_offsets_path(txt_file).unlink(missing_ok=True)
+                record(conn, txt_file.name, xml_file, 'xml', XML_EXTRACTOR)
+                l.info(f"Converted: {xml_file.name} -> {txt_file.name}")
+        conn.commit()
+    finally:
+        conn.close()
+    l.info(f"XML: {converted_count} converted, {len(jobs) - converted_count} failed, {len(sources) - len(jobs)} cached, {len(removed)} removed.")
     return xml_count, overwrite_count
 
+CORPUS_CHUNK_SIZE = 256  # articles per part file
+CORPUS_DIGEST_KEY = 'manifest_digest'
+CORPUS_SCHEMA = {'article_id': pl.String, 'source': pl.String, 'text': pl.String}
+
+def write_corpus(output_dir: Path, corpus_path: Path, chunk_size: int = CORPUS_CHUNK_SIZE):
+    """
+    Pack every .txt in output_dir into one zstd Parquet file with columns article_id, source, text.
+    Texts are read chunk_size at a time into part files that are then streamed into corpus_path, like
+    synth_corpus.write_corpus. The file keeps the outputs_digest of the manifest rows it was packed from
+    and is only rewritten when that changes.
+    """
+    txt_files = sorted(output_dir.glob("*.txt"))
+    conn = open_manifest(output_dir)
+    try:
+        kinds = dict(conn.execute('SELECT output, kind FROM files'))
+        digest = outputs_digest(conn, output_dir, [f.name for f in txt_files])
+    finally:
+        conn.close()
+    if corpus_path.exists() and pl.read_parquet_metadata(corpus_path).get(CORPUS_DIGEST_KEY) == digest:
+        l.info(f"Corpus {corpus_path} is up to date.")
+        return
+    corpus_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=corpus_path.parent, prefix=f".{corpus_path.name}.") as parts:
+        parts = Path(parts)
+        pl.DataFrame(schema=CORPUS_SCHEMA).write_parquet(parts / 'empty.parquet')
+        for start in range(0, len(txt_files), chunk_size):
+            chunk = txt_files[start:start + chunk_size]
+            pl.DataFrame(
+                {
+                    'article_id': [f.stem for f in chunk],
+                    'source': [kinds.get(f.name) for f in chunk],
+                    'text': [f.read_text(encoding='utf-8') for f in chunk],
+                },
+                schema=CORPUS_SCHEMA,
+            ).write_parquet(parts / f"{start:09d}.parquet")
+        # part names sort in article order; row groups of chunk_size keep the sink from buffering the whole corpus;
+        # written next to corpus_path and swapped in once complete
+        pl.scan_parquet(parts / '*.parquet').sink_parquet(
+            parts / 'corpus', compression='zstd', row_group_size=chunk_size, metadata={CORPUS_DIGEST_KEY: digest},
+        )
+        os.replace(parts / 'corpus', corpus_path)
+    l.info(f"Wrote {len(txt_files)} articles to {corpus_path}.")
+
+def xml_converted_stems(output_dir: Path, xml_dir) -> set[str]:
+    """Stems of xml_dir whose text in output_dir is up to date with the XML, i.e. whose conversion succeeded."""
+    sources = {f"{Path(f).stem}.txt": f for f in list_xml_files(xml_dir)}
+    conn = open_manifest(output_dir)
+    try:
+        failed = {txt_file.stem for _, txt_file in stale_jobs(conn, output_dir, sources, XML_EXTRACTOR)}
+    finally:
+        conn.close()
+    return {Path(output).stem for output in sources} - failed
+
+def parse_combine(output_dir: Path, pdf_dir: Path = PDF_DIR, xml_dir='data/train/XML', workers: int = 1, xml_engine='etree', corpus=None):
+    """
+    PDFs and XMLs into one output_dir, XML text winning; returns (pdf_count, xml_count, overwrite_count).
+    XMLs are converted first and a PDF is only skipped when its XML converted, so an article whose XML fails
+    to parse keeps (or gets) its PDF text; the XML is tried again on the next run.
+    """
+    output_dir, pdf_dir = Path(output_dir), Path(pdf_dir)
+    with metrics('parse_combine') as run:
+        # Process XMLs
+        with metrics('xml', bytes_read=path_bytes(xml_dir)) as m:
+            xml_count, overwrite_count = batch_convert_xml_folder(xml_dir, output_dir, workers, xml_engine)
+            m['rows_out'] = xml_count
+        l.info(f"Found and processed {xml_count} XML files.")
+        l.info(f"Replaced {overwrite_count} existing text files (PDF fallbacks or older XML text) with XML conversions.")
+
+        # Process PDFs; stems whose XML converted are left to the XML pass
+        xml_stems = xml_converted_stems(output_dir, xml_dir)
+        with metrics('pdf', bytes_read=path_bytes(pdf_dir)) as m:
+            pdf_count = pdf_to_txt(output_dir, pdf_dir, workers, exclude=xml_stems)
+            m['rows_out'] = pdf_count
+        l.info(f"Found and processed {pdf_count} PDF files.")
+        if xml_count > len(xml_stems):
+            l.warning(f"{xml_count - len(xml_stems)} XML files failed to convert; their PDFs are used where there is one.")
+
+        if corpus is not None:
+            with metrics('corpus') as m:
+                write_corpus(output_dir, Path(corpus))
+                m['bytes_written'] = path_bytes(corpus)
+        run.update(rows_out=len(list(output_dir.glob('*.txt'))), bytes_written=path_bytes(output_dir))
+    return pdf_count, xml_count, overwrite_count
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--pdf-dir', type=Path, default=PDF_DIR, help='Directory containing PDF files')
     parser.add_argument('--xml-dir', type=str, default='data/train/XML', help='Directory containing XML files')
     parser.add_argument('--output-dir', type=Path, default=Path('temp/parse_combine'), help='Directory to save text files')
+    parser.add_argument('--workers', type=int, default=1, help='Number of conversion processes (0 = one per CPU core)')
+    parser.add_argument('--xml-engine', choices=XML_ENGINES, default='etree', help='XML parser (auto = lxml when installed, else ElementTree)')
+    parser.add_argument('--corpus', type=Path, default=None, help='Also write all texts to this Parquet file (e.g. temp/corpus_combine.parquet)')
+    add_profile_args(parser)
     args = parser.parse_args()
-
-    # Process PDFs
-    pdf_count = pdf_to_txt(args.output_dir)
-    l.info(f"Found and processed {pdf_count} PDF files.")
-
-    # Process XMLs
-    xml_count, overwrite_count = batch_convert_xml_folder(args.xml_dir, args.output_dir)
-    l.info(f"Found and processed {xml_count} XML files.")
-    l.info(f"Overwrote {overwrite_count} text files from XML conversions.")
+    start_profiling(args)
+    pdf_count, xml_count, overwrite_count = parse_combine(args.output_dir, args.pdf_dir, args.xml_dir, args.workers, args.xml_engine, args.corpus)
 
     # Print summary to terminal
     print(f"Processed {pdf_count} PDF files.")
     print(f"Processed {xml_count} XML files.")
-    print(f"Overwrote {overwrite_count} text files from XML conversions.")
+    print(f"Replaced {overwrite_count} existing text files with XML conversions.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
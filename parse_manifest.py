@@ -0,0 +1,80 @@
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+
+"""
+Incremental parse cache.
+- One SQLite manifest per output directory, one row per .txt output
+- Each row records the source file, its sha256, size, mtime and the extractor version
+- A source is reconverted only when it is new, its content changed, or the extractor changed
+- size + mtime are checked first, so an unchanged corpus is never rehashed
+- outputs_digest condenses the rows of a set of outputs, e.g. to tell whether a packed corpus is current
+"""
+
+MANIFEST_NAME = 'manifest.sqlite'
+
+def file_digest(path) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+def open_manifest(output_dir) -> sqlite3.Connection:
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(Path(output_dir) / MANIFEST_NAME)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS files ('
+        'output TEXT PRIMARY KEY, source TEXT NOT NULL, kind TEXT NOT NULL, '
+        'sha256 TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, extractor TEXT NOT NULL)'
+    )
+    return conn
+
+def prune_manifest(conn: sqlite3.Connection) -> list[str]:
+    """Forget rows whose source file no longer exists; returns their outputs so the caller can delete them."""
+    gone = [output for output, source in conn.execute('SELECT output, source FROM files') if not os.path.exists(source)]
+    conn.executemany('DELETE FROM files WHERE output = ?', [(output,) for output in gone])
+    conn.commit()
+    return gone
+
+def stale_jobs(conn: sqlite3.Connection, output_dir, sources: dict, extractor: str) -> list[tuple[Path, Path]]:
+    """Return (source, output) pairs that need converting; `sources` maps output name -> source path."""
+    rows = {r[0]: r[1:] for r in conn.execute('SELECT output, source, sha256, size, mtime_ns, extractor FROM files')}
+    jobs = []
+    for output, source in sources.items():
+        source, txt_file = Path(source), Path(output_dir) / output
+        row = rows.get(output)
+        if row is None or not txt_file.exists():
+            jobs.append((source, txt_file))
+            continue
+        row_source, row_sha, row_size, row_mtime, row_extractor = row
+        if row_source != os.path.abspath(source) or row_extractor != extractor:
+            jobs.append((source, txt_file))
+            continue
+        st = source.stat()
+        if (st.st_size, st.st_mtime_ns) == (row_size, row_mtime):
+            continue
+        if file_digest(source) != row_sha:
+            jobs.append((source, txt_file))
+            continue
+        # touched but unchanged: remember the new mtime so we skip hashing next time
+        conn.execute('UPDATE files SET size = ?, mtime_ns = ? WHERE output = ?', (st.st_size, st.st_mtime_ns, output))
+    conn.commit()
+    return jobs
+
+def outputs_digest(conn: sqlite3.Connection, output_dir, outputs: list[str]) -> str:
+    """
+    sha256 over outputs in order, each by its manifest row (kind, source sha256, extractor), which fixes its
+    content; an output with no row counts by the sha256 of the file itself.
+    """
+    rows = {r[0]: r[1:] for r in conn.execute('SELECT output, kind, sha256, extractor FROM files')}
+    h = hashlib.sha256()
+    for output in outputs:
+        row = rows.get(output) or ('', file_digest(Path(output_dir) / output), '')
+        h.update('\t'.join((output, *row)).encode() + b'\n')
+    return h.hexdigest()
+
+def record(conn: sqlite3.Connection, output: str, source, kind: str, extractor: str) -> None:
+    st = os.stat(source)
+    conn.execute(
+        'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (output, os.path.abspath(source), kind, file_digest(source), st.st_size, st.st_mtime_ns, extractor),
+    )
@@ -3,6 +3,23 @@ import os
 import glob
 import re
 
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+XML_PARSE_ERRORS = (ET.ParseError,) + ((lxml_etree.XMLSyntaxError,) if lxml_etree is not None else ())
+
+def parse_xml_tree(xml_file_path, engine='etree'):
+    """
+    解析XML文件：engine为'lxml'且已安装lxml时使用lxml，否则回退到ElementTree
+    """
+    if engine == 'lxml' and lxml_etree is not None:
+        # 去掉注释和处理指令，使其前后的文本与ElementTree一样合并
+        parser = lxml_etree.XMLParser(remove_comments=True, remove_pis=True, huge_tree=True)
+        return lxml_etree.parse(xml_file_path, parser)
+    return ET.parse(xml_file_path)
+
 def detect_xml_style(root):
     """
     检测XML的风格类型
@@ -82,13 +99,13 @@ def extract_text_with_structure(element, style, block_elements, short_content_th
         # 对于内联元素，只添加空格
         return result_text + ' '
 
-def convert_xml_to_txt(xml_file_path, txt_file_path):
+def convert_xml_to_txt(xml_file_path, txt_file_path, engine='etree'):
     """
     将XML文件转换为TXT文件，自动检测风格并保留文本结构
     """
     try:
         # 解析XML文件
-        tree = ET.parse(xml_file_path)
+        tree = parse_xml_tree(xml_file_path, engine)
         root = tree.getroot()
         
         # 检测XML风格
@@ -108,12 +125,12 @@ def convert_xml_to_txt(xml_file_path, txt_file_path):
         with open(txt_file_path, 'w', encoding='utf-8') as txt_file:
             txt_file.write(structured_text)
                     
-    except ET.ParseError as e:
+    except XML_PARSE_ERRORS as e:
         print(f"错误：无法解析文件 {xml_file_path}。它可能不是有效的XML。错误信息: {e}")
     except Exception as e:
         print(f"处理文件 {xml_file_path} 时发生未知错误: {e}")
 
-def batch_convert_folder(input_folder, output_folder):
+def batch_convert_folder(input_folder, output_folder, engine='etree'):
     """
     批量转换一个文件夹中的所有XML文件
     """
@@ -134,7 +151,7 @@ def batch_convert_folder(input_folder, output_folder):
         txt_file_path = os.path.join(output_folder, original_filename + ".txt")
         
         # 转换每个文件
-        convert_xml_to_txt(xml_file, txt_file_path)
+        convert_xml_to_txt(xml_file, txt_file_path, engine)
         print(f"已转换: {original_filename}.xml -> {original_filename}.txt")
         
     print("批量转换完成！")
@@ -145,6 +162,8 @@ if __name__ == "__main__":
     input_directory = "data/train/XML"  # 替换为你的XML文件路径
     # 请修改为你希望输出TXT文件的文件夹路径
     output_directory = "temp/parse_xml"  # 输出TXT文件路径
+    # XML解析器：'etree' 或 'lxml'（未安装lxml时自动回退到ElementTree）
+    xml_engine = "etree"
     
     # 运行批量转换
-    batch_convert_folder(input_directory, output_directory)
\ No newline at end of file
+    batch_convert_folder(input_directory, output_directory, xml_engine)
\ No newline at end of file
@@ -0,0 +1,241 @@
+import os, sys, json, time, atexit, resource, argparse
+import cProfile, pstats, threading, traceback, tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+import polars as pl
+from helpers import get_logger, LOG_DIR, LOG_DATEFMT
+
+"""
+Stage metrics and profiling for the pipeline scripts
+- metrics() / timed() time a stage, append it to METRICS_FILE_PATH as a JSON line and log a summary table at exit
+- --profile / --profile-memory (add_profile_args + start_profiling, or profile_cli) add a cProfile, collapsed
+  stacks and a tracemalloc report per metrics() stage under logs/profile/<run id>
+"""
+
+METRICS_FILE_PATH = os.getenv("METRICS_FILE", str(LOG_DIR / "metrics.jsonl"))  # "" = summary only
+RUN_ID = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+_metric_stack = []    # names of the open metrics() blocks, for nested stage names
+_metric_records = []  # finished records of this run, for the summary table
+
+PROFILE_INTERVAL = 0.005  # seconds between stack samples for the collapsed-stack files
+PROFILE_FRAMES = 6        # traceback depth tracemalloc keeps per allocation
+PROFILE_TOP = 25          # allocation sites listed per stage in the memory report
+_profile = {}             # filled by start_profiling(); empty = profiling off
+
+def path_bytes(path) -> int:
+    """Size of a file, or of every file under a directory; 0 if missing."""
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file()) if path.is_dir() else 0
+
+def cpu_seconds() -> float:
+    """CPU time of this process (all threads) plus its finished children, e.g. pool workers."""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+@contextmanager
+def metrics(stage: str, **fields):
+    """
+    Time a pipeline stage or sub-step. The yielded dict takes rows_in / rows_out / bytes_read / bytes_written
+    (or any other field); on exit wall_s and cpu_s are added and the record is appended to METRICS_FILE_PATH
+    as one JSON line. Nested blocks are named parent/child. A summary table is logged when the run ends.
+    """
+    _metric_stack.append(stage)
+    record = {'run_id': RUN_ID, 'script': Path(sys.argv[0]).stem, 'stage': '/'.join(_metric_stack), **fields}
+    if _profile:
+        _profile_enter()
+    wall, cpu = time.perf_counter(), cpu_seconds()
+    status = 'error'
+    try:
+        yield record
+        status = 'ok'
+    finally:
+        if _profile:
+            _profile_exit(record)
+        _metric_stack.pop()
+        record.update(wall_s=round(time.perf_counter() - wall, 4), cpu_s=round(cpu_seconds() - cpu, 4), status=status, ts=time.strftime(LOG_DATEFMT))
+        if not _metric_records:
+            atexit.register(log_metrics_summary)
+        _metric_records.append(record)
+        if METRICS_FILE_PATH:
+            with open(METRICS_FILE_PATH, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+def timed(stage: str = None):
+    """Decorator form of metrics(); rows_in / rows_out are filled from DataFrame arguments and results."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics(stage or func.__name__) as m:
+                frames = [a for a in (*args, *kwargs.values()) if isinstance(a, pl.DataFrame)]
+                if frames:
+                    m['rows_in'] = frames[0].height
+                result = func(*args, **kwargs)
+                if isinstance(result, pl.DataFrame):
+                    m['rows_out'] = result.height
+                return result
+        return wrapper
+    return decorate
+
+def log_metrics_summary() -> None:
+    if not _metric_records:
+        return
+    fmt = lambda v, scale=1: '' if v is None else f"{v / scale:.1f}" if scale != 1 else str(v)
+    rows = [
+        (r['stage'], f"{r['wall_s']:.2f}", f"{r['cpu_s']:.2f}", fmt(r.get('rows_in')), fmt(r.get('rows_out')),
+         fmt(r.get('bytes_read'), 1e6), fmt(r.get('bytes_written'), 1e6), r['status'])
+        for r in _metric_records
+    ]
+    header = ('stage', 'wall s', 'cpu s', 'rows in', 'rows out', 'MB read', 'MB written', 'status')
+    widths = [max(len(str(row[i])) for row in [header, *rows]) for i in range(len(header))]
+    lines = ['  '.join(str(v).ljust(w) if i == 0 else str(v).rjust(w) for i, (v, w) in enumerate(zip(row, widths))) for row in [header, *rows]]
+    get_logger('metrics').info("Run summary\n" + '\n'.join(lines))
+
+def add_profile_args(parser):
+    parser.add_argument('--profile', action='store_true', help='cProfile and sample every metrics() stage (pstats + collapsed stacks)')
+    parser.add_argument('--profile-memory', action='store_true', help='tracemalloc report of the largest allocation sites per stage')
+    parser.add_argument('--profile-dir', type=Path, default=None, help='Where profiles go (default: logs/profile/<run id>)')
+    return parser
+
+def start_profiling(args) -> None:
+    """Turn on the --profile / --profile-memory modes for the metrics() stages of this process."""
+    if not (args.profile or args.profile_memory) or _profile:
+        return
+    out = Path(args.profile_dir or LOG_DIR / 'profile' / RUN_ID)
+    out.mkdir(parents=True, exist_ok=True)
+    _profile.update(dir=out, cpu=args.profile, memory=args.profile_memory, open=[], names=Counter())
+    if args.profile:
+        _profile.update(samples=Counter(), lock=threading.Lock())
+        threading.Thread(target=_sample_stacks, args=(threading.get_ident(),), daemon=True).start()
+    if args.profile_memory:
+        tracemalloc.start(PROFILE_FRAMES)
+        threading.Thread(target=_watch_memory, args=(threading.get_ident(),), daemon=True).start()
+    get_logger('metrics').info(f"Profiling to {out}")
+
+def profile_cli():
+    """For entry points with no other options: parse --profile / --profile-memory / --profile-dir and start profiling."""
+    args = add_profile_args(argparse.ArgumentParser()).parse_args()
+    start_profiling(args)
+    return args
+
+def _sample_stacks(thread_id: int) -> None:
+    """
+    Wall-clock sampler: every PROFILE_INTERVAL count the stacks of the main thread and of any other thread
+    running Python (e.g. polars calling map_elements UDFs) under each open stage.
+    """
+    me = threading.get_ident()
+    while True:
+        time.sleep(PROFILE_INTERVAL)
+        stages = list(_metric_stack)
+        frames = sys._current_frames()
+        if thread_id not in frames:
+            return
+        if not stages:
+            continue
+        stacks = []
+        for ident, frame in frames.items():
+            if ident == me:
+                continue
+            stack = ';'.join(f"{f.f_code.co_name} ({Path(f.f_code.co_filename).name}:{f.f_code.co_firstlineno})"
+                             for f, _ in reversed(list(traceback.walk_stack(frame))))
+            stacks.append(stack if ident == thread_id else f"[thread];{stack}")
+        with _profile['lock']:
+            for i in range(len(stages)):
+                for stack in stacks:
+                    _profile['samples']['/'.join(stages[:i + 1]), stack] += 1
+
+def _watch_memory(thread_id: int) -> None:
+    """Snapshot the innermost open stage whenever its traced memory grows past 1.1x its highest snapshot so far."""
+    while thread_id in sys._current_frames():
+        time.sleep(PROFILE_INTERVAL * 10)
+        if not _profile['open']:
+            continue
+        entry = _profile['open'][-1]
+        current, _ = tracemalloc.get_traced_memory()
+        if 'start' in entry and current - entry['start'] > max(1e6, 1.1 * entry.get('peak_seen', 0)):
+            entry.update(peak_snapshot=_memory_snapshot(), peak_seen=current - entry['start'])
+
+def _memory_snapshot():
+    # leave out what the profilers themselves allocate
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, cProfile, pstats, traceback)
+    ])
+
+def _profile_enter() -> None:
+    # one cProfile.Profile per stage; the parent's is paused while a child runs and merged with it on exit
+    entry = {'children': [], 'peak': 0}
+    if _profile['cpu']:
+        if _profile['open']:
+            _profile['open'][-1]['prof'].disable()
+        entry['prof'] = cProfile.Profile()
+    if _profile['memory']:
+        current, peak = tracemalloc.get_traced_memory()
+        if _profile['open']:
+            parent = _profile['open'][-1]
+            parent['peak'] = max(parent['peak'], peak)
+        tracemalloc.reset_peak()
+        entry.update(start=current, snapshot=_memory_snapshot())
+    _profile['open'].append(entry)
+    if _profile['cpu']:
+        entry['prof'].enable()
+
+def _profile_exit(record: dict) -> None:
+    entry = _profile['open'].pop()
+    if _profile['cpu']:
+        entry['prof'].disable()
+    stage = record['stage']
+    name = stage.replace('/', '.')
+    _profile['names'][name] += 1
+    if _profile['names'][name] > 1:
+        name += f".{_profile['names'][name]}"
+    base = _profile['dir'] / name
+    parent = _profile['open'][-1] if _profile['open'] else None
+    if _profile['cpu']:
+        stats = pstats.Stats(entry['prof'])
+        for child in entry['children']:
+            stats.add(child)
+        stats.dump_stats(f'{base}.pstats')
+        with _profile['lock']:
+            stacks = {k: v for k, v in _profile['samples'].items() if k[0] == stage}
+            for k in stacks:
+                del _profile['samples'][k]
+        Path(f'{base}.collapsed').write_text(''.join(f"{stack} {count}\n" for (_, stack), count in stacks.items()))
+        record['profile'] = f'{base}.pstats'
+        if parent:
+            parent['children'].append(stats)
+    if _profile['memory']:
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(entry['peak'], peak)
+        snapshot = _memory_snapshot()
+        largest = lambda snap: [
+            f"{d.size_diff / 1e6:+9.2f} MB {d.count_diff:+8d} blocks  " + ' < '.join(f"{Path(f.filename).name}:{f.lineno}" for f in reversed(d.traceback))
+            for d in sorted(snap.compare_to(entry['snapshot'], 'traceback'), key=lambda d: -d.size_diff)[:PROFILE_TOP]
+        ]
+        retained = largest(snapshot)
+        at_peak = largest(entry['peak_snapshot']) if 'peak_snapshot' in entry else []
+        lines = [
+            f"stage {stage}",
+            f"traced peak {(peak - entry['start']) / 1e6:.1f} MB above start, {(current - entry['start']) / 1e6:+.1f} MB retained at exit",
+            f"process max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB (includes polars/arrow buffers, which tracemalloc does not see)",
+            '',
+            f"largest sites near the peak, innermost frame first (snapshot at +{entry.get('peak_seen', 0) / 1e6:.1f} MB):" if at_peak else "no snapshot near the peak (stayed under 1 MB)",
+            *at_peak,
+            '',
+            'largest sites retained at exit:',
+            *retained,
+        ]
+        Path(f'{base}.mem.txt').write_text('\n'.join(lines) + '\n')
+        record['traced_peak_mb'] = round((peak - entry['start']) / 1e6, 1)
+        if parent:
+            parent['peak'] = max(parent['peak'], peak)
+            if entry.get('peak_seen', 0) + entry['start'] - parent['start'] > parent.get('peak_seen', 0):
+                parent.update(peak_snapshot=entry['peak_snapshot'], peak_seen=entry['peak_seen'] + entry['start'] - parent['start'])
+        top = (at_peak or retained)[:1]
+        if top:
+            get_logger('metrics').info(f"{stage}: traced peak {record['traced_peak_mb']} MB, top: {top[0].strip()}")
+    if parent and _profile['cpu']:
+        parent['prof'].enable()
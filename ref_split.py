@@ -0,0 +1,224 @@
+import re
+from bisect import bisect_left
+from functools import partial
+from typing import Optional, Tuple
+import polars as pl
+
+from helpers import map_chunks
+
+"""
+Reference-section splitter shared by the getid variants.
+- The header regex runs once over the text; the old code rescanned fresh text[:idx].strip() copies
+  up to three times
+- Without a header, lines are tokenized once and the first-citation and citation-run rules both
+  read the same per-line flags (the old code ran splitlines three times)
+- split_point returns where the references start: body = text[:cut].strip(), refs = text[cut:].strip()
+- split_offsets fans the corpus out to a process pool in chunks, keeping row order, and only ships four ints
+  per article back; split_columns / split_lazy (get_splits / get_splits_lazy of the variants) slice body/ref
+  from them with polars, so every caller takes the same workers option, or one helpers.process_pool executor
+  that a whole run reuses
+- The old implementation is kept as reference_split; check_ref_split.py compares the two
+"""
+
+# line breaks str.splitlines honours besides \n
+LINE_BREAKS_RE = re.compile(r'[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+def strip_bounds(text: str, lo: int, hi: int) -> Tuple[int, int]:
+    """Bounds of text[lo:hi].strip() without copying."""
+    while lo < hi and text[lo].isspace():
+        lo += 1
+    while hi > lo and text[hi - 1].isspace():
+        hi -= 1
+    return lo, hi
+
+def last_header(header_patterns: list[re.Pattern], text: str, lo: int, hi: int) -> Optional[int]:
+    # as before: the last pattern with any match wins, not the rightmost match
+    last_match_idx = None
+    for pattern in header_patterns:
+        for m in pattern.finditer(text, lo, hi):
+            last_match_idx = m.start()
+    return last_match_idx
+
+def header_cut(text: str, header_patterns: list[re.Pattern]) -> Optional[int]:
+    starts = [[m.start() for m in pattern.finditer(text)] for pattern in header_patterns]
+
+    def last_before(end):
+        last_match_idx = None
+        for s in starts:
+            i = bisect_left(s, end)
+            if i:
+                last_match_idx = s[i - 1]
+        return last_match_idx
+
+    cut = last_before(len(text) + 1)
+    if cut is None:
+        return None
+    # the old code looked for up to two earlier headers, each time in text[:cut].strip()
+    for _ in range(2):
+        lo, hi = strip_bounds(text, 0, cut)
+        if lo == 0:
+            # cut is a header start, and cutting there leaves every earlier match as it was
+            idx = last_before(hi)
+        else:
+            # leading whitespace: the old code used an index into the stripped copy as an index
+            # into text, so the cut no longer sits on a header; rescan that prefix as it did
+            idx = last_header(header_patterns, text, lo, hi)
+            idx = None if idx is None else idx - lo
+        if idx is None:
+            break
+        cut = idx
+    return cut
+
+def line_cut(text: str, patterns: dict) -> Optional[int]:
+    lines = text.splitlines(keepends=True)
+    stripped = [line.strip() for line in lines]
+    citation = [bool(patterns['citation_pattern'].match(s)) for s in stripped]
+    n = len(lines)
+
+    ref_start_line = None
+    for i, s in enumerate(stripped):
+        if s[:1] in '[(1' and any(p.match(s) for p in patterns['first_citation_patterns']):
+            if any(citation[i + 1:i + 3]):
+                ref_start_line = i
+    if ref_start_line is None:
+        for i in range(int(n * 0.5), n):
+            if citation[i] and sum(citation[i:i + 3]) >= 2:
+                ref_start_line = max(0, i - 10)
+                for j in range(i, max(-1, i - 10), -1):
+                    if not citation[j]:
+                        ref_start_line = j + 1
+                        break
+                break
+    if ref_start_line is None:
+        return None
+    return sum(len(line) for line in lines[:ref_start_line])
+
+def split_point(text: str, patterns: dict) -> int:
+    cut = header_cut(text, patterns['ref_header_patterns'])
+    if cut is None:
+        cut = line_cut(text, patterns)
+    return len(text) if cut is None else cut
+
+def split_references(text: str, patterns: dict) -> Tuple[str, str]:
+    cut = header_cut(text, patterns['ref_header_patterns'])
+    if cut is not None:
+        return text[:cut].strip(), text[cut:].strip()
+    cut = line_cut(text, patterns)
+    if cut is None:
+        return text.strip(), ''
+    if LINE_BREAKS_RE.search(text):
+        # the old code rejoined lines with \n
+        return '\n'.join(text[:cut].splitlines()).strip(), '\n'.join(text[cut:].splitlines()).strip()
+    return text[:cut].strip(), text[cut:].strip()
+
+SPLIT_CHUNK_SIZE = 32  # articles per pool task
+SPLIT_BOUNDS_SCHEMA = {'body_start': pl.Int64, 'body_end': pl.Int64, 'ref_start': pl.Int64, 'ref_end': pl.Int64}
+
+def split_bounds(text: str, patterns: dict) -> Tuple[int, int, int, int]:
+    """(body_start, body_end, ref_start, ref_end): body = text[body_start:body_end], same for ref."""
+    cut = split_point(text, patterns)
+    return (*strip_bounds(text, 0, cut), *strip_bounds(text, cut, len(text)))
+
+def bounds_chunk(patterns: dict, texts: list[str]) -> list[Tuple[int, int, int, int]]:
+    return [split_bounds(text, patterns) for text in texts]
+
+def split_offsets(df: pl.DataFrame, patterns: dict, workers: int = 1, chunk_size: int = SPLIT_CHUNK_SIZE, executor=None) -> pl.DataFrame:
+    """
+    Adds body_start/body_end/ref_start/ref_end, in row order.
+    Slices are of the text as-is: unlike split_references, \\r-style line breaks are not rewritten to \\n.
+    workers=0 uses every core; polars' own pool is idle while this runs, but keep workers + POLARS_MAX_THREADS
+    within the core count if other polars work runs alongside. A helpers.process_pool executor, when given, is
+    reused instead of starting workers for this call.
+    """
+    bounds = map_chunks(partial(bounds_chunk, patterns), df['text'].to_list(), workers, chunk_size, executor)
+    return df.with_columns(pl.DataFrame(bounds, schema=SPLIT_BOUNDS_SCHEMA, orient='row'))
+
+def slice_splits(df: pl.DataFrame) -> pl.DataFrame:
+    """body/ref columns from the split_offsets columns."""
+    return df.with_columns(
+        pl.col('text').str.slice(pl.col('body_start'), pl.col('body_end') - pl.col('body_start')).alias('body'),
+        pl.col('text').str.slice(pl.col('ref_start'), pl.col('ref_end') - pl.col('ref_start')).alias('ref'),
+    )
+
+def split_columns(df: pl.DataFrame, patterns: dict, workers: int = 1, chunk_size: int = SPLIT_CHUNK_SIZE, executor=None) -> pl.DataFrame:
+    """
+    Adds body/ref exactly as split_references returns them, in row order.
+    The pool only runs split_offsets and polars slices body/ref; texts with \\r-style line breaks, whose split
+    split_references may rewrite, are split again with split_references here.
+    """
+    df = slice_splits(split_offsets(df, patterns, workers, chunk_size, executor)).drop(list(SPLIT_BOUNDS_SCHEMA))
+    redo = df['text'].str.contains(LINE_BREAKS_RE.pattern).arg_true()
+    if not len(redo):
+        return df
+    splits = [split_references(text, patterns) for text in df['text'].gather(redo)]
+    return df.with_columns(
+        df['body'].scatter(redo, [body for body, _ in splits]),
+        df['ref'].scatter(redo, [ref for _, ref in splits]),
+    )
+
+def split_lazy(lf: pl.LazyFrame, patterns: dict, workers: int = 1, chunk_size: int = SPLIT_CHUNK_SIZE, executor=None) -> pl.LazyFrame:
+    """
+    Lazy counterpart of split_columns: every batch the engine hands over goes through split_columns. Pass an
+    executor (helpers.process_pool) with workers > 1, or every batch starts and stops its own pool.
+    """
+    schema = {**lf.collect_schema(), 'body': pl.String, 'ref': pl.String}
+    return lf.map_batches(partial(split_columns, patterns=patterns, workers=workers, chunk_size=chunk_size, executor=executor),
+                          schema=schema, streamable=True)
+
+# ---- previous implementation, kept as the reference ----
+
+def find_last_reference_header(text: str, header_patterns: list[re.Pattern]) -> Optional[int]:
+    last_match_idx = None
+    for pattern in header_patterns:
+        matches = list(pattern.finditer(text))
+        if matches:
+            last_match_idx = matches[-1].start()
+    return last_match_idx
+
+def find_last_first_citation(text: str, patterns: dict) -> Optional[int]:
+    lines = text.splitlines()
+    last_match_line = None
+    for line_num, line in enumerate(lines):
+        line = line.strip()
+        for pattern in patterns['first_citation_patterns']:
+            if pattern.match(line):
+                next_lines = lines[line_num:line_num+3]
+                if any(patterns['citation_pattern'].match(l.strip()) for l in next_lines[1:]):
+                    last_match_line = line_num
+                break
+    return last_match_line
+
+def find_reference_start(text: str, patterns: dict) -> Optional[int]:
+    lines = text.splitlines()
+    last_first_citation = find_last_first_citation(text, patterns)
+    if last_first_citation is not None:
+        return last_first_citation
+    start_search_idx = int(len(lines) * 0.5)
+    for i in range(start_search_idx, len(lines)):
+        line = lines[i].strip()
+        if patterns['citation_pattern'].match(line):
+            next_lines = lines[i:i+3]
+            if sum(1 for l in next_lines if patterns['citation_pattern'].match(l.strip())) >= 2:
+                for j in range(i, max(-1, i-10), -1):
+                    if not patterns['citation_pattern'].match(lines[j].strip()):
+                        return j + 1
+                return max(0, i-10)
+    return None
+
+def reference_split(text: str, patterns: dict) -> Tuple[str, str]:
+    header_idx = find_last_reference_header(text, patterns['ref_header_patterns'])
+    if header_idx is not None:
+        header_idx2 = find_last_reference_header(text[:header_idx].strip(), patterns['ref_header_patterns'])
+        if header_idx2 is not None:
+            header_idx3 = find_last_reference_header(text[:header_idx2].strip(), patterns['ref_header_patterns'])
+            if header_idx3 is not None:
+                return text[:header_idx3].strip(), text[header_idx3:].strip()
+            return text[:header_idx2].strip(), text[header_idx2:].strip()
+        return text[:header_idx].strip(), text[header_idx:].strip()
+    ref_start_line = find_reference_start(text, patterns)
+    if ref_start_line is not None:
+        lines = text.splitlines()
+        body = '\n'.join(lines[:ref_start_line])
+        refs = '\n'.join(lines[ref_start_line:])
+        return body.strip(), refs.strip()
+    return text.strip(), ''
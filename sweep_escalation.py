@@ -0,0 +1,82 @@
+import argparse
+import math
+from helpers import *
+from profiling import path_bytes
+from llm_validate import build_df, cached_scores, cascade, logprob_columns
+
+"""
+Margin sweep for llm_validate's two-model escalation: python sweep_escalation.py --small-model-path ./models/qwen2.5-0.5b
+- The windows the cascade routes to the LLM are scored by both models (through the decision cache, so a second
+  sweep costs nothing), then every --margins value is replayed: small model where its margin >= threshold,
+  large model below
+- compute saved = 1 - (cost_ratio * windows + escalated) / windows, in units of one large-model window;
+  cost_ratio defaults to the weight-size ratio of the two model directories (CPU inference is memory bound)
+- f1 is the DOI F1 of the rule tiers + model decisions against train_labels.csv (empty without labels);
+  agreement is the share of windows decided as the large model alone would
+"""
+
+l = get_logger()
+
+def doi_f1(pred: pl.DataFrame, gt: pl.DataFrame) -> float:
+    tp = gt.join(pred, on=['article_id', 'dataset_id']).height
+    fp, fn = pred.height - tp, gt.height - tp
+    return 2 * tp / (2 * tp + fp + fn) if tp + fp + fn else 0.0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--extracted', type=str, default='./temp/extracted.parquet')
+    parser.add_argument('--small-model-path', type=str, required=True)
+    parser.add_argument('--model-path', type=str, default='./models/qwen2.5')
+    parser.add_argument('--backend', choices=['transformers', 'vllm'], default='transformers')
+    parser.add_argument('--dtype', type=str, default='float32')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--cache', type=str, default='./temp/llm_cache.sqlite')
+    parser.add_argument('--margins', type=float, nargs='+', default=[0, 0.5, 1, 1.5, 2, 3, 4, 6, 8, math.inf])
+    parser.add_argument('--cost-ratio', type=float, default=None, help='Small / large model cost per window (default: weight size ratio)')
+    parser.add_argument('--output', type=str, default='./temp/escalation_sweep.csv')
+    args = parser.parse_args()
+
+    df = cascade(build_df(args.extracted, '/dev/null'))
+    rules = df.filter(pl.col('tier') != 'llm')
+    routed = df.filter(pl.col('tier') == 'llm')
+    windows = routed['window'].to_list()
+    options = dict(backend=args.backend, dtype=args.dtype, batch_size=args.batch_size, cache_path=args.cache or None)
+    routed = routed.with_columns(
+        *logprob_columns(cached_scores(windows, args.small_model_path, **options), 'small_'),
+        *logprob_columns(cached_scores(windows, args.model_path, **options), 'large_'),
+    ).with_columns(margin=(pl.col('small_logprob_a') - pl.col('small_logprob_b')).abs())
+
+    cost_ratio = args.cost_ratio or path_bytes(args.small_model_path) / max(path_bytes(args.model_path), 1)
+    labels = COMP_DIR / 'train_labels.csv'
+    gt = None
+    if labels.exists():
+        gt = pl.read_csv(labels).filter((pl.col('type') != 'Missing') & is_doi_link('dataset_id')).select('article_id', 'dataset_id').unique()
+    else:
+        l.warning(f"{labels} not found, reporting agreement with the large model only")
+
+    n = max(routed.height, 1)
+    large_type = pl.col('large_logprob_a') >= pl.col('large_logprob_b')
+    rows = []
+    for threshold in args.margins:
+        escalate = pl.col('margin') < threshold
+        decided = routed.with_columns(type=pl.when(escalate).then(large_type).otherwise(pl.col('small_logprob_a') >= pl.col('small_logprob_b')), escalated=escalate)
+        escalated = decided['escalated'].sum()
+        pred = pl.concat([rules, decided], how='diagonal').filter(pl.col('type')).select('article_id', 'dataset_id').unique()
+        rows.append({
+            'margin': threshold,
+            'escalated': escalated,
+            'escalated_share': escalated / n,
+            'compute_saved': 1 - (cost_ratio * routed.height + escalated) / n,
+            'agreement': (decided['type'] == decided.select(large_type)[:, 0]).mean(),
+            'f1': doi_f1(pred, gt) if gt is not None else None,
+        })
+    report = pl.DataFrame(rows)
+    report.write_csv(args.output)
+    l.info(f"{routed.height} windows routed to the LLM, cost ratio small/large {cost_ratio:.3f}")
+    for r in rows:
+        f1 = f"{r['f1']:.4f}" if r['f1'] is not None else '-'
+        l.info(f"margin < {r['margin']:<5} escalated {r['escalated']:>6} ({r['escalated_share']:6.1%})  compute saved {r['compute_saved']:6.1%}  "
+               f"agreement {r['agreement']:.3f}  doi f1 {f1}")
+    l.info(f"Sweep saved to {args.output}")
+
+if __name__=='__main__': main()